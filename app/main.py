@@ -1,9 +1,104 @@
 # app/main.py
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, Response
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
+from pydantic import BaseModel
+import asyncio
+import json
+import os
+import time
+import uuid
+from app.services.database import get_reference_data, reload_reference_data
+from app.services.http import close_http_client
+from app.services.codes import get_code_engine
+from app.services.bill_analyzer import (
+    stream_medical_bill_analysis, analyze_bill as run_bill_analysis, analyze_medical_bill, bill_input_error,
+    prefetch_batch,
+)
+from app.services.jobs import job_queue, JobQueueFull
+from app.services.pricing import (
+    MAX_BULK_PRICING_BYTES, PricingInputError, columns_to_csv, columns_to_json, parse_csv_columns, price_columns
+)
+from app.services.results import idempotency_key, is_complete, result_store
+from app.services.extraction import shutdown_executor
+from app.services.telemetry import (
+    http_request_seconds, log_error, log_event, new_request_id, render_prometheus, request_id_var
+)
+from app.services.uploads import (
+    ingest_uploads, purge_spool, UploadTooLarge, UploadRejected, MAX_REQUEST_UPLOAD_BYTES
+)
+
+# How often (seconds) to check the reference databases for changes on disk
+RELOAD_INTERVAL = float(os.getenv("REFERENCE_DATA_RELOAD_INTERVAL", "30"))
+
+# Startup steps that ran, with the seconds each took. /readyz waits for the
+# required ones; the rest only make the first requests that need them faster.
+startup_steps: Dict[str, float] = {}
+READY_STEPS = ("job_queue", "reference_data")
+shutting_down = False
+
+def import_sdks():
+    """Import the upstream SDKs ahead of the first request that calls one"""
+    import httpx, anthropic, openai  # noqa: F401
+
+async def run_startup_step(name: str, work):
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(work)
+    except Exception as e:
+        # Not fatal: whatever failed is loaded again on first use
+        log_error("startup_step_failed", e, step=name)
+        return
+    startup_steps[name] = round(time.perf_counter() - start, 4)
+    log_event("startup_step", step=name, seconds=startup_steps[name])
+
+async def watch_reference_data():
+    """Swap in a new reference-data snapshot whenever the source files change"""
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL)
+        try:
+            await asyncio.to_thread(reload_reference_data)
+        except Exception as e:
+            log_error("reference_reload_failed", e)
+
+async def purge_upload_spool():
+    """Drop spooled uploads that have not been seen for a while"""
+    while True:
+        try:
+            await asyncio.to_thread(purge_spool)
+        except Exception as e:
+            log_error("upload_purge_failed", e)
+        await asyncio.sleep(3600)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global shutting_down
+    await job_queue.start()
+    startup_steps["job_queue"] = 0.0
+    # Start serving straight away and warm up in the background; /readyz
+    # turns 200 once the reference data is in. A request arriving before
+    # that loads it itself.
+    warmup = [
+        asyncio.create_task(run_startup_step("reference_data", get_reference_data)),
+        asyncio.create_task(run_startup_step("search_index", lambda: get_code_engine().search_index())),
+        asyncio.create_task(run_startup_step("sdk_imports", import_sdks)),
+    ]
+    watcher = asyncio.create_task(watch_reference_data()) if RELOAD_INTERVAL > 0 else None
+    purger = asyncio.create_task(purge_upload_spool())
+    yield
+    shutting_down = True
+    await job_queue.stop()
+    purger.cancel()
+    for task in warmup:
+        task.cancel()
+    if watcher is not None:
+        watcher.cancel()
+    await close_http_client()
+    shutdown_executor()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS to allow requests from your Next.js app
 app.add_middleware(
@@ -13,6 +108,111 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # Reject oversized uploads before the multipart body is parsed. Bulk
+    # pricing takes whole audit CSVs and has its own, larger limit.
+    limit = MAX_BULK_PRICING_BYTES if request.url.path == "/api/pricing/bulk" else MAX_REQUEST_UPLOAD_BYTES
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        return JSONResponse(status_code=413, content={"detail": "Upload too large"})
+    return await call_next(request)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Every log line and upstream call made for this request carries its ID
+    request_id = new_request_id(request.headers.get("x-request-id"))
+    token = request_id_var.set(request_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        # Streaming responses are timed to their first byte
+        elapsed = time.perf_counter() - start
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        http_request_seconds.observe(elapsed, method=request.method, route=route_path, status=status)
+        log_event("request", method=request.method, path=route_path, status=status, seconds=round(elapsed, 4))
+        request_id_var.reset(token)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and its event loop is responding"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: startup finished and not shutting down, so send traffic here"""
+    pending = [step for step in READY_STEPS if step not in startup_steps]
+    ready = not pending and not shutting_down
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "pending": pending, "shutting_down": shutting_down, "startup_seconds": startup_steps},
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/codes/search")
+async def search_codes(q: str, limit: int = 10):
+    """CPT/HCPCS codes matching a code prefix or description words, best first"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Empty query")
+    if not 1 <= limit <= 50:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 50")
+    return {"query": q, "results": get_code_engine().search(q, limit)}
+
+@app.post("/api/pricing/bulk")
+async def bulk_pricing(request: Request, format: str = "json"):
+    """
+    Price many claim lines against the Medicare fee schedule. Accepts a CSV
+    body (text/csv, or a multipart "file") with code, billed and optional
+    quantity and date columns, or JSON columns {"code": [...], "billed": [...], ...}.
+    """
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="format must be json or csv")
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise PricingInputError('Upload the claim lines as a "file" field')
+            columns = parse_csv_columns((await upload.read()).decode("utf-8-sig"))
+        elif content_type.startswith("application/json"):
+            columns = await request.json()
+            if not isinstance(columns, dict):
+                raise PricingInputError("Expected an object of columns")
+        else:
+            columns = parse_csv_columns((await request.body()).decode("utf-8-sig"))
+        # Millions of lines take a while; keep the event loop free meanwhile
+        result = await asyncio.to_thread(price_columns, columns)
+    except (PricingInputError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Serialized in a thread too; jsonable_encoder would walk every cell on the loop
+    if format == "csv":
+        return Response(await asyncio.to_thread(columns_to_csv, result), media_type="text/csv")
+    # allow_nan=False: a stray NaN fails here rather than reaching clients as invalid JSON
+    body = await asyncio.to_thread(
+        lambda: json.dumps(columns_to_json(result), separators=(",", ":"), allow_nan=False))
+    return Response(body, media_type="application/json")
+
+async def receive_uploads(files):
+    """Spool the request's files to disk, mapping limit violations to HTTP errors"""
+    try:
+        return await ingest_uploads(files)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # app/main.py
 @app.post("/api/analyze")
 async def analyze_bill(
@@ -21,48 +221,119 @@ async def analyze_bill(
     lastName: str = Form(...),
     dateOfBirth: str = Form(...)
 ):
+    uploads = await receive_uploads(files)
+    user_input = {
+        "patient_info": {
+            "first_name": firstName,
+            "last_name": lastName,
+            "date_of_birth": dateOfBirth
+        },
+        "uploads": uploads
+    }
+    # Resubmissions of the same bill get the stored analysis, or join the run in progress
+    key = idempotency_key(user_input["patient_info"], [upload.sha256 for upload in uploads])
     try:
-        demo_analysis = {
-            "summary": f"Analysis for {firstName} {lastName}",
-            "details": {
-                "code_validation": {
-                    "valid_codes": [
-                        {"code": "86152", "description": "Cell enumeration & id", "type": "CPT"},
-                        {"code": "B002", "description": "X-ray", "type": "HCPCS"}
-                    ],
-                    "invalid_codes": [],
-                    "discrepancies": ["Minor pricing variance noted"],
-                    "upcoding_risks": ["None detected"],
-                    "errors": []
-                },
-                "ucr_validation": {
-                    "procedure_analysis": [
-                        {
-                            "code": "86152",
-                            "description": "Cell enumeration & id",
-                            "billed_cost": 300,
-                            "medicare_rate": 250,
-                            "ucr_rate": 275,
-                            "is_reasonable": True,
-                            "comments": "Within acceptable range"
-                        }
-                    ],
-                    "overall_assessment": "The charges appear to be within reasonable ranges",
-                    "recommendations": ["Keep records for your files", "No immediate action needed"],
-                    "references": [  # Add this references array
-                        "Medicare Fee Schedule 2024",
-                        "National UCR Database",
-                        "Healthcare Bluebook"
-                    ]
-                }
-            }
-        }
-        
-        return {"analysis": demo_analysis}
-
+        analysis = await result_store.get_or_compute(
+            key, lambda: analyze_medical_bill(user_input), store_if=is_complete)
     except Exception as e:
-        print(f"Error processing request: {str(e)}")
+        log_error("analyze_failed", e)
         raise HTTPException(status_code=500, detail=str(e))
+    return {"analysis": analysis, "files": [upload.metadata() for upload in uploads], "idempotency_key": key}
+
+@app.get("/api/analyses/{key}")
+async def get_analysis(key: str):
+    """
+    A stored analysis by the idempotency_key /api/analyze returned. The key
+    is the only credential: whoever has it can read the analysis.
+    """
+    analysis = await result_store.get(key)
+    if analysis is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return {"analysis": analysis, "idempotency_key": key}
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/api/analyze/stream")
+async def analyze_bill_stream(
+    files: List[UploadFile] = File(...),
+    firstName: str = Form(...),
+    lastName: str = Form(...),
+    dateOfBirth: str = Form(...)
+):
+    """Server-Sent Events variant of /api/analyze: one event per stage as it finishes"""
+    uploads = await receive_uploads(files)
+    user_input = {
+        "patient_info": {
+            "first_name": firstName,
+            "last_name": lastName,
+            "date_of_birth": dateOfBirth
+        },
+        "uploads": uploads
+    }
+
+    async def events():
+        try:
+            yield sse_event("files", [upload.metadata() for upload in uploads])
+            async for event, data in stream_medical_bill_analysis(user_input):
+                yield sse_event(event, data)
+        except Exception as e:
+            log_error("stream_failed", e)
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class BatchRequest(BaseModel):
+    bills: List[Dict[str, Any]]
+
+# Keep references to running batch tasks so they are not garbage collected
+batch_tasks = set()
+
+async def run_batch(bills, job_ids):
+    # Other workers answer polls for these jobs from the shared store
+    for job_id in job_ids:
+        await job_queue.publish(job_id)
+    try:
+        await prefetch_batch(bills)
+    except Exception as e:
+        # Not fatal: each bill's stages look up whatever is still missing
+        log_error("batch_prefetch_failed", e, bills=len(bills))
+    for bill, job_id in zip(bills, job_ids):
+        job_queue.enqueue(job_id, lambda bill=bill: run_bill_analysis(bill))
+
+@app.post("/api/analyze/batch", status_code=202)
+async def analyze_batch(request: BatchRequest):
+    """Queue many bills for analysis; poll /api/jobs/{id} for each result"""
+    if not request.bills:
+        raise HTTPException(status_code=400, detail="No bills submitted")
+    # Reject malformed bills now rather than as failed jobs later
+    for index, bill in enumerate(request.bills):
+        problem = bill_input_error(bill)
+        if problem is not None:
+            raise HTTPException(status_code=400, detail=f"Bill {index} {problem}")
+    if job_queue.waiting + len(request.bills) > job_queue.max_queued:
+        raise HTTPException(status_code=503, detail="Job queue is full, retry later")
+
+    batch_id = uuid.uuid4().hex
+    try:
+        job_ids = [job_queue.create("analysis", batch_id=batch_id, index=index) for index in range(len(request.bills))]
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    task = asyncio.create_task(run_batch(request.bills, job_ids))
+    batch_tasks.add(task)
+    task.add_done_callback(batch_tasks.discard)
+    return {"batch_id": batch_id, "jobs": job_ids}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.find(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 if __name__ == "__main__":
     import uvicorn
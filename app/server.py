@@ -0,0 +1,165 @@
+# app/server.py
+#
+# Production launch mode: a supervisor process that forks N uvicorn workers
+# sharing one listening socket.
+#
+#   python -m app.server --workers 4 --port 8000
+#
+# The supervisor imports the app and the upstream SDKs and loads the
+# reference data and the code search index before forking, so workers start
+# warm and share those pages copy-on-write (the snapshot itself is
+# memory-mapped, so its pages are shared regardless). With more than one
+# worker the response caches and the job table default to one SQLite file
+# (CACHE_PATH): a result computed by any worker is a hit in all of them.
+# Stored analyses hold patient data and are only shared (and kept across
+# restarts) when RESULT_STORE_PATH is set.
+# Upstream rate limits are split between the workers. Workers that die are
+# restarted.
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import tempfile
+import time
+from pathlib import Path
+
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# A worker that dies sooner than this after starting is restarted only after
+# waiting as long, so one failing at startup does not fork in a tight loop
+RESTART_BACKOFF = float(os.getenv("WORKER_RESTART_BACKOFF", "1"))
+# Seconds a stopping worker waits for in-flight requests before closing them
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+STOP_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+
+def configure_environment(workers: int):
+    """Defaults read by the app modules at import, so set before importing them"""
+    # Upstream quotas are per account: each worker takes its share
+    os.environ["WORKER_PROCESSES"] = str(workers)
+    if workers > 1:
+        os.environ.setdefault("CACHE_PATH", str(Path(tempfile.gettempdir()) / "advocare-cache.sqlite3"))
+        # Every worker has its own PDF extraction pool; split the cores between them
+        os.environ.setdefault("EXTRACTION_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+def preload():
+    from app.main import app, import_sdks
+    from app.services.codes import get_code_engine
+    from app.services.database import get_reference_data
+    from app.services.telemetry import log_event
+
+    start = time.perf_counter()
+    get_reference_data()
+    get_code_engine().search_index()
+    import_sdks()
+    # What is loaded now lives as long as the process. Frozen objects are
+    # skipped by the collector, which would otherwise write to (and so
+    # copy) their pages in every worker.
+    gc.collect()
+    gc.freeze()
+    log_event("app_preloaded", seconds=round(time.perf_counter() - start, 3))
+    return app
+
+def bind(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+def serve(app, sock: socket.socket, log_level: str):
+    import uvicorn
+
+    config = uvicorn.Config(app, log_level=log_level, timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
+    uvicorn.Server(config).run(sockets=[sock])
+
+class Supervisor:
+    """Forks the workers, restarts any that exit and stops them all on SIGTERM or SIGINT"""
+
+    def __init__(self, app, sock: socket.socket, workers: int, log_level: str):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self.running = {}
+        self.stopping = False
+
+    def spawn(self, slot: int):
+        from app.services.telemetry import log_error, log_event
+
+        # Hold stop signals across the fork: a child must not run the
+        # supervisor's handler it inherits, only the default one (or uvicorn's)
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        pid = os.fork()
+        if pid == 0:
+            for sig in STOP_SIGNALS:
+                signal.signal(sig, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+            code = 0
+            try:
+                serve(self.app, self.sock, self.log_level)
+            except BaseException as e:
+                log_error("worker_failed", e, slot=slot)
+                code = 1
+            finally:
+                os._exit(code)
+        self.running[pid] = (slot, time.monotonic())
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        log_event("worker_started", pid=pid, slot=slot)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.running):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        from app.services.telemetry import log_event
+
+        for sig in STOP_SIGNALS:
+            signal.signal(sig, self.stop)
+        for slot in range(self.workers):
+            self.spawn(slot)
+        while self.running:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            if pid not in self.running:
+                continue
+            slot, started = self.running.pop(pid)
+            if self.stopping:
+                continue
+            log_event("worker_exited", logging.WARNING, pid=pid, slot=slot,
+                      exit_code=os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < RESTART_BACKOFF:
+                time.sleep(RESTART_BACKOFF)
+            if not self.stopping:
+                self.spawn(slot)
+        log_event("supervisor_stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes (default: $WEB_CONCURRENCY or 1)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    configure_environment(args.workers)
+    app = preload()
+    sock = bind(args.host, args.port, args.backlog)
+    if args.workers == 1:
+        serve(app, sock, args.log_level)
+    else:
+        Supervisor(app, sock, args.workers, args.log_level).run()
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,267 @@
 # services/bill_analyzer.py
-from typing import Dict, List, Any
-import json
-from .claude import analyze_with_claude
-from .perplexity import search_ucr_rates
-from .database import load_cpt_database, load_medicare_database  
+from typing import Dict, List, Any, Optional
+import asyncio
+import logging
+import math
+import os
+import time
+from .claude import structured_with_claude, stream_structured_with_claude
+from .perplexity import search_ucr_rates, bill_locality
+from .database import get_reference_data, medicare_rate_on, parse_payment_rate, parse_visit_date
+from .codes import suggest_codes, validate_codes
+from .extraction import extract_bill_items
+from .prompts import PromptBuilder, add_result, counted_values
+from .pricing import MEDICARE_REASONABLE_MULTIPLE, UCR_REASONABLE_MULTIPLE
+from .telemetry import log_error, log_event, stage_seconds
 
 # app/services/bill_analyzer.py
 
-async def ucr_validation(bill):
-    medicare_rates = await load_medicare_database()
-    discrepancies = []
-
-    for procedure in bill["billing_details"]["procedure_codes"]:
-        code = procedure["code"]
-        description = procedure["description"]
-        billed_cost = procedure["cost"]
+# Per-stage timeouts in seconds
+STAGE_TIMEOUTS = {
+    "code_validation": float(os.getenv("CODE_VALIDATION_TIMEOUT", "60")),
+    "ucr_validation": float(os.getenv("UCR_VALIDATION_TIMEOUT", "90")),
+    "explanation": float(os.getenv("EXPLANATION_TIMEOUT", "60")),
+}
 
-        if code in medicare_rates:
-            medicare_info = medicare_rates[code]
-            
-            discrepancies.append({
-                "code": code,
-                "description": medicare_info['description'],
-                "billed_cost": billed_cost,
-                "medicare_rate": medicare_info.get('payment_rate', 0),
-                "apc": medicare_info['apc'],
-                "code_found": True
-            })
-        else:
-            discrepancies.append({
-                "code": code,
-                "description": description,
-                "billed_cost": billed_cost,
-                "medicare_rate": "Not available in database",
-                "code_found": False
-            })
-
-    ucr_result = await search_ucr_rates(bill)
-
-    prompt = f"""
-    Analyze the following medical bill information:
-
-    Medicare Discrepancies:
-    {json.dumps(discrepancies, indent=2)}
-
-    UCR Information:
-    {ucr_result}
-
-    Provide your analysis in the following JSON format:
-    {{
-        "ucr_validation": {{
-            "procedure_analysis": [
-                {{
-                    "code": "...",
-                    "description": "...",
-                    "billed_cost": 0,
-                    "medicare_rate": 0,
-                    "ucr_rate": 0,
-                    "is_reasonable": true/false,
-                    "comments": "..."
-                }}
-            ],
-            "overall_assessment": "...",
-            "recommendations": ["..."]
-        }}
-    }}
+async def run_stage(name, coro, latency, errors):
+    """
+    Run one analysis stage under its timeout, recording how long it took.
+    Returns None instead of raising so the other stages can still report.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await asyncio.wait_for(coro, timeout=STAGE_TIMEOUTS[name])
+        outcome = "ok"
+        return result
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        errors[name] = f"Timed out after {STAGE_TIMEOUTS[name]}s"
+    except Exception as e:
+        errors[name] = str(e)
+    finally:
+        elapsed = time.perf_counter() - start
+        latency[name] = round(elapsed, 3)
+        stage_seconds.observe(elapsed, stage=name, outcome=outcome)
+    log_event("stage_failed", logging.ERROR, stage=name, error=errors[name], seconds=latency[name])
+    return None
+
+def _number(value, default: float) -> float:
+    """
+    A quantity or amount as extracted or submitted: a number, "2" or
+    "$1,234.50". Anything unreadable, or not finite, is default.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value if math.isfinite(value) else default
+    if not isinstance(value, str):
+        return default
+    amount = parse_payment_rate(value)
+    return float(amount) if amount is not None and amount.is_finite() else default
+
+def _compare(billed, expected):
+    """(ratio, difference, percentage difference) columns of billed vs. expected"""
+    ratio = [round(b / e, 3) if e else None for b, e in zip(billed, expected)]
+    difference = [round(b - e, 2) if e is not None else None for b, e in zip(billed, expected)]
+    percentage = [round((b - e) / e * 100, 1) if e else None for b, e in zip(billed, expected)]
+    return ratio, difference, percentage
+
+def price_lines(codes, quantities, billed, ucr_rates, medicare_rates=None, visit_dates=None) -> Dict[str, list]:
+    """
+    Deterministic pricing of many bill lines at once. Takes parallel columns
+    (billed is the line total) and returns result columns of the same length.
+    Lines with a visit date are priced by the fee schedule in effect then.
     """
+    data = get_reference_data()
+    if medicare_rates is None:
+        medicare_rates = data.medicare_rates
+    billed = [float(_number(b, 0.0)) for b in billed]
+    # Missing or zero quantities count as one unit
+    quantities = [_number(q, 1) or 1 for q in quantities]
+    if visit_dates is None or not data.rate_history:
+        medicare_info = [medicare_rates.get(code) for code in codes]
+    else:
+        medicare_info = [medicare_rate_on(code, visit_date, medicare_rates, data.rate_history)
+                         for code, visit_date in zip(codes, visit_dates)]
+    medicare = [float(i['payment_rate']) if i and i['payment_rate'] is not None else None for i in medicare_info]
+    expected_medicare = [round(r * q, 2) if r is not None else None for r, q in zip(medicare, quantities)]
+    expected_ucr = [round(r * q, 2) if r is not None else None for r, q in zip(ucr_rates, quantities)]
+    medicare_ratio, medicare_difference, medicare_percentage = _compare(billed, expected_medicare)
+    ucr_ratio, ucr_difference, ucr_percentage = _compare(billed, expected_ucr)
+
+    is_reasonable = []
+    for m_ratio, u_ratio in zip(medicare_ratio, ucr_ratio):
+        checks = []
+        if m_ratio is not None:
+            checks.append(m_ratio <= MEDICARE_REASONABLE_MULTIPLE)
+        if u_ratio is not None:
+            checks.append(u_ratio <= UCR_REASONABLE_MULTIPLE)
+        # None: no benchmark to judge the line against
+        is_reasonable.append(all(checks) if checks else None)
+
+    return {
+        "code": list(codes),
+        "quantity": quantities,
+        "billed_cost": billed,
+        "medicare_rate": medicare,
+        "apc": [i['apc'] if i else None for i in medicare_info],
+        "medicare_description": [i['description'] if i else None for i in medicare_info],
+        "medicare_effective_date": [i.get('effective_date') if i else None for i in medicare_info],
+        "expected_medicare": expected_medicare,
+        "medicare_ratio": medicare_ratio,
+        "medicare_difference": medicare_difference,
+        "medicare_percentage_difference": medicare_percentage,
+        "ucr_rate": list(ucr_rates),
+        "expected_ucr": expected_ucr,
+        "ucr_ratio": ucr_ratio,
+        "ucr_difference": ucr_difference,
+        "ucr_percentage_difference": ucr_percentage,
+        "is_reasonable": is_reasonable,
+    }
+
+def _line_comment(row) -> str:
+    if row["is_reasonable"] is None:
+        return "No Medicare or UCR benchmark available for this code"
+    parts = []
+    if row["medicare_ratio"] is not None:
+        parts.append(f"{row['medicare_ratio']}x the Medicare rate")
+    if row["ucr_ratio"] is not None:
+        parts.append(f"{row['ucr_ratio']}x the local UCR rate")
+    verdict = "Within the expected range" if row["is_reasonable"] else "Above the expected range"
+    return f"{verdict}: billed at " + " and ".join(parts)
+
+def summarize_pricing(procedures, columns) -> Dict[str, Any]:
+    """procedure_analysis rows, totals and a templated assessment for one bill"""
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    procedure_analysis = []
+    for procedure, row in zip(procedures, rows):
+        procedure_analysis.append({
+            "code": row["code"],
+            "description": row["medicare_description"] or procedure.get("description", ""),
+            "quantity": row["quantity"],
+            "billed_cost": row["billed_cost"],
+            "medicare_rate": row["medicare_rate"],
+            "expected_medicare": row["expected_medicare"],
+            "ucr_rate": row["ucr_rate"],
+            "expected_ucr": row["expected_ucr"],
+            "difference": row["medicare_difference"] if row["medicare_difference"] is not None else row["ucr_difference"],
+            "percentage_difference": row["medicare_percentage_difference"] if row["medicare_percentage_difference"] is not None else row["ucr_percentage_difference"],
+            "apc": row["apc"],
+            "medicare_effective_date": row["medicare_effective_date"],
+            "is_reasonable": row["is_reasonable"],
+            "comments": _line_comment(row),
+        })
 
-    result = await analyze_with_claude(prompt)
+    flagged = [line["code"] for line in procedure_analysis if line["is_reasonable"] is False]
+    unpriced = [line["code"] for line in procedure_analysis if line["is_reasonable"] is None]
+    totals = {
+        "billed": round(sum(columns["billed_cost"]), 2),
+        "expected_medicare": round(sum(e for e in columns["expected_medicare"] if e is not None), 2),
+        "expected_ucr": round(sum(e for e in columns["expected_ucr"] if e is not None), 2),
+    }
+    if flagged:
+        overall_assessment = f"{len(flagged)} of {len(procedure_analysis)} charges exceed the expected range: {', '.join(flagged)}."
+        recommendations = [
+            "Request an itemized bill and ask the provider to justify the flagged charges",
+            "Compare the flagged charges with your insurer's explanation of benefits",
+        ]
+    else:
+        overall_assessment = "All benchmarked charges are within the expected range."
+        recommendations = ["Keep records for your files"]
+    if unpriced:
+        overall_assessment += f" No benchmark was available for {', '.join(unpriced)}."
+    return {
+        "procedure_analysis": procedure_analysis,
+        "totals": totals,
+        "overall_assessment": overall_assessment,
+        "recommendations": recommendations,
+    }
+
+def bill_input_error(bill) -> Optional[str]:
+    """What is wrong with a submitted bill's structure, or None if it can be analyzed"""
+    if not isinstance(bill, dict):
+        return "must be an object"
+    for section in ("patient_info", "visit_info"):
+        if not isinstance(bill.get(section, {}), dict):
+            return f"{section} must be an object"
+    details = bill.get("billing_details")
+    if not isinstance(details, dict) or not isinstance(details.get("procedure_codes"), list):
+        return "has no billing_details.procedure_codes list"
+    if not details["procedure_codes"]:
+        return "has no procedure codes"
+    for line, procedure in enumerate(details["procedure_codes"]):
+        if not isinstance(procedure, dict):
+            return f"procedure {line} must be an object"
+        if not isinstance(procedure.get("code"), str) or not procedure["code"].strip():
+            return f"procedure {line} has no code"
+        if _number(procedure.get("cost"), None) is None:
+            return f"procedure {line} has no readable cost"
+    return None
+
+def price_bills(bills, ucr_rates_by_bill) -> List[Dict[str, Any]]:
+    """Price every line of many bills in a single columnar pass"""
+    codes, quantities, billed, ucr_rates, visit_dates = [], [], [], [], []
+    for bill, bill_ucr_rates in zip(bills, ucr_rates_by_bill):
+        visit_date = parse_visit_date(bill.get("visit_info", {}).get("date_of_visit"))
+        for procedure in bill["billing_details"]["procedure_codes"]:
+            code = procedure["code"].strip().upper()
+            codes.append(code)
+            quantities.append(procedure.get("quantity", 1))
+            billed.append(procedure["cost"])
+            ucr_rates.append(bill_ucr_rates.get(code))
+            # A line's own date of service wins over the bill's
+            visit_dates.append(parse_visit_date(procedure.get("date_of_service")) or visit_date)
+
+    columns = price_lines(codes, quantities, billed, ucr_rates, visit_dates=visit_dates)
+    results = []
+    start = 0
+    for bill in bills:
+        end = start + len(bill["billing_details"]["procedure_codes"])
+        bill_columns = {name: values[start:end] for name, values in columns.items()}
+        results.append(summarize_pricing(bill["billing_details"]["procedure_codes"], bill_columns))
+        start = end
+    return results
+
+async def ucr_validation(bill):
+    procedures = bill["billing_details"]["procedure_codes"]
+    ucr_rates = await search_ucr_rates([procedure["code"] for procedure in procedures], bill_locality(bill))
+    pricing = price_bills([bill], [ucr_rates])[0]
+
+    if all(line["is_reasonable"] is not None for line in pricing["procedure_analysis"]):
+        # Every line has a benchmark, so the verdicts are computed, not generated
+        return {"ucr_validation": pricing}
+
+    # Some codes have no benchmark at all; let Claude weigh in on those
+    result = await structured_with_claude("ucr_validation", ucr_validation_prompt(pricing))
     return {"ucr_validation": result}
 
-async def explanation_handler(results):
-    report = "Explanation Summary:\n"
+def ucr_validation_prompt(pricing):
+    # Lines without a benchmark go first so they survive truncation on very large bills
+    lines = sorted(pricing["procedure_analysis"], key=lambda line: line["is_reasonable"] is not None)
+    return (
+        PromptBuilder("ucr_validation")
+        .instructions("Analyze this medical bill's pricing. Lines with empty is_reasonable have no Medicare "
+                      "or UCR benchmark; judge those from the description.")
+        .instructions("Record your assessment of every line with the record_ucr_validation tool.")
+        .table("Pricing", lines, ["code", "description", "quantity", "billed_cost", "medicare_rate",
+                                  "ucr_rate", "is_reasonable"])
+        .build()
+    )
+
+def explanation_prompt(results):
+    builder = (
+        PromptBuilder("explanation")
+        .instructions("Analyze this medical bill report.")
+        .instructions("Record a structured explanation for the patient with the record_explanation tool.")
+    )
     for result in results:
         for key, value in result.items():
-            report += f"{key}: {value}\n"
-
-    prompt = f"""
-    Please analyze this medical bill report and provide a structured response:
-
-    {report}
-
-    Provide your analysis in the following JSON format:
-    {{
-        "summary": "Brief overview of findings",
-        "code_validation": {{
-            "issues_found": true/false,
-            "details": ["..."]
-        }},
-        "ucr_validation": {{
-            "concerns": ["..."],
-            "recommendations": ["..."]
-        }},
-        "overall_recommendation": "..."
-    }}
-    """
+            add_result(builder, key, value)
+    return builder.build()
 
-    return await analyze_with_claude(prompt)
+async def explanation_handler(results):
+    return await structured_with_claude("explanation", explanation_prompt(results))
 
-async def analyze_medical_bill(user_input):
+def build_demo_bill(user_input):
     # We'll use this sample bill for demo purposes
     demo_bill = {
         "patient_info": {
@@ -149,83 +312,182 @@ async def analyze_medical_bill(user_input):
         "notes": "Follow-up recommended in 2 weeks."
     }
 
-    try:
-        # Use the demo bill but update it with user's info
-        demo_bill["patient_info"].update({
+    # Use the demo bill but update it with user's info
+    demo_bill["patient_info"].update({
+        "name": f"{user_input['patient_info']['first_name']} {user_input['patient_info']['last_name']}",
+        "dob": user_input['patient_info']['date_of_birth']
+    })
+    return demo_bill
+
+async def build_bill(user_input):
+    """
+    The bill to analyze: line items extracted from the uploaded files, or
+    the demo bill when nothing could be extracted from them.
+    """
+    uploads = user_input.get("uploads") or []
+    items = await extract_bill_items(uploads) if uploads else None
+    if not items or not items["procedure_codes"]:
+        return build_demo_bill(user_input)
+
+    procedures = items["procedure_codes"]
+    total_cost = round(sum(procedure["cost"] for procedure in procedures), 2)
+    return {
+        "patient_info": {
             "name": f"{user_input['patient_info']['first_name']} {user_input['patient_info']['last_name']}",
             "dob": user_input['patient_info']['date_of_birth']
-        })
+        },
+        "visit_info": {"date_of_visit": items.get("date_of_visit")} if items.get("date_of_visit") else {},
+        "billing_details": {
+            "charges": total_cost,
+            "procedure_codes": procedures,
+            "total_cost": total_cost
+        },
+        "diagnoses": items["diagnoses"],
+        "source_files": [upload.sha256 for upload in uploads]
+    }
 
-        # Run the analyses using the demo bill
-        results = []
-        
-        # Code validation
-        code_result = await code_validation(demo_bill)
-        results.append(code_result)
-        
-        # UCR validation
-        ucr_result = await ucr_validation(demo_bill)
-        results.append(ucr_result)
+async def analyze_bill(bill):
+    """Run the full analysis pipeline on one bill"""
+    latency = {}
+    errors = {}
+    start = time.perf_counter()
 
-        # Final report
-        final_report = await explanation_handler(results)
-        
-        try:
-            return json.loads(final_report)
-        except json.JSONDecodeError:
-            return {"summary": final_report}
+    # Code and UCR validation are independent, so run them concurrently
+    code_result, ucr_result = await asyncio.gather(
+        run_stage("code_validation", code_validation(bill), latency, errors),
+        run_stage("ucr_validation", ucr_validation(bill), latency, errors),
+    )
+    results = [result for result in (code_result, ucr_result) if result is not None]
+    if not results:
+        raise Exception("; ".join(f"{stage}: {error}" for stage, error in errors.items()))
+
+    # Final report
+    final_report = await run_stage("explanation", explanation_handler(results), latency, errors)
+    latency["total"] = round(time.perf_counter() - start, 3)
+
+    if final_report is None:
+        analysis = {"summary": "The final explanation could not be generated."}
+        for result in results:
+            analysis.update(result)
+    else:
+        # A new dict: final_report is the response cache's stored value,
+        # shared with every request that hits it
+        analysis = {**final_report}
+
+    analysis["latency"] = latency
+    if errors:
+        analysis["errors"] = errors
+    return analysis
 
+async def analyze_medical_bill(user_input):
+    try:
+        return await analyze_bill(await build_bill(user_input))
     except Exception as e:
-        print(f"Error in analyze_medical_bill: {str(e)}")
+        log_error("analysis_failed", e)
         raise Exception(f"Analysis failed: {str(e)}")
 
-async def code_validation(bill):
-    icd_api = 'https://clinicaltables.nlm.nih.gov/api/icd10cm/v3/search'
-    hcpcs_api = 'https://clinicaltables.nlm.nih.gov/api/hcpcs/v3/search'
-    
-    cpt_codes = await load_cpt_database()
-    
-    invalid_codes = []
-    valid_codes = []
-
-    # Process the codes from the demo bill
-    for procedure in bill["billing_details"]["procedure_codes"]:
-        code = procedure["code"]
-        response = requests.get(icd_api, params={"terms": code, "sf": "code", "df": "code,name"})
-        if response.status_code == 200:
-            data = response.json()
-            if data[1]:  # Valid ICD-10 code
-                valid_codes.append({"code": code, "description": data[3][0][1], "type": "ICD-10"})
-            else:  # Try HCPCS
-                response = requests.get(hcpcs_api, params={"terms": code, "sf": "code", "df": "code,display"})
-                if response.status_code == 200:
-                    data = response.json()
-                    if data[1]:  # Valid HCPCS code
-                        valid_codes.append({"code": code, "description": data[3][0][1], "type": "HCPCS"})
-                    else:
-                        if code in cpt_codes:  # Check CPT
-                            valid_codes.append({"code": code, "description": cpt_codes[code], "type": "CPT"})
-                        else:
-                            invalid_codes.append(code)
-
-    prompt = (
-        f"Analyze the following procedure codes and check for any discrepancies:\n\n"
-        f"Valid Codes:\n{valid_codes}\n"
-        f"Invalid Codes:\n{invalid_codes}\n\n"
-        "Provide your analysis in the following JSON format:\n"
-        "{\n"
-        '  "code_validation": {\n'
-        '    "valid_codes": [{"code": "...", "description": "...", "type": "..."}],\n'
-        '    "invalid_codes": ["..."],\n'
-        '    "discrepancies": ["..."],\n'
-        '    "upcoding_risks": ["..."],\n'
-        '    "errors": ["..."]\n'
-        "  }\n"
-        "}\n\n"
+async def prefetch_batch(bills):
+    """
+    Resolve every distinct code of a batch once up front: one code-set pass
+    and one UCR lookup per locality, so the per-bill stages hit the caches.
+    """
+    codes_by_locality = {}
+    for bill in bills:
+        codes = codes_by_locality.setdefault(bill_locality(bill), set())
+        codes.update(procedure["code"] for procedure in bill["billing_details"]["procedure_codes"])
+    all_codes = sorted(set().union(*codes_by_locality.values()))
+    await asyncio.gather(
+        validate_codes(all_codes),
+        *(search_ucr_rates(sorted(codes), locality) for locality, codes in codes_by_locality.items()),
     )
+    return {"distinct_codes": len(all_codes), "localities": len(codes_by_locality)}
 
-    result = await analyze_with_claude(prompt)
-    return {"code_validation": result}
+async def stream_medical_bill_analysis(user_input):
+    """
+    Yield (event, data) pairs as each stage completes: local code validation,
+    the Medicare comparison, UCR rates, then the summary token by token.
+    """
+    start = time.perf_counter()
+    latency = {}
+    bill = await build_bill(user_input)
+    procedures = bill["billing_details"]["procedure_codes"]
+    codes = [procedure["code"] for procedure in procedures]
+    ucr_search = asyncio.create_task(search_ucr_rates(codes, bill_locality(bill)))
+
+    def elapsed():
+        return round(time.perf_counter() - start, 3)
+
+    try:
+        valid_codes, invalid_codes, unverified_codes = await validate_codes(codes)
+        code_result = {
+            "valid_codes": valid_codes,
+            "invalid_codes": invalid_codes,
+            "unverified_codes": unverified_codes,
+            "suggested_codes": suggest_codes(procedures, invalid_codes),
+        }
+        latency["code_validation"] = elapsed()
+        yield "code_validation", code_result
+
+        yield "medicare_comparison", price_bills([bill], [{}])[0]
+        latency["medicare_comparison"] = elapsed()
+
+        ucr_rates = await ucr_search
+        pricing = price_bills([bill], [ucr_rates])[0]
+        latency["ucr_validation"] = elapsed()
+        yield "ucr_validation", {"ucr_rates": ucr_rates, **pricing}
+
+        prompt = explanation_prompt([{"code_validation": code_result}, {"ucr_validation": pricing}])
+        analysis = None
+        async for kind, data in stream_structured_with_claude("explanation", prompt):
+            if kind == "delta":
+                latency.setdefault("summary_first_token", elapsed())
+                yield "summary_delta", {"text": data}
+            else:
+                analysis = data
+        if analysis is None:
+            log_event("summary_stream_incomplete", logging.WARNING)
+            yield "error", {"detail": "The summary stream ended without a result"}
+            return
+        latency["total"] = elapsed()
+        # Time from the start of the request to each event
+        for name, seconds in latency.items():
+            stage_seconds.observe(seconds, stage=f"stream_{name}", outcome="ok")
+        yield "summary", analysis
+        yield "done", {"latency": latency}
+    finally:
+        ucr_search.cancel()
+
+async def code_validation(bill):
+    # Validated locally against the reference code sets, no network round-trips
+    procedures = bill["billing_details"]["procedure_codes"]
+    codes = [procedure["code"] for procedure in procedures]
+    valid_codes, invalid_codes, unverified_codes = await validate_codes(codes)
+    # Nearest valid codes, from the code itself and the billed description
+    suggestions = suggest_codes(procedures, invalid_codes)
+
+    prompt = code_validation_prompt(valid_codes, invalid_codes, suggestions, unverified_codes)
+    result = await structured_with_claude("code_validation", prompt)
+    return {"code_validation": {**result, "suggested_codes": suggestions, "unverified_codes": unverified_codes}}
+
+def code_validation_prompt(valid_codes, invalid_codes, suggestions=None, unverified_codes=None):
+    suggested = [
+        {"invalid_code": code, "suggested_code": match["code"], "description": match["description"]}
+        for code, matches in (suggestions or {}).items()
+        for match in matches
+    ]
+    builder = (
+        PromptBuilder("code_validation")
+        .instructions("Check these procedure codes for discrepancies and upcoding risks.")
+        .instructions("Record the result with the record_code_validation tool.")
+        .table("Valid codes", valid_codes, ["code", "type", "description"])
+        .text(f"Invalid codes: {', '.join(counted_values(invalid_codes)) or 'none'}")
+    )
+    if unverified_codes:
+        builder.text("Codes that could not be checked (no code set available), "
+                     f"not to be reported as invalid: {', '.join(counted_values(unverified_codes))}")
+    if suggested:
+        builder.table("Nearest valid codes for the invalid ones", suggested)
+    return builder.build()
 
 
 
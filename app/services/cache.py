@@ -0,0 +1,217 @@
+# services/cache.py
+from typing import Any, Awaitable, Callable, Dict, Optional
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from .telemetry import log_error, register_collector
+
+# SQLite file shared by every cache that has no path of its own, so all
+# workers of a multi-process deployment see each other's results
+SHARED_CACHE_PATH = os.getenv("CACHE_PATH") or None
+
+def cache_key(*parts: Any) -> str:
+    """Content-addressed key: sha256 of the JSON-encoded parts"""
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class SQLiteTier:
+    """On-disk cache tier; values are stored as JSON and shared across processes"""
+
+    def __init__(self, path: str, namespace: str, max_entries: int):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_expiry ON cache (namespace, expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads, nor carried
+        # into a forked worker: each thread of each process opens its own
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get(self, key: str):
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None, 0.0
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), expires_at),
+            )
+            # Drop expired rows, then the soonest-expiring ones beyond the size cap
+            db.execute("DELETE FROM cache WHERE namespace = ? AND expires_at < ?", (self.namespace, time.time()))
+            db.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                " SELECT key FROM cache WHERE namespace = ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.max_entries),
+            )
+
+_caches: "weakref.WeakSet[ResponseCache]" = weakref.WeakSet()
+
+def _collect_cache_metrics():
+    caches = sorted(_caches, key=lambda cache: cache.namespace)
+    yield ("advocare_cache_lookups_total", "counter", "Cache lookups by result",
+           [({"cache": cache.namespace, "result": result}, cache.metrics[result])
+            for cache in caches for result in ("hits", "disk_hits", "misses", "joined")])
+    yield ("advocare_cache_hit_ratio", "gauge", "Share of lookups answered without an upstream call",
+           [({"cache": cache.namespace}, cache.stats()["hit_ratio"]) for cache in caches])
+    yield ("advocare_cache_entries", "gauge", "Entries held in memory",
+           [({"cache": cache.namespace}, len(cache._entries)) for cache in caches])
+
+register_collector(_collect_cache_metrics)
+
+class _Flight:
+    """A computation in progress and the number of callers waiting on it"""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class ResponseCache:
+    """
+    In-memory LRU cache with TTL, an optional SQLite tier and single-flight
+    deduplication: concurrent misses on the same key share one computation.
+    """
+
+    def __init__(self, namespace: str, ttl: float, max_entries: int,
+                 path: Optional[str] = None, disk_max_entries: Optional[int] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk = SQLiteTier(path, namespace, disk_max_entries or max_entries * 10) if path else None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self.metrics = {"hits": 0, "disk_hits": 0, "misses": 0, "joined": 0, "evictions": 0, "errors": 0}
+        _caches.add(self)
+
+    def _get_memory(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _set_memory(self, key: str, value: Any, expires_at: float):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.metrics["evictions"] += 1
+
+    async def get(self, key: str):
+        """Return the cached value or None"""
+        entry = self._get_memory(key)
+        if entry is not None:
+            self.metrics["hits"] += 1
+            return entry[0]
+        if self.disk is not None:
+            try:
+                value, expires_at = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error as e:
+                log_error("cache_read_failed", e, cache=self.namespace)
+                value = None
+            if value is not None:
+                self.metrics["disk_hits"] += 1
+                self._set_memory(key, value, expires_at)
+                return value
+        self.metrics["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._set_memory(key, value, expires_at)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value, expires_at)
+            except sqlite3.Error as e:
+                log_error("cache_write_failed", e, cache=self.namespace)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                             store_if: Optional[Callable[[Any], bool]] = None):
+        """
+        Cached value for key, computing it once however many callers miss at
+        the same time. Values failing store_if are returned but not kept.
+        The computation runs in its own task: a caller that is cancelled
+        (a timeout, a disconnect) leaves it running for the others, and it
+        is cancelled only once nobody is waiting for it.
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.metrics["joined"] += 1
+        else:
+            # Another caller may have finished while we were reading the disk tier
+            entry = self._get_memory(key)
+            if entry is not None:
+                return entry[0]
+            flight = self._inflight[key] = _Flight(asyncio.ensure_future(self._compute(key, compute, store_if)))
+            flight.task.add_done_callback(lambda task: self._release(key, flight))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Nobody wants the result any more; new callers start afresh
+                self._release(key, flight)
+                flight.task.cancel()
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                       store_if: Optional[Callable[[Any], bool]]):
+        try:
+            value = await compute()
+        except Exception:
+            self.metrics["errors"] += 1
+            raise
+        if store_if is None or store_if(value):
+            await self.set(key, value)
+        return value
+
+    def _release(self, key: str, flight: _Flight):
+        # By now a later caller may have started its own computation for key
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        # A miss that joined an in-flight computation still saved an upstream call
+        lookups = self.metrics["hits"] + self.metrics["disk_hits"] + self.metrics["misses"]
+        hits = self.metrics["hits"] + self.metrics["disk_hits"] + self.metrics["joined"]
+        return {
+            **self.metrics,
+            "entries": len(self._entries),
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        }
@@ -1,7 +1,20 @@
-from anthropic import Client
+from typing import TYPE_CHECKING
+import asyncio
+import logging
 import os
+import time
 from dotenv import load_dotenv
 import json
+from .http import get_http_client
+from pydantic import ValidationError
+from .cache import SHARED_CACHE_PATH, ResponseCache, cache_key
+from .prompts import Prompt, count_tokens, parse_json
+from .schemas import STAGE_TOOLS, tool_definition
+from .telemetry import llm_prompt_cache, llm_tokens, log_event
+from .upstream import Upstream
+
+if TYPE_CHECKING:
+    from anthropic import AsyncAnthropic
 
 # Load environment variables from .env
 load_dotenv()
@@ -9,37 +22,270 @@ load_dotenv()
 api_key = os.getenv('ANTHROPIC_API_KEY')
 
 if api_key is None:
-    print("Error: ANTHROPIC_API_KEY is not set.")
-else:
-    # Initialize the client with your API key
-    client = Client(api_key=api_key)
+    log_event("anthropic_api_key_missing", logging.WARNING)
+
+CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20241022")
+# Maximum number of Claude requests in flight per process
+CLAUDE_CONCURRENCY = int(os.getenv("CLAUDE_CONCURRENCY", "32"))
+CLAUDE_MAX_TOKENS = 1000
+CLAUDE_TEMPERATURE = 0
+# Repair calls for a stage whose tool input fails validation
+CLAUDE_REPAIR_RETRIES = int(os.getenv("CLAUDE_REPAIR_RETRIES", "1"))
+# Mark a prompt's static instructions (and the tool schema before them) as a
+# cacheable prefix. The API only caches prefixes of at least 1024 tokens
+# (2048 for Haiku) and bills cache writes at 1.25x, reads at 0.1x.
+CLAUDE_PROMPT_CACHING = os.getenv("CLAUDE_PROMPT_CACHING", "1") == "1"
+# Shortest prefix worth marking, by the local token estimate; set 2048 for Haiku.
+# Today's stage prefixes (tool schema plus instructions) are about 500-800
+# tokens, so nothing is marked or cached until a stage's instructions grow
+# past the minimum.
+CLAUDE_CACHE_MIN_TOKENS = int(os.getenv("CLAUDE_CACHE_MIN_TOKENS", "1024"))
+
+# Deterministic (temperature 0) responses are cached by prompt content.
+# Set LLM_CACHE_PATH (or CACHE_PATH) to add a SQLite tier that survives restarts.
+response_cache = ResponseCache(
+    "claude",
+    ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+    path=os.getenv("LLM_CACHE_PATH") or SHARED_CACHE_PATH,
+)
+
+# Tokens billed by the API, as reported in each response's usage. input_tokens
+# are the uncached ones; prompt-cache reads and writes are counted apart.
+token_usage = {
+    "requests": 0, "input_tokens": 0, "output_tokens": 0,
+    "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0,
+}
+# Structured stage calls, replies that failed validation and repair calls made
+structured_metrics = {"calls": 0, "invalid": 0, "repairs": 0}
+
+_client = None
+_client_pool = None
+_semaphore = asyncio.Semaphore(CLAUDE_CONCURRENCY)
+
+# Quota defaults match the entry API tier; set CLAUDE_REQUESTS_PER_MINUTE to
+# the account's limit. Generations are not hedged (they cost tokens twice).
+def _connection_errors():
+    from anthropic import APIConnectionError
+    return (APIConnectionError,)
+
+claude_upstream = Upstream(
+    "claude", "CLAUDE", requests_per_minute=50, max_retries=2, retryable_exceptions=_connection_errors
+)
+
+def get_client() -> "AsyncAnthropic":
+    """Return the async Claude client bound to the shared connection pool"""
+    global _client, _client_pool
+    if api_key is None:
+        raise RuntimeError("ANTHROPIC_API_KEY is not set")
+    http_client = get_http_client()
+    if _client is None or _client_pool is not http_client:
+        # The SDK takes a while to import; only pay for it once it is used
+        from anthropic import AsyncAnthropic
+        _client_pool = http_client
+        _client = AsyncAnthropic(
+            api_key=api_key,
+            base_url=os.getenv("ANTHROPIC_BASE_URL"),
+            http_client=http_client,
+            # Retries are handled by claude_upstream
+            max_retries=0,
+        )
+    return _client
 
-def analyze_with_claude(input_text):
+def _split(prompt):
+    """(instructions, content) of a Prompt; a plain string is all content"""
+    if isinstance(prompt, Prompt):
+        return prompt
+    return "", prompt
+
+def _system(prompt, tools=()):
+    """
+    The instructions as a system block, marked as the end of the cacheable
+    prefix when the prefix (tools, then instructions) is long enough to cache
+    """
+    instructions, _ = _split(prompt)
+    if not instructions:
+        return {}
+    block = {"type": "text", "text": instructions}
+    prefix_tokens = count_tokens(instructions) + sum(count_tokens(json.dumps(tool)) for tool in tools)
+    if CLAUDE_PROMPT_CACHING and prefix_tokens >= CLAUDE_CACHE_MIN_TOKENS:
+        block["cache_control"] = {"type": "ephemeral"}
+    return {"system": [block]}
+
+def _messages(prompt):
+    _, input_text = _split(prompt)
+    return [{"role": "user", "content": input_text}]
+
+async def _send(**request):
+    async with _semaphore:
+        return await get_client().messages.create(**request)
+
+async def _create_message(input_text):
+    message = await claude_upstream.call(lambda: _send(
+        model=CLAUDE_MODEL,
+        max_tokens=CLAUDE_MAX_TOKENS,
+        temperature=CLAUDE_TEMPERATURE,
+        messages=_messages(input_text),
+        **_system(input_text)
+    ))
+    _record_usage(message.usage)
+    # Extract response content from the Claude API
+    return message.content[0].text
+
+def _record_usage(usage, stage=None):
+    # The SDK's Usage model predates prompt caching; the fields come through as extras
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_creation = getattr(usage, "cache_creation_input_tokens", None) or 0
+    token_usage["requests"] += 1
+    token_usage["input_tokens"] += usage.input_tokens
+    token_usage["output_tokens"] += usage.output_tokens
+    token_usage["cache_read_input_tokens"] += cache_read
+    token_usage["cache_creation_input_tokens"] += cache_creation
+    llm_tokens.observe(usage.input_tokens, kind="input")
+    llm_tokens.observe(usage.output_tokens, kind="output")
+    llm_tokens.observe(cache_read, kind="cache_read")
+    llm_tokens.observe(cache_creation, kind="cache_write")
+    outcome = "hit" if cache_read else "write" if cache_creation else "none"
+    llm_prompt_cache.inc(stage=stage or "analyze", outcome=outcome)
+    log_event("claude_usage", logging.DEBUG, stage=stage, input_tokens=usage.input_tokens,
+              cache_read_input_tokens=cache_read, cache_creation_input_tokens=cache_creation,
+              output_tokens=usage.output_tokens)
+
+def _response_key(input_text):
+    return cache_key(CLAUDE_MODEL, CLAUDE_MAX_TOKENS, CLAUDE_TEMPERATURE, input_text)
+
+async def analyze_with_claude(input_text):
     """
     Analyze the input text using Claude AI and return the response.
+    input_text is a string or a Prompt, whose instructions are sent as a
+    cached system prompt.
     """
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20241022",
-        max_tokens=1000,
-        temperature=0,
-        messages=[
-            {
-                "role": "user",
-                "content": f'''
-
-                    {input_text}
-                '''
-            }
+    if CLAUDE_TEMPERATURE != 0:
+        return await _create_message(input_text)
+    return await response_cache.get_or_compute(_response_key(input_text), lambda: _create_message(input_text))
+
+def _tool_request(stage, prompt):
+    tool = tool_definition(stage)
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": CLAUDE_MAX_TOKENS,
+        "temperature": CLAUDE_TEMPERATURE,
+        # Tools come before the system prompt in the cached prefix
+        "tools": [tool],
+        "tool_choice": {"type": "tool", "name": tool["name"]},
+        **_system(prompt, [tool]),
+    }
+
+def _tool_output(message):
+    """(tool_use block, its input) of a reply; a plain-text reply is parsed as JSON"""
+    for block in message.content:
+        if block.type == "tool_use":
+            return block, block.input
+    return None, parse_json("".join(block.text for block in message.content if block.type == "text"))
+
+def _repair_messages(messages, block, output, error):
+    """The conversation so far plus the validation errors, and nothing else to redo"""
+    problems = "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'input'}: {detail['msg']}" for detail in error.errors()
+    )
+    if block is None:
+        return messages + [
+            {"role": "assistant", "content": output if isinstance(output, str) else json.dumps(output)},
+            {"role": "user", "content": f"That reply failed validation: {problems}. "
+                                        "Call the tool with these fields corrected and everything else unchanged."},
         ]
+    return messages + [
+        {"role": "assistant", "content": [
+            {"type": "tool_use", "id": block.id, "name": block.name, "input": block.input},
+        ]},
+        {"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": block.id, "is_error": True,
+             "content": f"Invalid input: {problems}. Call {block.name} again with these fields "
+                        "corrected and everything else unchanged."},
+        ]},
+    ]
+
+async def _create_structured(stage, input_text, message=None):
+    """
+    Call the stage's tool and validate its input against the stage model.
+    Invalid input is sent back with the validation errors for a targeted
+    repair, up to CLAUDE_REPAIR_RETRIES times. message is a reply that was
+    already received (e.g. streamed).
+    """
+    model = STAGE_TOOLS[stage][0]
+    messages = _messages(input_text)
+    structured_metrics["calls"] += 1
+    for attempt in range(CLAUDE_REPAIR_RETRIES + 1):
+        if message is None:
+            message = await claude_upstream.call(lambda: _send(messages=messages, **_tool_request(stage, input_text)))
+            _record_usage(message.usage, stage)
+        block, output = _tool_output(message)
+        try:
+            return model.model_validate(output).model_dump()
+        except ValidationError as e:
+            structured_metrics["invalid"] += 1
+            if attempt == CLAUDE_REPAIR_RETRIES:
+                raise
+            structured_metrics["repairs"] += 1
+            messages = _repair_messages(messages, block, output, e)
+            message = None
+
+def _structured_key(stage, input_text):
+    return cache_key(CLAUDE_MODEL, CLAUDE_MAX_TOKENS, CLAUDE_TEMPERATURE, tool_definition(stage), input_text)
+
+async def structured_with_claude(stage, input_text):
+    """
+    Run one analysis stage through its tool schema and return the output
+    as a validated dict (see services/schemas.py). input_text is a string
+    or a Prompt.
+    """
+    if CLAUDE_TEMPERATURE != 0:
+        return await _create_structured(stage, input_text)
+    return await response_cache.get_or_compute(
+        _structured_key(stage, input_text), lambda: _create_structured(stage, input_text)
     )
-    # Extract response content from the Claude API
-    response_content = message.content[0].text
-    return response_content
 
-def save_response_to_file(response_data, filename='claude-response.json'):
+async def stream_structured_with_claude(stage, input_text):
     """
-    Save the Claude AI response to a JSON file.
+    Like structured_with_claude, but yield ("delta", json_text) pairs as the
+    tool input is generated, then ("result", validated dict). A cached
+    result is yielded as a single delta.
     """
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(response_data, f, indent=2, ensure_ascii=False)
-    print(f"Data saved to {filename}")
+    key = _structured_key(stage, input_text)
+    cached = await response_cache.get(key) if CLAUDE_TEMPERATURE == 0 else None
+    if cached is not None:
+        yield "delta", json.dumps(cached)
+        yield "result", cached
+        return
+
+    attempt = 0
+    while True:
+        await claude_upstream.admit()
+        start = time.perf_counter()
+        streamed = False
+        try:
+            async with _semaphore:
+                async with get_client().messages.stream(
+                    messages=_messages(input_text), **_tool_request(stage, input_text)
+                ) as stream:
+                    async for event in stream:
+                        if event.type == "input_json":
+                            streamed = True
+                            yield "delta", event.partial_json
+                        elif event.type == "text":
+                            streamed = True
+                            yield "delta", event.text
+                    message = await stream.get_final_message()
+        except Exception as e:
+            # Only retry while nothing has been sent on to the client
+            if await claude_upstream.failed(e, attempt, time.perf_counter() - start, can_retry=not streamed):
+                attempt += 1
+                continue
+            raise
+        claude_upstream.succeeded(time.perf_counter() - start)
+        break
+    _record_usage(message.usage, stage)
+    result = await _create_structured(stage, input_text, message)
+    if CLAUDE_TEMPERATURE == 0:
+        await response_cache.set(key, result)
+    yield "result", result
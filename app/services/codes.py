@@ -0,0 +1,230 @@
+# services/codes.py
+#
+# Offline validation of CPT, HCPCS Level II and ICD-10-CM codes against the
+# code sets in the reference data. The NLM clinicaltables API is only used
+# as an optional fallback (CODE_VALIDATION_REMOTE=1) and its answers are cached.
+from typing import Dict, List, Optional, Tuple
+import bisect
+import os
+import re
+import threading
+from .cache import SHARED_CACHE_PATH, ResponseCache, cache_key
+from .database import ReferenceData, get_reference_data
+from .http import get_http_client
+from .search import CodeSearchIndex
+from .telemetry import log_error
+from .upstream import Upstream
+
+CPT = "CPT"
+HCPCS = "HCPCS"
+ICD10 = "ICD-10"
+
+# CPT Category I is five digits; Category II/III and PLA codes end in F/T/U
+CPT_PATTERN = re.compile(r"^\d{4}[0-9FTU]$")
+HCPCS_PATTERN = re.compile(r"^[A-V]\d{4}$")
+ICD10_PATTERN = re.compile(r"^[A-TV-Z]\d[0-9A-Z](?:\.?[0-9A-Z]{1,4})?$")
+
+NLM_BASE_URL = os.getenv("NLM_BASE_URL", "https://clinicaltables.nlm.nih.gov")
+REMOTE_APIS = {
+    ICD10: (f"{NLM_BASE_URL}/api/icd10cm/v3/search", "code,name"),
+    HCPCS: (f"{NLM_BASE_URL}/api/hcpcs/v3/search", "code,display"),
+}
+REMOTE_ENABLED = os.getenv("CODE_VALIDATION_REMOTE", "0") == "1"
+def _transport_errors():
+    import httpx
+    return (httpx.TransportError,)
+
+nlm_upstream = Upstream("nlm", "NLM", max_retries=2, hedge_after=-1, retryable_exceptions=_transport_errors)
+
+remote_cache = ResponseCache(
+    "nlm",
+    ttl=float(os.getenv("CODE_CACHE_TTL", str(30 * 86400))),
+    max_entries=int(os.getenv("CODE_CACHE_MAX_ENTRIES", "10000")),
+    path=os.getenv("CODE_CACHE_PATH") or SHARED_CACHE_PATH,
+)
+
+def normalize_code(code: str) -> str:
+    return code.strip().upper()
+
+def classify_code(code: str) -> List[str]:
+    """Code systems the code's format could belong to, most likely first"""
+    code = normalize_code(code)
+    types = []
+    if CPT_PATTERN.match(code):
+        types.append(CPT)
+    if HCPCS_PATTERN.match(code):
+        types.append(HCPCS)
+    if ICD10_PATTERN.match(code):
+        types.append(ICD10)
+    return types
+
+class CodeSet:
+    """Exact and prefix lookups over one code system"""
+
+    def __init__(self, name: str, codes):
+        self.name = name
+        self.codes = codes
+        self._sorted: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def get(self, code: str) -> Optional[Dict]:
+        return self.codes.get(code)
+
+    def sorted_codes(self) -> List[str]:
+        if self._sorted is None:
+            self._sorted = sorted(self.codes)
+        return self._sorted
+
+    def prefix(self, prefix: str, limit: int = 20) -> List[Dict]:
+        codes = self.sorted_codes()
+        start = bisect.bisect_left(codes, prefix)
+        matches = []
+        for code in codes[start:start + limit]:
+            if not code.startswith(prefix):
+                break
+            matches.append(self.codes[code])
+        return matches
+
+class CodeEngine:
+    """Validates codes against the code sets of one reference-data snapshot"""
+
+    def __init__(self, data: ReferenceData):
+        self.data = data
+        self.code_sets = {
+            CPT: [CodeSet(CPT, data.cpt_codes), CodeSet(HCPCS, data.hcpcs_codes)],
+            HCPCS: [CodeSet(HCPCS, data.hcpcs_codes)],
+            ICD10: [CodeSet(ICD10, data.icd10_codes)],
+        }
+        self._search_index: Optional[CodeSearchIndex] = None
+        self._search_lock = threading.Lock()
+
+    def search_index(self) -> CodeSearchIndex:
+        """Description and code search over CPT and HCPCS, built on first use"""
+        if self._search_index is None:
+            with self._search_lock:
+                if self._search_index is None:
+                    self._search_index = CodeSearchIndex(self._search_entries())
+        return self._search_index
+
+    def _search_entries(self):
+        # cpt.txt has the longer descriptors, so its entries go first
+        for code_set in self.code_sets[CPT]:
+            for code in code_set.codes:
+                code_type = CPT if CPT_PATTERN.match(code) else HCPCS
+                yield code, code_set.codes[code]["description"], code_type
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        return self.search_index().search(query, limit)
+
+    def has_code_set(self, code_type: str) -> bool:
+        return any(len(code_set) for code_set in self.code_sets[code_type])
+
+    def lookup(self, code: str) -> Optional[Dict]:
+        """{"code", "description", "type"} for a known code, else None"""
+        code = normalize_code(code)
+        for code_type in classify_code(code):
+            key = code.replace(".", "") if code_type == ICD10 else code
+            for code_set in self.code_sets[code_type]:
+                info = code_set.get(key)
+                if info is not None:
+                    return {"code": code, "description": info["description"], "type": code_type}
+        return None
+
+    def suggest(self, code: str, description: str = "", limit: int = 5) -> List[Dict]:
+        """
+        Known codes nearest to an unknown one: codes one typo away whose
+        description matches the billed one, codes matching it word for
+        word, other codes one typo away, looser description matches, and
+        finally codes sharing the longest prefix.
+        """
+        code = normalize_code(code).replace(".", "")
+        if ICD10 not in classify_code(code):
+            index = self.search_index()
+            typos = [index.result(doc, "typo") for doc in index.typo_neighbours(code)]
+            described = index.description_matches(description, limit) if description else []
+            typo_codes = {match["code"] for match in typos}
+            matches = ([m for m in described if m["code"] in typo_codes]
+                       + [m for m in described if m["match"] == "words"] + typos + described)
+            if matches:
+                unique = {match["code"]: match for match in matches}
+                return [{"code": m["code"], "description": m["description"], "type": m["type"]}
+                        for m in list(unique.values())[:limit]]
+        for length in range(len(code), 0, -1):
+            for code_type in classify_code(code) or [CPT, HCPCS, ICD10]:
+                matches = self.code_sets[code_type][-1].prefix(code[:length], limit)
+                if matches:
+                    return [{"code": m["code"], "description": m["description"], "type": code_type} for m in matches]
+        return []
+
+_engine: Optional[CodeEngine] = None
+
+def get_code_engine() -> CodeEngine:
+    """Engine for the current reference-data snapshot, rebuilt after a reload"""
+    global _engine
+    data = get_reference_data()
+    engine = _engine
+    if engine is None or engine.data is not data:
+        engine = _engine = CodeEngine(data)
+    return engine
+
+async def _remote_lookup(code: str, code_type: str) -> Optional[Dict]:
+    url, fields = REMOTE_APIS[code_type]
+
+    async def fetch():
+        async def send():
+            response = await get_http_client().get(url, params={"terms": code, "sf": "code", "df": fields})
+            response.raise_for_status()
+            return response
+
+        response = await nlm_upstream.call(send, hedge=True)
+        data = response.json()
+        for match_code, description in data[3] if data[1] else []:
+            if normalize_code(match_code).replace(".", "") == code.replace(".", ""):
+                return {"code": code, "description": description, "type": code_type}
+        # Cache misses too, as an explicit "not found"
+        return {}
+
+    result = await remote_cache.get_or_compute(cache_key(code_type, code), fetch)
+    return result or None
+
+def suggest_codes(procedures: List[Dict], invalid_codes: List[str], limit: int = 3) -> Dict[str, List[Dict]]:
+    """Nearest valid codes for each invalid one, using the billed description too"""
+    engine = get_code_engine()
+    descriptions = {procedure["code"]: procedure.get("description", "") for procedure in procedures}
+    return {code: engine.suggest(code, descriptions.get(code, ""), limit) for code in dict.fromkeys(invalid_codes)}
+
+async def validate_codes(codes: List[str]) -> Tuple[List[Dict], List[str], List[str]]:
+    """
+    Split codes into (valid code records, invalid codes, unverified codes).
+    Lookups are local; the remote API is only consulted for code systems
+    missing locally. A code whose most likely system has no local code set
+    (ICD-10 unless icd10cm_codes.txt is installed) and that the remote API
+    could not answer for is unverified rather than invalid.
+    """
+    engine = get_code_engine()
+    valid_codes = []
+    invalid_codes = []
+    unverified_codes = []
+    for code in codes:
+        info = engine.lookup(code)
+        types = classify_code(code)
+        answered = False
+        if info is None and REMOTE_ENABLED:
+            for code_type in types:
+                if code_type in REMOTE_APIS and not engine.has_code_set(code_type):
+                    try:
+                        info = await _remote_lookup(normalize_code(code), code_type)
+                        answered = answered or code_type == types[0]
+                    except Exception as e:
+                        log_error("code_lookup_failed", e, code_type=code_type, code=code)
+                    if info is not None:
+                        break
+        if info is not None:
+            valid_codes.append(info)
+        elif types and not engine.has_code_set(types[0]) and not answered:
+            unverified_codes.append(code)
+        else:
+            invalid_codes.append(code)
+    return valid_codes, invalid_codes, unverified_codes
@@ -1,17 +1,46 @@
 # services/database.py
-from typing import Optional, Dict
+from typing import Optional, Dict, Mapping, Tuple
+from types import MappingProxyType
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+import bisect
+import logging
+import threading
 import json
+import os
 import csv
 from pathlib import Path
+from .snapshot import SnapshotError, compile_reference_tables, open_reference_tables, write_snapshot
+from .telemetry import log_event, log_error, reference_load_seconds
 
 # Get the base directory of your project
-BASE_DIR = Path(__file__).resolve().parent.parent
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+DATABASE_DIR = BASE_DIR / "databases"
+
+CPT_PATH = DATABASE_DIR / "cpt.txt"
+ADDENDUM_A_PATH = DATABASE_DIR / "addendum_a.csv"
+ADDENDUM_B_PATH = DATABASE_DIR / "addendum_b.csv"
+# CMS ICD-10-CM code descriptions (icd10cm_codes_<year>.txt from the tabular
+# order release), copied here. Without it ICD-10 codes are reported as
+# unverified rather than invalid, unless CODE_VALIDATION_REMOTE=1 checks them
+ICD10_PATH = Path(os.getenv("ICD10_CODES_PATH", DATABASE_DIR / "icd10cm_codes.txt"))
+# Medicare rate versions by effective date, appended to by `python databases/map.py merge`
+RATE_HISTORY_PATH = Path(os.getenv("RATE_HISTORY_PATH", DATABASE_DIR / "medicare_rate_history.csv"))
+# Compiled by `python databases/map.py compile`; used instead of the sources when up to date
+SNAPSHOT_PATH = Path(os.getenv("REFERENCE_SNAPSHOT", DATABASE_DIR / "reference.snapshot"))
+
+SOURCE_PATHS = (CPT_PATH, ADDENDUM_A_PATH, ADDENDUM_B_PATH, ICD10_PATH, RATE_HISTORY_PATH)
+
+# (effective date, APC, payment rate); an empty APC means the code stopped
+# being separately paid on that date
+RateVersion = Tuple[str, str, Optional[Decimal]]
 
 def load_cpt_database() -> Dict:
     """Load CPT codes from text file"""
     cpt_codes = {}
     try:
-        with open(BASE_DIR / "databases" / "cpt.txt", 'r') as file:
+        with open(CPT_PATH, 'r') as file:
             for line in file:
                 parts = line.strip().split(": ")
                 if len(parts) == 2:
@@ -21,32 +50,254 @@ def load_cpt_database() -> Dict:
                         "description": description
                     }
     except FileNotFoundError:
-        print(f"Error: CPT database file not found")
+        log_event("reference_file_missing", logging.ERROR, file=str(CPT_PATH))
     return cpt_codes
 
-def load_medicare_database() -> Dict:
-    """Load Medicare rates from CSV file"""
+def load_icd10_database() -> Dict:
+    """Load ICD-10-CM codes ("A000    Cholera due to ...") keyed without the dot"""
+    icd10_codes = {}
+    if not ICD10_PATH.exists():
+        return icd10_codes
+    with open(ICD10_PATH, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            parts = line.strip().split(None, 1)
+            if len(parts) == 2:
+                code, description = parts
+                code = code.replace(".", "").upper()
+                icd10_codes[code] = {
+                    "code": code,
+                    "description": description
+                }
+    return icd10_codes
+
+def parse_payment_rate(value: str) -> Optional[Decimal]:
+    """Parse an addendum payment rate such as "$4,156.57 " into a Decimal"""
+    value = value.strip().replace("$", "").replace(",", "")
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+def _read_addendum(path: Path):
+    # The CMS exports carry a BOM and stray whitespace in the header names
+    with open(path, 'r', newline='', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            yield {key.strip(): (value or '').strip() for key, value in row.items()}
+
+def load_apc_database() -> Dict:
+    """Load APC groups and their payment rates from Addendum A"""
+    apc_rates = {}
+    try:
+        for row in _read_addendum(ADDENDUM_A_PATH):
+            apc = row['APC']
+            apc_rates[apc] = {
+                'apc': apc,
+                'title': row['Group Title'],
+                'payment_rate': parse_payment_rate(row['Payment Rate'])
+            }
+    except FileNotFoundError:
+        log_event("reference_file_missing", logging.ERROR, file=str(ADDENDUM_A_PATH))
+    return apc_rates
+
+def load_hcpcs_database() -> Dict:
+    """Load every HCPCS/CPT code and short descriptor from Addendum B, paid or not"""
+    hcpcs_codes = {}
+    try:
+        for row in _read_addendum(ADDENDUM_B_PATH):
+            code = row['HCPCS Code']
+            hcpcs_codes[code] = {
+                "code": code,
+                "description": row['Short Descriptor']
+            }
+    except FileNotFoundError:
+        log_event("reference_file_missing", logging.ERROR, file=str(ADDENDUM_B_PATH))
+    return hcpcs_codes
+
+def load_medicare_database(apc_rates: Optional[Dict] = None) -> Dict:
+    """Load one Medicare rate entry per HCPCS code from Addendum B"""
+    if apc_rates is None:
+        apc_rates = load_apc_database()
     medicare_rates = {}
     try:
-        with open(BASE_DIR / "databases" / "medicare_rates.csv", 'r') as file:
-            csv_reader = csv.DictReader(file)
-            for row in csv_reader:
-                code = row['HCPCS Code']
-                medicare_rates[code] = {
-                    'code': code,
-                    'apc': row['APC'],
-                    'description': row['Description']
-                }
+        for row in _read_addendum(ADDENDUM_B_PATH):
+            apc = row['APC']
+            if not apc:
+                # Codes without an APC are not separately paid under OPPS
+                continue
+            code = row['HCPCS Code']
+            payment_rate = parse_payment_rate(row['Payment Rate'])
+            if payment_rate is None and apc in apc_rates:
+                payment_rate = apc_rates[apc]['payment_rate']
+            medicare_rates[code] = {
+                'code': code,
+                'apc': apc,
+                'description': row['Short Descriptor'],
+                'payment_rate': payment_rate
+            }
     except FileNotFoundError:
-        print(f"Error: Medicare rates database file not found")
+        log_event("reference_file_missing", logging.ERROR, file=str(ADDENDUM_B_PATH))
     return medicare_rates
 
+def load_rate_history() -> Dict[str, Tuple[RateVersion, ...]]:
+    """Medicare rate versions per HCPCS code, oldest first"""
+    versions: Dict[str, list] = {}
+    if not RATE_HISTORY_PATH.exists():
+        return {}
+    with open(RATE_HISTORY_PATH, 'r', newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            versions.setdefault(row['HCPCS Code'], []).append(
+                (row['Effective Date'], row['APC'], parse_payment_rate(row['Payment Rate']))
+            )
+    return {code: tuple(sorted(history)) for code, history in versions.items()}
+
+def build_apc_index(medicare_rates: Mapping[str, Dict]) -> Dict[str, Tuple[str, ...]]:
+    """Reverse index of APC -> HCPCS codes assigned to it"""
+    apc_codes: Dict[str, list] = {}
+    for code, info in medicare_rates.items():
+        apc_codes.setdefault(info['apc'], []).append(code)
+    return {apc: tuple(sorted(codes)) for apc, codes in apc_codes.items()}
+
+@dataclass(frozen=True)
+class ReferenceData:
+    """Immutable snapshot of the reference databases shared by all requests"""
+    cpt_codes: Mapping[str, Dict]
+    medicare_rates: Mapping[str, Dict]
+    apc_rates: Mapping[str, Dict]
+    apc_codes: Mapping[str, Tuple[str, ...]]
+    hcpcs_codes: Mapping[str, Dict]
+    icd10_codes: Mapping[str, Dict]
+    rate_history: Mapping[str, Tuple[RateVersion, ...]]
+    fingerprint: Tuple
+
+def _source_fingerprint() -> Tuple:
+    """(path, mtime, size) of every source file, used to detect changes on disk"""
+    fingerprint = []
+    for path in SOURCE_PATHS + (SNAPSHOT_PATH,):
+        try:
+            stat = path.stat()
+            fingerprint.append((str(path), stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            fingerprint.append((str(path), None, None))
+    return tuple(fingerprint)
+
+def _snapshot_is_current() -> bool:
+    try:
+        built = SNAPSHOT_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+    for path in SOURCE_PATHS:
+        if path.exists() and path.stat().st_mtime_ns > built:
+            log_event("reference_snapshot_stale", logging.WARNING, snapshot=str(SNAPSHOT_PATH), newer_source=str(path))
+            return False
+    return True
+
+def parse_reference_data() -> ReferenceData:
+    """Parse the source files into a new read-only snapshot"""
+    fingerprint = _source_fingerprint()
+    apc_rates = load_apc_database()
+    medicare_rates = load_medicare_database(apc_rates)
+    return ReferenceData(
+        cpt_codes=MappingProxyType(load_cpt_database()),
+        medicare_rates=MappingProxyType(medicare_rates),
+        apc_rates=MappingProxyType(apc_rates),
+        apc_codes=MappingProxyType(build_apc_index(medicare_rates)),
+        hcpcs_codes=MappingProxyType(load_hcpcs_database()),
+        icd10_codes=MappingProxyType(load_icd10_database()),
+        rate_history=MappingProxyType(load_rate_history()),
+        fingerprint=fingerprint,
+    )
+
+def build_reference_data() -> ReferenceData:
+    """Memory-map the compiled snapshot if it is up to date, otherwise parse the sources"""
+    if _snapshot_is_current():
+        fingerprint = _source_fingerprint()
+        try:
+            with reference_load_seconds.time(source="snapshot"):
+                return ReferenceData(fingerprint=fingerprint, **open_reference_tables(SNAPSHOT_PATH))
+        except SnapshotError as e:
+            log_error("reference_snapshot_unreadable", e, snapshot=str(SNAPSHOT_PATH))
+    with reference_load_seconds.time(source="parse"):
+        return parse_reference_data()
+
+def compile_reference_snapshot(path: Path = SNAPSHOT_PATH) -> ReferenceData:
+    """Parse the sources and write them out as a binary snapshot"""
+    data = parse_reference_data()
+    write_snapshot(compile_reference_tables(data), path)
+    return data
+
+_snapshot: Optional[ReferenceData] = None
+_reload_lock = threading.Lock()
+
+def get_reference_data() -> ReferenceData:
+    """Return the current snapshot, building it on first use"""
+    snapshot = _snapshot
+    if snapshot is None:
+        snapshot = reload_reference_data()
+    return snapshot
+
+def reload_reference_data(force: bool = False) -> ReferenceData:
+    """
+    Rebuild the snapshot if the files on disk changed (or when forced) and swap
+    it in. Readers holding the old snapshot keep using it until they finish.
+    """
+    global _snapshot
+    with _reload_lock:
+        current = _snapshot
+        if not force and current is not None and current.fingerprint == _source_fingerprint():
+            return current
+        _snapshot = build_reference_data()
+        return _snapshot
+
 async def get_cpt_code(code: str) -> Optional[Dict]:
     """Get a specific CPT code information"""
-    cpt_codes = load_cpt_database()
-    return cpt_codes.get(code)
+    return get_reference_data().cpt_codes.get(code)
+
+def parse_visit_date(value) -> Optional[str]:
+    """A date of visit as an ISO date string, or None when it cannot be read"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    if not value:
+        return None
+    value = str(value).strip()
+    for fmt in ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%m-%d-%Y"):
+        try:
+            return datetime.strptime(value[:10] if fmt == "%Y-%m-%d" else value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+def medicare_rate_on(code: str, visit_date: Optional[str], medicare_rates: Mapping[str, Dict],
+                     rate_history: Mapping[str, Tuple[RateVersion, ...]]) -> Optional[Dict]:
+    """
+    The Medicare entry for code under the fee schedule in effect on
+    visit_date. Falls back to the current addendum when there is no date or
+    the visit predates the recorded history.
+    """
+    current = medicare_rates.get(code)
+    versions = rate_history.get(code) if visit_date else None
+    if not versions:
+        return current
+    position = bisect.bisect_right(versions, (visit_date, "\uffff"))
+    if position == 0:
+        return current
+    effective_date, apc, payment_rate = versions[position - 1]
+    if not apc:
+        return None
+    return {
+        'code': code,
+        'apc': apc,
+        'description': current['description'] if current else '',
+        'payment_rate': payment_rate,
+        'effective_date': effective_date
+    }
+
+async def get_medicare_rate(code: str, visit_date: Optional[str] = None) -> Optional[Dict]:
+    """Get a specific Medicare rate information, as of visit_date when given"""
+    data = get_reference_data()
+    return medicare_rate_on(code, parse_visit_date(visit_date), data.medicare_rates, data.rate_history)
 
-async def get_medicare_rate(code: str) -> Optional[Dict]:
-    """Get a specific Medicare rate information"""
-    medicare_rates = load_medicare_database()
-    return medicare_rates.get(code)
\ No newline at end of file
+async def get_apc_codes(apc: str) -> Tuple[str, ...]:
+    """Get the HCPCS codes assigned to an APC"""
+    return get_reference_data().apc_codes.get(apc, ())
@@ -0,0 +1,237 @@
+# services/extraction.py
+#
+# Turns uploaded bill files into the billing_details.procedure_codes
+# structure the analyzer expects. Parsing is CPU-bound, so it runs in a
+# process pool; results are cached by the upload's content hash.
+from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import mmap
+import os
+import re
+import zlib
+from .cache import SHARED_CACHE_PATH, ResponseCache, cache_key
+
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Bump when the parsers change what they extract, so cached results are not served
+EXTRACTOR_VERSION = 1
+
+extraction_cache = ResponseCache(
+    "extraction",
+    ttl=float(os.getenv("EXTRACTION_CACHE_TTL", str(7 * 86400))),
+    max_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "1000")),
+    path=os.getenv("EXTRACTION_CACHE_PATH") or SHARED_CACHE_PATH,
+)
+
+# --- PDF text ------------------------------------------------------------
+
+STREAM_PATTERN = re.compile(rb"<<(.*?)>>\s*stream\r?\n(.*?)\r?\nendstream", re.DOTALL)
+TEXT_TOKEN_PATTERN = re.compile(
+    rb"\((?:\\.|[^\\)])*\)"          # literal string
+    rb"|<[0-9A-Fa-f\s]*>"            # hex string
+    rb"|\[|\]"
+    rb"|-?\d*\.?\d+"                  # number operand
+    rb"|T[jJdD*m]|'|\"|ET|BT"
+)
+PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+def _pdf_string(token: bytes) -> str:
+    if token.startswith(b"<"):
+        hex_digits = re.sub(rb"\s", b"", token[1:-1])
+        return bytes.fromhex(hex_digits.decode() + ("0" if len(hex_digits) % 2 else "")).decode("latin-1")
+    body = token[1:-1]
+
+    def unescape(match):
+        escaped = match.group(1)
+        if escaped[:1].isdigit():
+            return bytes([int(escaped, 8) & 0xFF])
+        return PDF_ESCAPES.get(escaped, escaped)
+
+    return re.sub(rb"\\([0-7]{1,3}|.)", unescape, body, flags=re.DOTALL).decode("latin-1")
+
+def _content_text(content: bytes) -> str:
+    """Text shown by a content stream, one line per text line on the page"""
+    out: List[str] = []
+    operands: List[bytes] = []
+    in_array = False
+    last_y = None
+    for token in TEXT_TOKEN_PATTERN.findall(content):
+        if token == b"[":
+            in_array = True
+            operands = []
+        elif token == b"]":
+            in_array = False
+        elif token in (b"Tj", b"'", b'"', b"TJ"):
+            if token in (b"'", b'"'):
+                out.append("\n")
+            for operand in operands:
+                if operand[:1] in (b"(", b"<"):
+                    out.append(_pdf_string(operand))
+                elif token == b"TJ" and operand[:1] == b"-" and float(operand) < -200:
+                    # Large negative kerning inside TJ is a word gap
+                    out.append(" ")
+            operands = []
+        elif token in (b"Td", b"TD", b"Tm"):
+            numbers = [float(n) for n in operands if n[:1] not in (b"(", b"<")]
+            y = numbers[-1] if numbers else 0.0
+            moved_down = (y != 0) if token != b"Tm" else (last_y is not None and y != last_y)
+            if token == b"Tm":
+                last_y = y
+            out.append("\n" if moved_down else " ")
+            operands = []
+        elif token in (b"T*", b"ET"):
+            out.append("\n")
+            operands = []
+        elif token == b"BT":
+            operands = []
+        else:
+            operands.append(token)
+            if not in_array and len(operands) > 6:
+                operands = operands[-6:]
+    return "".join(out)
+
+def pdf_text(data) -> str:
+    """
+    Best-effort text of a PDF using only the standard library: inflates the
+    content streams and collects the strings of the text-showing operators.
+    Scanned (image-only) PDFs yield no text.
+    """
+    pages = []
+    for match in STREAM_PATTERN.finditer(data):
+        header, stream = match.group(1), match.group(2)
+        if b"/FlateDecode" in header:
+            try:
+                stream = zlib.decompress(stream)
+            except zlib.error:
+                continue
+        elif b"/Filter" in header:
+            continue
+        if b"Tj" in stream or b"TJ" in stream:
+            pages.append(_content_text(stream))
+    return "\n".join(pages)
+
+# --- line items ----------------------------------------------------------
+
+AMOUNT_PATTERN = re.compile(r"\$?\s?(\d{1,3}(?:,\d{3})*(?:\.\d{2})|\d+\.\d{2})\b")
+PROCEDURE_CODE_PATTERN = re.compile(r"\b([A-V]\d{4}|\d{4}[0-9FTU])\b")
+ICD10_TOKEN_PATTERN = re.compile(r"\b([A-TV-Z]\d[0-9A-Z](?:\.[0-9A-Z]{1,4}|[0-9A-Z]{1,4})?)\b")
+ICD10_DOTTED_PATTERN = re.compile(r"\b([A-TV-Z]\d[0-9A-Z]\.[0-9A-Z]{1,4})\b")
+QUANTITY_PATTERN = re.compile(r"\b(?:qty|quantity|units?)\s*[:#]?\s*(\d{1,3})\b|\b[x×]\s?(\d{1,3})\b", re.IGNORECASE)
+TRAILING_QUANTITY_PATTERN = re.compile(r"\s(\d{1,3})\s*$")
+DIAGNOSIS_HINT = re.compile(r"\b(dx|diag|diagnos[ie]s|icd)\b", re.IGNORECASE)
+# "Date of service: 11/01/2024"; the date picks the fee schedule to price against
+VISIT_DATE_PATTERN = re.compile(
+    r"\b(?:date of (?:service|visit)|service date|visit date|dos)\b\s*[:#]?\s*"
+    r"(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4})", re.IGNORECASE)
+# Summary lines whose numbers (zip codes, account numbers) are not procedures
+SUMMARY_HINT = re.compile(r"\b(total|subtotal|balance|amount due|payments?|adjustments?|account|zip)\b", re.IGNORECASE)
+
+def _clean_description(text: str) -> str:
+    text = re.sub(r"\s+", " ", text).strip(" -:|\t")
+    return text[:120]
+
+def _parse_procedure(line: str) -> Optional[Dict]:
+    for match in PROCEDURE_CODE_PATTERN.finditer(line.upper()):
+        code = match.group(1)
+        rest = line[match.end():]
+        amounts = AMOUNT_PATTERN.findall(rest)
+        if not amounts:
+            continue
+        description = rest[:AMOUNT_PATTERN.search(rest).start()]
+        quantity_match = QUANTITY_PATTERN.search(description)
+        if quantity_match:
+            quantity = int(next(group for group in quantity_match.groups() if group))
+            description = QUANTITY_PATTERN.sub("", description)
+        else:
+            # A bare number right before the amounts is a quantity column
+            trailing = TRAILING_QUANTITY_PATTERN.search(description)
+            quantity = int(trailing.group(1)) if trailing else 1
+            description = description[:trailing.start()] if trailing else description
+        return {
+            "code": code,
+            "description": _clean_description(description),
+            "quantity": quantity or 1,
+            # The last amount on a line is the line total (a unit price, if any, comes first)
+            "cost": float(amounts[-1].replace(",", "")),
+        }
+    return None
+
+def parse_line_items(text: str) -> Dict[str, List[Dict]]:
+    """Find procedure lines (code + amount), diagnosis codes and the date of service in bill text"""
+    procedure_codes = []
+    diagnoses = []
+    seen_diagnoses = set()
+    visit_date = None
+
+    def add_diagnosis(code, description):
+        if code not in seen_diagnoses:
+            seen_diagnoses.add(code)
+            diagnoses.append({"code": code, "description": _clean_description(description)})
+
+    for line in text.splitlines():
+        if visit_date is None:
+            date_match = VISIT_DATE_PATTERN.search(line)
+            if date_match:
+                visit_date = date_match.group(1)
+                continue
+        if DIAGNOSIS_HINT.search(line) and not AMOUNT_PATTERN.search(line):
+            for match in ICD10_TOKEN_PATTERN.finditer(line.upper()):
+                add_diagnosis(match.group(1), ICD10_TOKEN_PATTERN.split(line[match.end():])[0])
+            continue
+        for match in ICD10_DOTTED_PATTERN.finditer(line.upper()):
+            add_diagnosis(match.group(1), AMOUNT_PATTERN.split(line[match.end():])[0])
+        if SUMMARY_HINT.search(line):
+            continue
+        procedure = _parse_procedure(line)
+        if procedure is not None:
+            procedure_codes.append(procedure)
+    return {"procedure_codes": procedure_codes, "diagnoses": diagnoses, "date_of_visit": visit_date}
+
+def extract_file(path: str, content_type: str) -> Dict[str, List[Dict]]:
+    """Runs in a worker process: read the spooled file and parse its line items"""
+    if os.path.getsize(path) == 0:
+        return {"procedure_codes": [], "diagnoses": []}
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if content_type == "application/pdf":
+            text = pdf_text(data)
+        elif content_type == "text/plain":
+            text = data[:].decode("utf-8", errors="replace")
+        else:
+            # Images need OCR, which is not available locally
+            text = ""
+    return parse_line_items(text)
+
+# --- async entry points --------------------------------------------------
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def extract_upload(upload) -> Dict[str, List[Dict]]:
+    """Line items of one SpooledUpload, cached by its content hash and the extractor version"""
+    async def run():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), extract_file, str(upload.path), upload.content_type)
+
+    key = cache_key("extraction", EXTRACTOR_VERSION, upload.content_type, upload.sha256)
+    return await extraction_cache.get_or_compute(key, run)
+
+async def extract_bill_items(uploads) -> Dict[str, List[Dict]]:
+    """Merged line items of all uploads of one request"""
+    results = await asyncio.gather(*(extract_upload(upload) for upload in uploads))
+    items = {"procedure_codes": [], "diagnoses": [], "date_of_visit": None}
+    for result in results:
+        items["procedure_codes"].extend(result["procedure_codes"])
+        items["diagnoses"].extend(result["diagnoses"])
+        items["date_of_visit"] = items["date_of_visit"] or result.get("date_of_visit")
+    return items
@@ -0,0 +1,46 @@
+# services/http.py
+import os
+from typing import TYPE_CHECKING, Optional
+from .telemetry import request_id_var
+
+if TYPE_CHECKING:
+    import httpx
+
+# One connection pool per process, shared by every upstream SDK client
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+
+_client: Optional["httpx.AsyncClient"] = None
+
+async def _tag_request(request: "httpx.Request"):
+    # Lets upstream logs be matched with ours
+    request_id = request_id_var.get()
+    if request_id is not None:
+        request.headers["X-Request-ID"] = request_id
+
+def get_http_client() -> "httpx.AsyncClient":
+    """Return the process-wide pooled HTTP client, creating it on first use"""
+    global _client
+    if _client is None or _client.is_closed:
+        # Imported here, with the SDKs, rather than on the startup path
+        import httpx
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            event_hooks={"request": [_tag_request]},
+        )
+    return _client
+
+async def close_http_client():
+    """Close the pooled client, e.g. on application shutdown"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
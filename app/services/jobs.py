@@ -0,0 +1,134 @@
+# services/jobs.py
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from collections import OrderedDict
+import asyncio
+import os
+import time
+import uuid
+from .cache import SHARED_CACHE_PATH, ResponseCache
+from .telemetry import log_error, request_id_var
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "10000"))
+# Finished jobs kept for GET /api/jobs/{id} before the oldest are dropped
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "10000"))
+JOB_STORE_TTL = float(os.getenv("JOB_STORE_TTL", "86400"))
+
+class JobQueueFull(Exception):
+    pass
+
+class JobQueue:
+    """
+    In-process job queue drained by a bounded pool of worker tasks. With a
+    store, every state change is also written there, so a job can be polled
+    through any worker of a multi-process deployment.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_SIZE,
+                 retention: int = JOB_RETENTION, store: Optional[ResponseCache] = None):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.store = store
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.waiting = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def create(self, kind: str, **details) -> str:
+        """Register a job in 'pending' state, before its work is enqueued"""
+        if self.waiting >= self.max_queued:
+            raise JobQueueFull(f"More than {self.max_queued} jobs are waiting")
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = {
+            "id": job_id,
+            "kind": kind,
+            "status": "pending",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            # Work done for the job is logged under the submitting request's ID
+            "request_id": request_id_var.get(),
+            **details,
+        }
+        self.waiting += 1
+        self._evict()
+        return job_id
+
+    def enqueue(self, job_id: str, work: Callable[[], Awaitable[Any]]):
+        self.jobs[job_id]["status"] = "queued"
+        self._queue.put_nowait((job_id, work))
+
+    def fail(self, job_id: str, error: str):
+        self.waiting -= 1
+        self.jobs[job_id].update(status="failed", error=error, finished_at=time.time())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.get(job_id)
+
+    async def find(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job, from this process or, failing that, from the store"""
+        job = self.jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = await self.store.get(job_id)
+        return job
+
+    async def publish(self, job_id: str):
+        job = self.jobs.get(job_id)
+        if self.store is None or job is None:
+            return
+        try:
+            await self.store.set(job_id, job)
+        except (TypeError, ValueError) as e:
+            # A result that is not JSON is still served by this worker
+            log_error("job_publish_failed", e, job_id=job_id)
+
+    def _evict(self):
+        excess = len(self.jobs) - self.retention
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id]["status"] in ("done", "failed"):
+                del self.jobs[job_id]
+                excess -= 1
+
+    async def _worker(self):
+        while True:
+            job_id, work = await self._queue.get()
+            job = self.jobs.get(job_id)
+            self.waiting -= 1
+            try:
+                if job is None:
+                    continue
+                request_id_var.set(job["request_id"])
+                job.update(status="running", started_at=time.time())
+                await self.publish(job_id)
+                job["result"] = await work()
+                job.update(status="done", finished_at=time.time())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error("job_failed", e, job_id=job_id)
+                job.update(status="failed", error=str(e), finished_at=time.time())
+            finally:
+                self._queue.task_done()
+            await self.publish(job_id)
+
+job_queue = JobQueue(
+    # Memory is this process's own job table; the store only holds copies
+    # for the other workers, so it keeps none in memory
+    store=ResponseCache("jobs", ttl=JOB_STORE_TTL, max_entries=0, path=SHARED_CACHE_PATH,
+                        disk_max_entries=JOB_RETENTION * 10) if SHARED_CACHE_PATH else None,
+)
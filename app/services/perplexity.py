@@ -1,7 +1,17 @@
-from openai import OpenAI
+from typing import TYPE_CHECKING, Dict, List, Optional
+import asyncio
+import json
 import os
+import re
 # import sys
 from dotenv import load_dotenv
+from .http import get_http_client
+from .cache import SHARED_CACHE_PATH, ResponseCache, cache_key
+from .telemetry import log_error
+from .upstream import Upstream
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 load_dotenv()
 
@@ -10,10 +20,88 @@ api_key = os.getenv("PERPLEXITY_API_KEY")
 # Set your API key as an environment variable for security
 # os.environ["PERPLEXITY_API_KEY"] = "your_api_key_here"
 
-# Initialize the OpenAI client with Perplexity's base URL
-client = OpenAI(api_key=api_key, base_url="https://api.perplexity.ai")
+PERPLEXITY_BASE_URL = os.getenv("PERPLEXITY_BASE_URL", "https://api.perplexity.ai")
+PERPLEXITY_MODEL = os.getenv("PERPLEXITY_MODEL", "llama-3.1-sonar-small-128k-online")
+# Maximum number of Perplexity requests in flight per process
+PERPLEXITY_CONCURRENCY = int(os.getenv("PERPLEXITY_CONCURRENCY", "16"))
+
+# UCR rates per (code, locality); popular procedures are answered from here
+ucr_cache = ResponseCache(
+    "ucr",
+    ttl=float(os.getenv("UCR_CACHE_TTL", str(7 * 86400))),
+    max_entries=int(os.getenv("UCR_CACHE_MAX_ENTRIES", "50000")),
+    path=os.getenv("UCR_CACHE_PATH") or SHARED_CACHE_PATH,
+)
+
+_client = None
+_client_pool = None
+_semaphore = asyncio.Semaphore(PERPLEXITY_CONCURRENCY)
+
+# UCR lookups are idempotent, so slow ones are hedged after the recent p95
+def _connection_errors():
+    from openai import APIConnectionError
+    return (APIConnectionError,)
+
+perplexity_upstream = Upstream(
+    "perplexity", "PERPLEXITY", requests_per_minute=50, max_retries=3, hedge_after=-1,
+    retryable_exceptions=_connection_errors,
+)
+
+def get_client() -> "AsyncOpenAI":
+    """Return the async OpenAI client pointed at Perplexity's base URL"""
+    global _client, _client_pool
+    if api_key is None:
+        raise RuntimeError("PERPLEXITY_API_KEY is not set")
+    http_client = get_http_client()
+    if _client is None or _client_pool is not http_client:
+        # The SDK takes a while to import; only pay for it once it is used
+        from openai import AsyncOpenAI
+        _client_pool = http_client
+        # Retries are handled by perplexity_upstream
+        _client = AsyncOpenAI(api_key=api_key, base_url=PERPLEXITY_BASE_URL, http_client=http_client, max_retries=0)
+    return _client
+
+def bill_locality(bill) -> str:
+    """
+    City/state the UCR rates should be looked up for. Only the locality is
+    sent upstream, never the patient's name, SSN or street address.
+    """
+    visit_info = bill.get("visit_info", {})
+    if visit_info.get("locality"):
+        return visit_info["locality"]
+    address = bill.get("patient_info", {}).get("address", "")
+    parts = [part.strip() for part in address.split(",") if part.strip()]
+    # Drop the street line, keep "City, State"
+    return ", ".join(parts[1:] if len(parts) > 1 else parts) or "United States"
 
-def search_ucr_rates(input_text):
+# A dollar amount: "$1,125" or "1,125.50", never a bare number such as a CPT code
+RATE_PATTERN = re.compile(r"\$\s?(\d[\d,]*(?:\.\d+)?)|(?<![\d.])(\d[\d,]*\.\d{2})(?![\d.])")
+
+def parse_rate(value) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = RATE_PATTERN.search(str(value))
+    return float((match.group(1) or match.group(2)).replace(",", "")) if match else None
+
+def parse_ucr_response(text: str, codes: List[str]) -> Dict[str, Optional[float]]:
+    """Pull {code: rate} out of the model's reply, tolerating prose around the JSON"""
+    rates = {}
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group())
+            data = data.get("ucr_rates", data)
+            rates = {str(code).upper(): parse_rate(rate) for code, rate in data.items()}
+        except (json.JSONDecodeError, AttributeError):
+            rates = {}
+    for code in codes:
+        if code not in rates:
+            # Fall back to "CODE ... $123.45" in free text
+            found = re.search(rf"{re.escape(code)}\D{{0,80}}?\$\s?(\d[\d,]*(?:\.\d+)?)", text)
+            rates[code] = float(found.group(1).replace(",", "")) if found else None
+    return {code: rates.get(code) for code in codes}
+
+async def _search_batch(codes: List[str], locality: str) -> Dict[str, Optional[float]]:
     messages = [
         {
             "role": "system",
@@ -21,24 +109,54 @@ def search_ucr_rates(input_text):
         },
         {
             "role": "user",
-            "content": f'''What are the standardized UCR rates for the procedure (or medical code) in {input_text}   
-            Search online and find as many sources available within the correct (same) city / state as the patient
-            and calculate the average. Use this as your reference point. Provide an output with only one sentence.
-            It should state the standardized UCR rate (the average) for the medical procedure in the city/state the user underwent it.
-            Make it clear that this is to be labelled and used as 'ucr_rate'.
+            "content": f'''What are the standardized UCR rates for the following procedure codes in {locality}?
+            Codes: {json.dumps(codes)}
+            Search online and find as many sources available within the same city / state
+            and calculate the average for each code. Use this as your reference point.
+            Respond with only a JSON object mapping each code to its average UCR rate in US dollars
+            as a number, e.g. {{"ucr_rates": {{"99213": 125.50}}}}. Use null when no rate can be found.
             '''
         }
     ]
 
-    try:
-        response = client.chat.completions.create(
-            model="llama-3.1-sonar-small-128k-online",
-            messages=messages,
-        )
-        # sys.stderr(response.choices[0].message.content)
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"An error occurred: {str(e)}"
+    async def send():
+        async with _semaphore:
+            return await get_client().chat.completions.create(
+                model=PERPLEXITY_MODEL,
+                messages=messages,
+            )
+
+    response = await perplexity_upstream.call(send, hedge=True)
+    return parse_ucr_response(response.choices[0].message.content, codes)
+
+async def search_ucr_rates(codes: List[str], locality: str) -> Dict[str, Optional[float]]:
+    """
+    UCR rate per procedure code in locality. Cached codes are answered
+    locally; all the others go upstream together in a single request.
+    """
+    codes = list(dict.fromkeys(code.strip().upper() for code in codes))
+    locality = locality.strip()
+    rates = {}
+    missing = []
+    cached = await asyncio.gather(*(ucr_cache.get(cache_key(code, locality.lower())) for code in codes))
+    for code, rate in zip(codes, cached):
+        if rate is None:
+            missing.append(code)
+        else:
+            rates[code] = rate
+
+    if missing:
+        try:
+            found = await _search_batch(missing, locality)
+        except Exception as e:
+            log_error("ucr_search_failed", e, codes=len(missing), locality=locality)
+            found = {}
+        for code in missing:
+            rate = found.get(code)
+            rates[code] = rate
+            if rate is not None:
+                await ucr_cache.set(cache_key(code, locality.lower()), rate)
+    return {code: rates.get(code) for code in codes}
 
 
 # result = search_ucr_rates(bill)
@@ -56,4 +174,4 @@ def search_ucr_rates(input_text):
 
 # Entry point for the script
 # if __name__ == "__main__":
-#     main()
\ No newline at end of file
+#     main()
@@ -0,0 +1,318 @@
+# services/pricing.py
+#
+# Bulk pricing of claim lines against the Medicare fee schedule, for audit
+# jobs over millions of historical lines. Everything works on whole
+# columns: codes are joined against the schedule with map() over a dict
+# and the arithmetic runs through operator functions, so no Python-level
+# code runs per line. Missing rates are NaN, which flows through the
+# arithmetic and never compares as an outlier.
+from typing import Dict, List, Optional, Sequence, Tuple
+from array import array
+from itertools import compress, repeat
+from operator import add, eq, gt, mul, ne, sub, truediv
+import bisect
+import csv
+import io
+import math
+import os
+import threading
+from .database import ReferenceData, get_reference_data, parse_payment_rate, parse_visit_date
+
+NAN = float("nan")
+
+# A billed line is "reasonable" when it is within these multiples of the
+# quantity-adjusted benchmark. Commercial prices commonly run 2-3x Medicare.
+MEDICARE_REASONABLE_MULTIPLE = float(os.getenv("MEDICARE_REASONABLE_MULTIPLE", "3.0"))
+UCR_REASONABLE_MULTIPLE = float(os.getenv("UCR_REASONABLE_MULTIPLE", "1.25"))
+
+# Largest /api/pricing/bulk request body; audit CSVs run to millions of lines
+MAX_BULK_PRICING_BYTES = int(os.getenv("MAX_BULK_PRICING_BYTES", str(1024 * 1024 * 1024)))
+
+# Header names accepted for each input column (case-insensitive)
+COLUMN_ALIASES = {
+    "code": ("code", "hcpcs", "hcpcs code", "cpt", "procedure_code"),
+    "quantity": ("quantity", "qty", "units"),
+    "billed": ("billed", "billed_cost", "charge", "charges", "amount"),
+    "date": ("date", "date_of_service", "date_of_visit", "service_date"),
+}
+
+class PricingInputError(ValueError):
+    pass
+
+class RateTable:
+    """
+    One fee schedule as sorted codes with a parallel array of rates (NaN
+    where a code has no rate). Joins go through a code -> rate dict built
+    from the two; the sorted arrays serve range scans.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        self.codes = sorted(rates)
+        self.rates = array("d", (rates[code] for code in self.codes))
+        self._rate_of = dict(zip(self.codes, self.rates))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def lookup(self, codes: Sequence[str]) -> List[float]:
+        return list(map(self._rate_of.get, codes, repeat(NAN)))
+
+    def range(self, first: str, last: str) -> List[Tuple[str, float]]:
+        """(code, rate) for every code between first and last inclusive"""
+        start = bisect.bisect_left(self.codes, first)
+        end = bisect.bisect_right(self.codes, last)
+        return list(zip(self.codes[start:end], self.rates[start:end]))
+
+def _rate(value) -> float:
+    # Zero-rate (packaged) codes have no standalone benchmark either
+    return float(value) if value else NAN
+
+class FeeSchedule:
+    """The current fee schedule and the historical ones of a reference-data snapshot"""
+
+    def __init__(self, data: ReferenceData):
+        self.data = data
+        self.current = RateTable({code: _rate(info["payment_rate"]) for code, info in data.medicare_rates.items()})
+        self.effective_dates = sorted({version[0] for versions in data.rate_history.values() for version in versions})
+        self._tables: Dict[str, RateTable] = {}
+        self._lock = threading.Lock()
+
+    def period(self, visit_date: Optional[str]) -> Optional[str]:
+        """Effective date of the schedule in force on visit_date; None for the current one"""
+        if not visit_date:
+            return None
+        position = bisect.bisect_right(self.effective_dates, visit_date)
+        return self.effective_dates[position - 1] if position else None
+
+    def table(self, period: Optional[str]) -> RateTable:
+        if period is None:
+            return self.current
+        table = self._tables.get(period)
+        if table is None:
+            with self._lock:
+                table = self._tables.get(period)
+                if table is None:
+                    table = self._tables[period] = self._build_table(period)
+        return table
+
+    def _build_table(self, period: str) -> RateTable:
+        rates = {}
+        for code, info in self.data.medicare_rates.items():
+            rates[code] = _rate(info["payment_rate"])
+        for code, versions in self.data.rate_history.items():
+            position = bisect.bisect_right(versions, (period, "\uffff"))
+            if position:
+                _, apc, payment_rate = versions[position - 1]
+                rates[code] = _rate(payment_rate) if apc else NAN
+        return RateTable(rates)
+
+    def rates(self, codes: Sequence[str], dates: Optional[Sequence[str]] = None) -> List[float]:
+        """Rate of every line, from the schedule in force on its date when given"""
+        if dates is None or not self.effective_dates:
+            return self.current.lookup(codes)
+        periods = {value: self.period(parse_visit_date(value)) for value in set(dates)}
+        used = set(periods.values())
+        if len(used) == 1:
+            return self.table(used.pop()).lookup(codes)
+        # Join on (period, code) so lines of every period resolve in one pass
+        joined = {}
+        for period in used:
+            table = self.table(period)
+            joined.update(zip(zip(repeat(period), table.codes), table.rates))
+        return list(map(joined.get, zip(map(periods.__getitem__, dates), codes), repeat(NAN)))
+
+_schedule: Optional[FeeSchedule] = None
+
+def get_fee_schedule() -> FeeSchedule:
+    """Fee schedule of the current reference-data snapshot, rebuilt after a reload"""
+    global _schedule
+    data = get_reference_data()
+    schedule = _schedule
+    if schedule is None or schedule.data is not data:
+        schedule = _schedule = FeeSchedule(data)
+    return schedule
+
+def bulk_price(codes: Sequence[str], quantities: Sequence[float], billed: Sequence[float],
+               dates: Optional[Sequence[str]] = None, threshold: float = MEDICARE_REASONABLE_MULTIPLE) -> Dict:
+    """
+    Price parallel columns of claim lines (billed is the line total).
+    Returns result columns of the same length, NaN where a code has no
+    Medicare rate, and totals. Outliers are lines billed at more than
+    threshold times the expected payment.
+    """
+    if not len(codes) == len(quantities) == len(billed) or (dates is not None and len(dates) != len(codes)):
+        raise PricingInputError("All columns must have the same length")
+    rates = get_fee_schedule().rates(codes, dates)
+    expected = list(map(mul, rates, quantities))
+    delta = list(map(sub, billed, expected))
+    try:
+        ratio = list(map(truediv, billed, expected))
+    except ZeroDivisionError:
+        # Zero rates are NaN and price_columns counts a zero quantity as 1,
+        # so only a direct call with a zero quantity gets here
+        ratio = [amount / payment if payment else NAN for amount, payment in zip(billed, expected)]
+    outlier = list(map(gt, ratio, repeat(threshold)))
+    # NaN != NaN, which picks out the priced lines without a Python loop
+    priced = list(map(eq, rates, rates))
+    return {
+        "columns": {
+            "code": codes,
+            "quantity": quantities,
+            "billed": billed,
+            "medicare_rate": rates,
+            "expected_payment": expected,
+            "delta": delta,
+            "ratio": ratio,
+            "outlier": outlier,
+        },
+        "summary": {
+            "lines": len(codes),
+            "priced": sum(priced),
+            "outliers": sum(outlier),
+            "billed": math.fsum(billed),
+            "billed_priced": math.fsum(compress(billed, priced)),
+            "expected_payment": math.fsum(compress(expected, priced)),
+            "threshold": threshold,
+        },
+    }
+
+# --- input and output ----------------------------------------------------
+
+# JSON values an amount may be given as; float() also takes booleans, which are not amounts
+AMOUNT_TYPES = {float, int, str, type(None)}
+
+def _amounts(values: Sequence, name: str, default: Optional[float] = None) -> List[float]:
+    if set(map(type, values)) - AMOUNT_TYPES:
+        line, value = next((line, value) for line, value in enumerate(values, start=1)
+                           if type(value) not in AMOUNT_TYPES)
+        raise PricingInputError(f"Line {line}: {name} {value!r} is not a number")
+    try:
+        amounts = list(map(float, values))
+    except (TypeError, ValueError):
+        # Slow path for "$1,234.00"-style amounts and blanks
+        amounts = []
+        for line, value in enumerate(values, start=1):
+            if value in (None, "") and default is not None:
+                amounts.append(default)
+                continue
+            amount = parse_payment_rate(str(value)) if value not in (None, "") else None
+            if amount is None:
+                raise PricingInputError(f"Line {line}: {name} {value!r} is not a number")
+            amounts.append(float(amount))
+    # float() reads "nan" and "inf", which would poison the totals
+    if not all(map(math.isfinite, amounts)):
+        line = next(line for line, amount in enumerate(amounts, start=1) if not math.isfinite(amount))
+        raise PricingInputError(f"Line {line}: {name} {values[line - 1]!r} is not a finite number")
+    return amounts
+
+def normalize_codes(codes: Sequence[str]) -> List[str]:
+    return list(map(str.upper, map(str.strip, map(str, codes))))
+
+def parse_csv_columns(text: str) -> Dict[str, list]:
+    """Columns of a CSV with a header row; see COLUMN_ALIASES for the names accepted"""
+    if '"' in text:
+        reader = csv.reader(io.StringIO(text))
+        header = next(reader, [])
+        rows = [row for row in reader if row]
+        columns = list(map(list, zip(*rows))) if rows else [[] for _ in header]
+        widths = set(map(len, rows))
+    else:
+        # Nothing quoted: split every field into one flat list and take the
+        # columns as strided slices, with no per-row objects to allocate
+        lines = list(filter(None, text.splitlines()))
+        header = lines[0].split(",") if lines else []
+        fields = ",".join(lines[1:]).split(",") if len(lines) > 1 else []
+        columns = [fields[i::len(header)] for i in range(len(header))]
+        widths = {count + 1 for count in set(map(str.count, lines[1:], repeat(",")))}
+    header = [name.strip().lower() for name in header]
+    positions = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in header:
+                positions[column] = header.index(alias)
+                break
+    if "code" not in positions or "billed" not in positions:
+        raise PricingInputError("CSV needs a code and a billed column")
+    if widths - {len(header)}:
+        raise PricingInputError(f"Every CSV row needs {len(header)} fields")
+    return {name: columns[position] for name, position in positions.items()}
+
+def price_columns(columns: Dict[str, Sequence]) -> Dict:
+    """bulk_price over raw input columns: code, billed and optional quantity and date"""
+    if "code" not in columns or "billed" not in columns:
+        raise PricingInputError("code and billed columns are required")
+    for name, values in columns.items():
+        if name in COLUMN_ALIASES and values is not None and not isinstance(values, (list, tuple)):
+            raise PricingInputError(f"{name} must be a list")
+    dates = columns.get("date")
+    if dates is not None and set(map(type, dates)) - {str, type(None)}:
+        raise PricingInputError("date values must be strings (YYYY-MM-DD) or null")
+    codes = normalize_codes(columns["code"])
+    billed = _amounts(columns["billed"], "billed")
+    if columns.get("quantity") is None:
+        quantities = [1.0] * len(codes)
+    else:
+        # Missing or zero quantities count as one unit
+        quantities = [quantity or 1.0 for quantity in _amounts(columns["quantity"], "quantity", default=1.0)]
+    return bulk_price(codes, quantities, billed, dates)
+
+# Derived columns, NaN on lines without a rate, and how to format them
+RESULT_FORMATS = {"medicare_rate": ".2f", "expected_payment": ".2f", "delta": ".2f", "ratio": ".3f"}
+
+def _unpriced(result: Dict) -> List[int]:
+    rates = result["columns"]["medicare_rate"]
+    return list(compress(range(len(rates)), map(ne, rates, rates)))
+
+def columns_to_json(result: Dict) -> Dict:
+    """NaN is not valid JSON: values of lines without a rate become null, the rest are rounded"""
+    unpriced = _unpriced(result)
+    columns = dict(result["columns"])
+    for name, spec in RESULT_FORMATS.items():
+        values = list(map(round, columns[name], repeat(3 if spec == ".3f" else 2)))
+        for i in unpriced:
+            values[i] = None
+        columns[name] = values
+    outlier = list(columns["outlier"])
+    for i in unpriced:
+        outlier[i] = None
+    columns["outlier"] = outlier
+    return {"columns": columns, "summary": result["summary"]}
+
+def _format_column(values: Sequence[float], spec: str) -> List[str]:
+    distinct = set(values)
+    if len(distinct) * 4 < len(values):
+        # Rates and quantities repeat: format each distinct value once
+        formatted = {value: format(value, spec) for value in distinct}
+        return list(map(formatted.__getitem__, values))
+    return list(map(format, values, repeat(spec)))
+
+def columns_to_csv(result: Dict) -> str:
+    """The result columns as CSV, blank where a line has no rate"""
+    columns = result["columns"]
+    unpriced = _unpriced(result)
+    cells = {}
+    for name, values in columns.items():
+        if name in RESULT_FORMATS or name == "outlier":
+            if name == "outlier":
+                cells[name] = list(map(("false", "true").__getitem__, values))
+            else:
+                cells[name] = _format_column(values, RESULT_FORMATS[name])
+            for i in unpriced:
+                cells[name][i] = ""
+        elif name == "code":
+            cells[name] = list(values)
+        else:
+            cells[name] = _format_column(values, ".2f" if name == "billed" else "g")
+    codes = "\x00".join(cells["code"])
+    if any(char in codes for char in ',"\n\r'):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(zip(*cells.values()))
+        return ",".join(cells) + "\n" + buffer.getvalue()
+    # Interleave the columns into one flat list and join it once; the last
+    # column carries the line break, and the comma after it is dropped
+    last = next(reversed(cells))
+    cells[last] = list(map(add, cells[last], repeat("\n")))
+    fields: List[Optional[str]] = [None] * (len(cells["code"]) * len(cells))
+    for i, values in enumerate(cells.values()):
+        fields[i::len(cells)] = values
+    return ",".join(cells) + "\n" + ",".join(fields).replace("\n,", "\n")
@@ -0,0 +1,232 @@
+# services/prompts.py
+#
+# Builds the Claude prompts out of compact CSV-like tables instead of
+# indented JSON and Python reprs, and keeps every stage's prompt within a
+# token budget. Prompt sizes are recorded per stage in prompt_metrics.
+#
+# A prompt is split into instructions, which are the same for every call of
+# a stage and go in the cacheable system prompt, and content, the bill data.
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+from collections import Counter
+import csv
+import io
+import json
+import os
+import re
+from .telemetry import prompt_tokens
+
+# Input-token budget per stage; table rows beyond it are omitted
+PROMPT_BUDGETS = {
+    "code_validation": int(os.getenv("CODE_VALIDATION_PROMPT_BUDGET", "2000")),
+    "ucr_validation": int(os.getenv("UCR_VALIDATION_PROMPT_BUDGET", "4000")),
+    "explanation": int(os.getenv("EXPLANATION_PROMPT_BUDGET", "4000")),
+}
+
+prompt_metrics: Dict[str, Dict[str, int]] = {}
+
+# Words, digit runs, indentation and single symbols, roughly as a BPE
+# tokenizer splits them
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d+|\s{2,}|[^\sA-Za-z\d]")
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate of the number of input tokens in text. Errs slightly high so
+    a prompt within budget locally is within budget upstream too.
+    """
+    tokens = 0
+    for piece in TOKEN_PATTERN.findall(text):
+        if piece[0].isalpha():
+            tokens += (len(piece) + 3) // 4
+        elif piece[0].isdigit():
+            tokens += (len(piece) + 2) // 3
+        else:
+            tokens += 1
+    return tokens
+
+def format_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    if isinstance(value, (dict, list)):
+        return compact_json(value)
+    return re.sub(r"\s+", " ", str(value)).strip()
+
+def compact_json(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def parse_json(text: str) -> Any:
+    """The JSON object in a model reply, or the reply itself if there is none"""
+    if not isinstance(text, str):
+        return text
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            return json.loads(match.group())
+        except json.JSONDecodeError:
+            pass
+    return text
+
+def table_columns(rows: Iterable[Dict], exclude: Iterable[str] = ()) -> List[str]:
+    """Keys of rows in first-seen order, minus excluded and all-empty columns"""
+    columns = {}
+    for row in rows:
+        for key, value in row.items():
+            if key not in exclude and value not in (None, "", []):
+                columns[key] = True
+    return list(columns)
+
+def table_rows(rows: Iterable[Dict], columns: List[str]) -> List[str]:
+    """One CSV line per row"""
+    lines = []
+    for row in rows:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="").writerow(format_value(row.get(column)) for column in columns)
+        lines.append(buffer.getvalue())
+    return lines
+
+def counted_rows(lines: List[str]) -> Optional[List[str]]:
+    """
+    The distinct lines in first-seen order, each ending in how many times
+    it appears, or None when every line is distinct. Identical line items
+    are duplicate charges: the count keeps them in the prompt.
+    """
+    counts = Counter(lines)
+    if len(counts) == len(lines):
+        return None
+    return [f"{line},{count}" for line, count in counts.items()]
+
+def counted_values(values: Iterable[Any]) -> List[str]:
+    """Distinct values in first-seen order, each repeated one followed by its count, e.g. 99999 (x2)"""
+    counts = Counter(format_value(value) for value in values)
+    return [value if count == 1 else f"{value} (x{count})" for value, count in counts.items()]
+
+class Prompt(NamedTuple):
+    """A stage prompt: static instructions (the cacheable prefix) and the variable content"""
+    instructions: str
+    content: str
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(part for part in self if part)
+
+class PromptBuilder:
+    """
+    Assembles a prompt from fixed text and tables. When the prompt exceeds
+    the stage's budget, rows are dropped from the end of the largest table
+    (callers put the rows that matter most first) and replaced with a count.
+    Instructions must not depend on the bill, or the cached prefix misses.
+    """
+
+    def __init__(self, stage: str, budget: Optional[int] = None):
+        self.stage = stage
+        self.budget = PROMPT_BUDGETS.get(stage, 4000) if budget is None else budget
+        self.instruction_lines: List[str] = []
+        self.sections: List[Any] = []
+
+    def instructions(self, text: str):
+        self.instruction_lines.append(text.strip())
+        return self
+
+    def text(self, text: str):
+        self.sections.append(text.strip())
+        return self
+
+    def table(self, title: str, rows: List[Dict], columns: Optional[List[str]] = None):
+        columns = columns or table_columns(rows)
+        if not rows or not columns:
+            self.sections.append(f"{title}: none")
+        else:
+            lines = table_rows(rows, columns)
+            counted = counted_rows(lines)
+            if counted is not None:
+                columns, lines = [*columns, "count"], counted
+            self.sections.append([f"{title} (CSV):", ",".join(columns), lines])
+        return self
+
+    def _render(self, kept: Dict[int, int]) -> str:
+        parts = []
+        for index, section in enumerate(self.sections):
+            if isinstance(section, str):
+                parts.append(section)
+                continue
+            title, header, lines = section
+            count = kept.get(index, len(lines))
+            body = lines[:count]
+            if count < len(lines):
+                body.append(f"... {len(lines) - count} more rows omitted")
+            parts.append("\n".join([title, header, *body]))
+        return "\n\n".join(parts)
+
+    def build(self) -> Prompt:
+        instructions = "\n".join(self.instruction_lines)
+        tables = {index: section for index, section in enumerate(self.sections) if not isinstance(section, str)}
+        kept = {index: len(section[2]) for index, section in tables.items()}
+        prompt = self._render(kept)
+        # The budget covers the whole prompt; only the tables can be trimmed
+        fixed_tokens = count_tokens(instructions)
+        tokens = fixed_tokens + count_tokens(prompt)
+        omitted = 0
+        if tokens > self.budget and tables:
+            # Row tokens are additive, so trim without re-rendering each time
+            row_tokens = {index: [count_tokens(line) for line in section[2]] for index, section in tables.items()}
+            table_tokens = {index: sum(counts) for index, counts in row_tokens.items()}
+            excess = tokens - self.budget + count_tokens("... 999 more rows omitted") * len(tables)
+            while excess > 0:
+                index = max(table_tokens, key=table_tokens.get)
+                if kept[index] == 0:
+                    break
+                kept[index] -= 1
+                table_tokens[index] -= row_tokens[index][kept[index]]
+                excess -= row_tokens[index][kept[index]]
+                omitted += 1
+            prompt = self._render(kept)
+            tokens = fixed_tokens + count_tokens(prompt)
+        self._record(tokens, omitted)
+        return Prompt(instructions, prompt)
+
+    def _record(self, tokens: int, omitted: int):
+        metrics = prompt_metrics.setdefault(self.stage, {
+            "prompts": 0, "tokens": 0, "max_tokens": 0, "truncated": 0, "rows_omitted": 0, "over_budget": 0,
+        })
+        metrics["prompts"] += 1
+        metrics["tokens"] += tokens
+        metrics["max_tokens"] = max(metrics["max_tokens"], tokens)
+        metrics["truncated"] += 1 if omitted else 0
+        metrics["rows_omitted"] += omitted
+        metrics["over_budget"] += 1 if tokens > self.budget else 0
+        prompt_tokens.observe(tokens, stage=self.stage)
+
+def prompt_stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        stage: {**metrics, "avg_tokens": round(metrics["tokens"] / metrics["prompts"], 1)}
+        for stage, metrics in prompt_metrics.items()
+        if metrics["prompts"]
+    }
+
+def add_result(builder: PromptBuilder, name: str, value: Any):
+    """
+    Add an earlier stage's result to a prompt: lists of records become
+    tables, lists of strings one line each, anything else compact JSON.
+    """
+    value = parse_json(value)
+    if isinstance(value, dict) and set(value) == {name}:
+        value = value[name]
+    if not isinstance(value, dict):
+        builder.text(f"{name}: {format_value(value)}")
+        return
+    lines = []
+    for key, item in value.items():
+        if isinstance(item, list) and item and all(isinstance(row, dict) for row in item):
+            if lines:
+                builder.text("\n".join(lines))
+                lines = []
+            builder.table(f"{name}.{key}", item, table_columns(item, exclude=("comments",)))
+        elif isinstance(item, list):
+            lines.append(f"{name}.{key}: {'; '.join(counted_values(item)) or 'none'}")
+        else:
+            lines.append(f"{name}.{key}: {format_value(item)}")
+    if lines:
+        builder.text("\n".join(lines))
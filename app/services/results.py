@@ -0,0 +1,45 @@
+# services/results.py
+#
+# Stored analyses, keyed by an idempotency key derived from the patient
+# fields and the content hashes of the uploaded files. A resubmitted bill
+# (a frontend retry, a refresh) gets the stored analysis back, and a
+# duplicate arriving while the first is still running waits for it
+# instead of starting another run.
+#
+# Analyses hold patient data. They stay in this process's memory unless
+# RESULT_STORE_PATH names a SQLite file, which should be somewhere only the
+# service can read; set it to keep them across restarts and to share them
+# between workers. GET /api/analyses/{key} has no auth of its own: anyone
+# who has a key can read its analysis, so treat keys as secrets.
+from typing import Any, Dict, Iterable
+import os
+from .cache import ResponseCache, cache_key
+
+# Bump when the shape of a stored analysis changes, so old entries are not served
+RESULT_VERSION = 1
+
+RESULT_STORE_PATH = os.getenv("RESULT_STORE_PATH", "")
+
+result_store = ResponseCache(
+    "analysis",
+    ttl=float(os.getenv("RESULT_STORE_TTL", str(30 * 86400))),
+    # Analyses are large; only the most recent stay in memory, the rest on disk
+    max_entries=int(os.getenv("RESULT_MEMORY_ENTRIES", "256")),
+    path=RESULT_STORE_PATH or None,
+    disk_max_entries=int(os.getenv("RESULT_STORE_MAX_ENTRIES", "100000")),
+)
+
+def idempotency_key(patient_info: Dict[str, str], upload_hashes: Iterable[str]) -> str:
+    """Same patient and same files, in any order, give the same key"""
+    return cache_key(
+        "analysis",
+        RESULT_VERSION,
+        patient_info["first_name"].strip().casefold(),
+        patient_info["last_name"].strip().casefold(),
+        patient_info["date_of_birth"].strip(),
+        sorted(upload_hashes),
+    )
+
+def is_complete(analysis: Any) -> bool:
+    """Only analyses where every stage succeeded are kept; partial ones are recomputed"""
+    return isinstance(analysis, dict) and not analysis.get("errors")
@@ -0,0 +1,58 @@
+# services/schemas.py
+#
+# Shapes of the Claude stage outputs. Each model doubles as the input
+# schema of the tool Claude is made to call, so replies arrive as JSON
+# that pydantic validates in one pass.
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+class CodeRecord(BaseModel):
+    code: str
+    description: str = ""
+    type: str = ""
+
+class CodeValidation(BaseModel):
+    valid_codes: List[CodeRecord] = Field(default_factory=list)
+    invalid_codes: List[str] = Field(default_factory=list)
+    discrepancies: List[str] = Field(default_factory=list, description="Codes that do not fit the bill or each other")
+    upcoding_risks: List[str] = Field(default_factory=list)
+    errors: List[str] = Field(default_factory=list)
+
+class ProcedureAssessment(BaseModel):
+    code: str
+    description: str = ""
+    billed_cost: float
+    medicare_rate: Optional[float] = None
+    ucr_rate: Optional[float] = None
+    is_reasonable: Optional[bool] = Field(None, description="null when there is no basis to judge the charge")
+    comments: str = ""
+
+class UCRValidation(BaseModel):
+    procedure_analysis: List[ProcedureAssessment]
+    overall_assessment: str
+    recommendations: List[str] = Field(default_factory=list)
+
+class CodeFindings(BaseModel):
+    issues_found: bool
+    details: List[str] = Field(default_factory=list)
+
+class PricingFindings(BaseModel):
+    concerns: List[str] = Field(default_factory=list)
+    recommendations: List[str] = Field(default_factory=list)
+
+class Explanation(BaseModel):
+    summary: str = Field(description="Brief overview of findings")
+    code_validation: CodeFindings
+    ucr_validation: PricingFindings
+    overall_recommendation: str
+
+# Tool name and description Claude sees for each stage's output model
+STAGE_TOOLS = {
+    "code_validation": (CodeValidation, "Record the result of validating the bill's procedure codes"),
+    "ucr_validation": (UCRValidation, "Record the assessment of each billed charge"),
+    "explanation": (Explanation, "Record the patient-facing explanation of the bill analysis"),
+}
+
+def tool_definition(stage: str):
+    model, description = STAGE_TOOLS[stage]
+    return {"name": f"record_{stage}", "description": description, "input_schema": model.model_json_schema()}
@@ -0,0 +1,186 @@
+# services/search.py
+#
+# In-memory search over procedure code descriptions: an inverted index of
+# description words, matched whole or by prefix through the sorted
+# vocabulary, a trigram index over that vocabulary to correct misspelt
+# words, and the sorted code list for prefix scans and typo correction.
+from typing import Dict, Iterable, List, Tuple
+from array import array
+from collections import Counter
+import bisect
+import heapq
+import re
+import string
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+CODE_QUERY_PATTERN = re.compile(r"^[A-Z0-9]{1,7}$")
+CODE_ALPHABET = string.digits + string.ascii_uppercase
+
+# Trigram similarity below which a vocabulary word is not taken as a
+# spelling of the query word, and how many such words to try
+MIN_WORD_SIMILARITY = 0.4
+MAX_SIMILAR_WORDS = 8
+
+def words(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+def trigrams(word: str) -> List[str]:
+    """Trigrams of a word padded with spaces, so short words still have some"""
+    padded = f"  {word} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+def looks_like_code(query: str) -> bool:
+    """A single token with a digit in it, like 9921, J0129 or 0001u"""
+    query = query.strip().upper()
+    return bool(CODE_QUERY_PATTERN.match(query)) and any(c.isdigit() for c in query)
+
+class CodeSearchIndex:
+    """
+    Built once per reference-data snapshot from (code, description, type)
+    entries. Documents are numbered by their position in the sorted code
+    list and words by their position in the sorted vocabulary; postings are
+    arrays of those numbers.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, str]]):
+        documents: Dict[str, Tuple[str, str]] = {}
+        for code, description, code_type in entries:
+            # The first entry for a code wins (CPT before HCPCS)
+            documents.setdefault(code, (description, code_type))
+        self.codes = sorted(documents)
+        self.descriptions = [documents[code][0] for code in self.codes]
+        self.types = [documents[code][1] for code in self.codes]
+        self._positions = {code: i for i, code in enumerate(self.codes)}
+
+        word_postings: Dict[str, array] = {}
+        for doc, description in enumerate(self.descriptions):
+            # "X-ray" is also indexed as "xray"
+            for word in set(words(description) + words(description.replace("-", ""))):
+                word_postings.setdefault(word, array("I")).append(doc)
+        self.vocabulary = sorted(word_postings)
+        self._word_postings = [word_postings[word] for word in self.vocabulary]
+        self._word_ids = {word: i for i, word in enumerate(self.vocabulary)}
+        self._trigram_postings: Dict[str, array] = {}
+        self._trigram_counts = array("B")
+        for word_id, word in enumerate(self.vocabulary):
+            word_trigrams = set(trigrams(word))
+            for trigram in word_trigrams:
+                self._trigram_postings.setdefault(trigram, array("I")).append(word_id)
+            self._trigram_counts.append(min(len(word_trigrams), 255))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def result(self, doc: int, match: str, score: float = 1.0) -> Dict:
+        return {
+            "code": self.codes[doc],
+            "description": self.descriptions[doc],
+            "type": self.types[doc],
+            "match": match,
+            "score": round(score, 3),
+        }
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """Codes matching query, best first: a code (prefix) or description words"""
+        query = query.strip()
+        if not query:
+            return []
+        if looks_like_code(query):
+            results = self.code_matches(query.upper(), limit)
+            if results:
+                return results
+        return self.description_matches(query, limit)
+
+    # --- codes ---------------------------------------------------------------
+
+    def prefix(self, prefix: str, limit: int = 10) -> List[int]:
+        """Documents whose code starts with prefix, in code order"""
+        start = bisect.bisect_left(self.codes, prefix)
+        end = bisect.bisect_left(self.codes, prefix + "\uffff", start, min(len(self.codes), start + limit))
+        return list(range(start, end))
+
+    def typo_neighbours(self, code: str) -> List[int]:
+        """Known codes one substituted or transposed character away from code"""
+        found = set()
+        for i in range(len(code)):
+            for c in CODE_ALPHABET:
+                if c != code[i]:
+                    doc = self._positions.get(code[:i] + c + code[i + 1:])
+                    if doc is not None:
+                        found.add(doc)
+            if i + 1 < len(code) and code[i] != code[i + 1]:
+                doc = self._positions.get(code[:i] + code[i + 1] + code[i] + code[i + 2:])
+                if doc is not None:
+                    found.add(doc)
+        return sorted(found)
+
+    def code_matches(self, code: str, limit: int = 10) -> List[Dict]:
+        doc = self._positions.get(code)
+        if doc is not None:
+            return [self.result(doc, "exact")]
+        results = [self.result(doc, "prefix") for doc in self.prefix(code, limit)]
+        if len(results) < limit:
+            results += [self.result(doc, "typo", 0.8) for doc in self.typo_neighbours(code)][:limit - len(results)]
+        return results
+
+    # --- descriptions --------------------------------------------------------
+
+    def similar_words(self, word: str) -> List[Tuple[float, int]]:
+        """(Dice similarity, word id) of vocabulary words spelt like word"""
+        word_trigrams = set(trigrams(word))
+        shared = Counter()
+        for trigram in word_trigrams:
+            postings = self._trigram_postings.get(trigram)
+            if postings is not None:
+                shared.update(postings)
+        size = len(word_trigrams)
+        counts = self._trigram_counts
+        scored = ((2 * hits / (size + counts[word_id]), word_id) for word_id, hits in shared.items())
+        return [(score, word_id) for score, word_id in heapq.nlargest(MAX_SIMILAR_WORDS, scored)
+                if score >= MIN_WORD_SIMILARITY]
+
+    def _word_matches(self, word: str, allow_prefix: bool) -> Tuple[Dict[int, float], str]:
+        """Documents matching one query word and how well, exactly or by prefix if possible"""
+        word_ids = []
+        word_id = self._word_ids.get(word)
+        if word_id is not None:
+            word_ids.append(word_id)
+        if allow_prefix:
+            start = bisect.bisect_left(self.vocabulary, word)
+            end = bisect.bisect_left(self.vocabulary, word + "\uffff", start)
+            word_ids.extend(i for i in range(start, end) if i != word_id)
+        if word_ids:
+            docs = dict.fromkeys((doc for i in word_ids for doc in self._word_postings[i]), 1.0)
+            return docs, "words"
+        docs: Dict[int, float] = {}
+        for score, word_id in self.similar_words(word):
+            for doc in self._word_postings[word_id]:
+                if docs.get(doc, 0) < score:
+                    docs[doc] = score
+        return docs, "fuzzy"
+
+    def description_matches(self, query: str, limit: int = 10) -> List[Dict]:
+        """
+        Documents ranked by how many query words their description matches.
+        A word matches exactly, by prefix (the last word always, so search
+        works as you type; others from three letters) or, when the word is
+        not in the vocabulary at all, through its closest spellings.
+        """
+        query_words = list(dict.fromkeys(words(query)))
+        if not query_words:
+            return []
+        scores: Dict[int, float] = {}
+        fuzzy = False
+        for i, word in enumerate(query_words):
+            docs, match = self._word_matches(word, allow_prefix=i == len(query_words) - 1 or len(word) >= 3)
+            fuzzy = fuzzy or match == "fuzzy"
+            for doc, score in docs.items():
+                scores[doc] = scores.get(doc, 0) + score
+        # Shorter descriptions match the query more closely
+        best = heapq.nsmallest(
+            limit, scores, key=lambda doc: (-scores[doc], len(self.descriptions[doc]), self.codes[doc]))
+        total = len(query_words)
+        return [
+            self.result(doc, "words" if scores[doc] == total and not fuzzy else "fuzzy", scores[doc] / total)
+            for doc in best
+        ]
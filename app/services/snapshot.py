@@ -0,0 +1,337 @@
+# services/snapshot.py
+#
+# Compact, versioned binary snapshot of the reference databases.
+#
+# The file is memory-mapped read-only, so every uvicorn worker on the host
+# shares the same page-cache pages instead of holding its own dict copies.
+#
+# Layout (little endian):
+#   header      magic(8s) version(H) table_count(I)
+#   directory   table_count x [name(16s) offset(Q)]
+#   table       rows(I) column_count(I) index_offset(Q) capacity(I),
+#               column_count x [name(16s) kind(B) offset(Q)]
+#   str column  uint32 offsets[rows + 1] followed by the utf-8 blob
+#   int column  int64 values[rows]  (-1 means "missing")
+#   hash index  uint32 slots[capacity], row + 1 or 0 when empty
+# The first column of every table is its key, kept sorted for range scans.
+# Point lookups go through the open-addressed hash index (crc32, linear probing).
+from typing import Optional, Dict, List, Mapping, Tuple, Iterator, Callable, Any
+from collections.abc import Mapping as MappingABC
+from decimal import Decimal
+from pathlib import Path
+import bisect
+import mmap
+import os
+import struct
+import zlib
+
+MAGIC = b"ADVREF\x00\x00"
+VERSION = 4
+
+_HEADER = struct.Struct("<8sHI")
+_DIRECTORY_ENTRY = struct.Struct("<16sQ")
+_TABLE_HEADER = struct.Struct("<IIQI")
+_COLUMN_ENTRY = struct.Struct("<16sBQ")
+_UINT32 = struct.Struct("<I")
+_INT64 = struct.Struct("<q")
+
+KIND_STR = 0
+KIND_INT = 1
+
+class SnapshotError(Exception):
+    pass
+
+def rate_to_cents(rate: Optional[Decimal]) -> int:
+    return -1 if rate is None else int((rate * 100).to_integral_value())
+
+def cents_to_rate(cents: int) -> Optional[Decimal]:
+    return None if cents < 0 else Decimal(cents).scaleb(-2)
+
+# --- writing -------------------------------------------------------------
+
+def _encode_str_column(values: List[str]) -> bytes:
+    blob = bytearray()
+    offsets = [0]
+    for value in values:
+        blob += value.encode("utf-8")
+        offsets.append(len(blob))
+    return struct.pack(f"<{len(offsets)}I", *offsets) + bytes(blob)
+
+def _encode_int_column(values: List[int]) -> bytes:
+    return struct.pack(f"<{len(values)}q", *values)
+
+def _encode_index(keys: List[str]) -> Tuple[int, bytes]:
+    capacity = 8
+    while capacity < 2 * len(keys):
+        capacity *= 2
+    slots = [0] * capacity
+    for row, key in enumerate(keys):
+        slot = zlib.crc32(key.encode("utf-8")) & (capacity - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (capacity - 1)
+        slots[slot] = row + 1
+    return capacity, struct.pack(f"<{capacity}I", *slots)
+
+def _encode_table(columns: List[Tuple[str, int, List[Any]]], base: int) -> bytes:
+    rows = len(columns[0][2])
+    header_size = _TABLE_HEADER.size + _COLUMN_ENTRY.size * len(columns)
+    bodies = []
+    entries = []
+    offset = base + header_size
+    for name, kind, values in columns:
+        if len(values) != rows:
+            raise SnapshotError(f"Column {name} has {len(values)} rows, expected {rows}")
+        body = _encode_str_column(values) if kind == KIND_STR else _encode_int_column(values)
+        # Keep int64 columns 8-byte aligned
+        padding = (-offset) % 8
+        offset += padding
+        bodies.append(b"\x00" * padding + body)
+        entries.append(_COLUMN_ENTRY.pack(name.encode(), kind, offset))
+        offset += len(body)
+    capacity, index = _encode_index(columns[0][2])
+    padding = (-offset) % 8
+    bodies.append(b"\x00" * padding + index)
+    index_offset = offset + padding
+    header = _TABLE_HEADER.pack(rows, len(columns), index_offset, capacity)
+    return header + b"".join(entries) + b"".join(bodies)
+
+def write_snapshot(tables: Dict[str, List[Tuple[str, int, List[Any]]]], path: Path) -> None:
+    """
+    Write tables of (column name, kind, values) to path. The first column of
+    each table must be its sorted, unique key. The file is replaced atomically.
+    """
+    for name, columns in tables.items():
+        keys = columns[0][2]
+        if any(a >= b for a, b in zip(keys, keys[1:])):
+            raise SnapshotError(f"Key column of table {name} is not sorted and unique")
+
+    offset = _HEADER.size + _DIRECTORY_ENTRY.size * len(tables)
+    directory = []
+    for name, columns in tables.items():
+        offset += (-offset) % 8
+        body = _encode_table(columns, offset)
+        directory.append((name, offset, body))
+        offset += len(body)
+
+    tmp_path = Path(f"{path}.tmp")
+    with open(tmp_path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, len(tables)))
+        for name, table_offset, _ in directory:
+            file.write(_DIRECTORY_ENTRY.pack(name.encode(), table_offset))
+        for _, table_offset, body in directory:
+            file.write(b"\x00" * (table_offset - file.tell()))
+            file.write(body)
+    os.replace(tmp_path, path)
+
+def compile_reference_tables(data) -> Dict:
+    """Turn a parsed ReferenceData into snapshot tables"""
+    def code_table(codes: Mapping[str, Dict]):
+        keys = sorted(codes)
+        return [
+            ("code", KIND_STR, keys),
+            ("description", KIND_STR, [codes[c]["description"] for c in keys]),
+        ]
+
+    medicare_rates = data.medicare_rates
+    apc_rates = data.apc_rates
+    medicare = sorted(medicare_rates)
+    apcs = sorted(apc_rates)
+    apc_keys = sorted(data.apc_codes)
+    history = sorted(data.rate_history)
+    return {
+        "cpt": code_table(data.cpt_codes),
+        "hcpcs": code_table(data.hcpcs_codes),
+        "icd10": code_table(data.icd10_codes),
+        "medicare": [
+            ("code", KIND_STR, medicare),
+            ("apc", KIND_STR, [medicare_rates[c]["apc"] for c in medicare]),
+            ("description", KIND_STR, [medicare_rates[c]["description"] for c in medicare]),
+            ("payment_cents", KIND_INT, [rate_to_cents(medicare_rates[c]["payment_rate"]) for c in medicare]),
+        ],
+        "apc": [
+            ("apc", KIND_STR, apcs),
+            ("title", KIND_STR, [apc_rates[a]["title"] for a in apcs]),
+            ("payment_cents", KIND_INT, [rate_to_cents(apc_rates[a]["payment_rate"]) for a in apcs]),
+        ],
+        "apc_codes": [
+            ("apc", KIND_STR, apc_keys),
+            ("codes", KIND_STR, [" ".join(data.apc_codes[a]) for a in apc_keys]),
+        ],
+        "rate_history": [
+            ("code", KIND_STR, history),
+            # "date apc cents" per version, oldest first, joined with ";"
+            ("versions", KIND_STR, [
+                ";".join(f"{effective} {apc or '-'} {rate_to_cents(rate)}" for effective, apc, rate in data.rate_history[c])
+                for c in history
+            ]),
+        ],
+    }
+
+# --- reading -------------------------------------------------------------
+
+class _StrColumn:
+    """Sequence view of a string column; bisect works on it directly"""
+
+    def __init__(self, buffer: memoryview, offset: int, rows: int):
+        self._buffer = buffer
+        self._offsets = offset
+        self._blob = offset + _UINT32.size * (rows + 1)
+        self._rows = rows
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def raw(self, index: int) -> bytes:
+        start, = _UINT32.unpack_from(self._buffer, self._offsets + 4 * index)
+        end, = _UINT32.unpack_from(self._buffer, self._offsets + 4 * index + 4)
+        return bytes(self._buffer[self._blob + start:self._blob + end])
+
+    __getitem__ = raw
+
+    def value(self, index: int) -> str:
+        return self.raw(index).decode("utf-8")
+
+class _IntColumn:
+    def __init__(self, buffer: memoryview, offset: int, rows: int):
+        self._buffer = buffer
+        self._offset = offset
+        self._rows = rows
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def value(self, index: int) -> int:
+        return _INT64.unpack_from(self._buffer, self._offset + 8 * index)[0]
+
+class SnapshotTable(MappingABC):
+    """Read-only mapping over one table of a memory-mapped snapshot"""
+
+    def __init__(self, layout: "_TableLayout", make_row: Callable[["SnapshotTable", int], Any]):
+        self.columns = layout.columns
+        self._keys = next(iter(layout.columns.values()))
+        self._buffer = layout.buffer
+        self._index_offset = layout.index_offset
+        self._mask = layout.capacity - 1
+        self._make_row = make_row
+
+    def index_of(self, key: str) -> int:
+        """Row number of key, or -1"""
+        encoded = key.encode("utf-8")
+        slot = zlib.crc32(encoded) & self._mask
+        while True:
+            row, = _UINT32.unpack_from(self._buffer, self._index_offset + 4 * slot)
+            if not row:
+                return -1
+            if self._keys.raw(row - 1) == encoded:
+                return row - 1
+            slot = (slot + 1) & self._mask
+
+    def bisect(self, key: str) -> int:
+        """Position of the first key >= key in sort order"""
+        return bisect.bisect_left(self._keys, key.encode("utf-8"))
+
+    def value(self, column: str, index: int):
+        return self.columns[column].value(index)
+
+    def __getitem__(self, key: str):
+        if not isinstance(key, str):
+            raise KeyError(key)
+        index = self.index_of(key)
+        if index < 0:
+            raise KeyError(key)
+        return self._make_row(self, index)
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, str) and self.index_of(key) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self._keys)):
+            yield self._keys.value(index)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+class _TableLayout:
+    def __init__(self, buffer, columns, index_offset, capacity):
+        self.buffer = buffer
+        self.columns = columns
+        self.index_offset = index_offset
+        self.capacity = capacity
+
+class Snapshot:
+    """A memory-mapped snapshot file and its tables"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        try:
+            with open(self.path, "rb") as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._read_directory(memoryview(self._mmap))
+        except (ValueError, struct.error) as e:
+            # Empty (mmap refuses it) or cut short
+            raise SnapshotError(f"{self.path} is truncated: {e}") from e
+
+    def _read_directory(self, buffer: memoryview):
+        magic, version, table_count = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"{self.path} is not a reference snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"{self.path} has snapshot version {version}, expected {VERSION}")
+
+        self.tables: Dict[str, _TableLayout] = {}
+        for i in range(table_count):
+            name, offset = _DIRECTORY_ENTRY.unpack_from(buffer, _HEADER.size + i * _DIRECTORY_ENTRY.size)
+            rows, column_count, index_offset, capacity = _TABLE_HEADER.unpack_from(buffer, offset)
+            columns = {}
+            for j in range(column_count):
+                column_name, kind, column_offset = _COLUMN_ENTRY.unpack_from(
+                    buffer, offset + _TABLE_HEADER.size + j * _COLUMN_ENTRY.size)
+                column_type = _StrColumn if kind == KIND_STR else _IntColumn
+                columns[column_name.rstrip(b"\x00").decode()] = column_type(buffer, column_offset, rows)
+            self.tables[name.rstrip(b"\x00").decode()] = _TableLayout(buffer, columns, index_offset, capacity)
+
+    def table(self, name: str, make_row: Callable[[SnapshotTable, int], Any]) -> SnapshotTable:
+        if name not in self.tables:
+            raise SnapshotError(f"{self.path} has no table {name}")
+        return SnapshotTable(self.tables[name], make_row)
+
+def _code_row(table: SnapshotTable, i: int) -> Dict:
+    return {"code": table.value("code", i), "description": table.value("description", i)}
+
+def _medicare_row(table: SnapshotTable, i: int) -> Dict:
+    return {
+        'code': table.value("code", i),
+        'apc': table.value("apc", i),
+        'description': table.value("description", i),
+        'payment_rate': cents_to_rate(table.value("payment_cents", i))
+    }
+
+def _apc_row(table: SnapshotTable, i: int) -> Dict:
+    return {
+        'apc': table.value("apc", i),
+        'title': table.value("title", i),
+        'payment_rate': cents_to_rate(table.value("payment_cents", i))
+    }
+
+def _apc_codes_row(table: SnapshotTable, i: int) -> Tuple[str, ...]:
+    return tuple(table.value("codes", i).split())
+
+def _rate_history_row(table: SnapshotTable, i: int) -> Tuple:
+    versions = []
+    for version in table.value("versions", i).split(";"):
+        effective, apc, cents = version.split(" ")
+        versions.append((effective, "" if apc == "-" else apc, cents_to_rate(int(cents))))
+    return tuple(versions)
+
+def open_reference_tables(path: Path) -> Dict[str, SnapshotTable]:
+    """Memory-map a compiled snapshot and return its tables as read-only mappings"""
+    snapshot = Snapshot(path)
+    return {
+        "cpt_codes": snapshot.table("cpt", _code_row),
+        "hcpcs_codes": snapshot.table("hcpcs", _code_row),
+        "icd10_codes": snapshot.table("icd10", _code_row),
+        "medicare_rates": snapshot.table("medicare", _medicare_row),
+        "apc_rates": snapshot.table("apc", _apc_row),
+        "apc_codes": snapshot.table("apc_codes", _apc_codes_row),
+        "rate_history": snapshot.table("rate_history", _rate_history_row),
+    }
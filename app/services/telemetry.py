@@ -0,0 +1,218 @@
+# services/telemetry.py
+#
+# Request IDs, counters and histograms exported in Prometheus text format,
+# and structured JSON logs. Each thread records into its own shard of a
+# metric, so observing takes no lock; shards are summed when /metrics is
+# scraped.
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import bisect
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Set per HTTP request (or job) and inherited by every task and thread it starts
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Use the caller's X-Request-ID when it looks sane, otherwise mint one"""
+    if incoming and len(incoming) <= 128 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex
+
+# --- metrics -------------------------------------------------------------
+
+_registry: List["_Metric"] = []
+_collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._local = threading.local()
+        self._shards: List[Dict] = []
+        self._shards_lock = threading.Lock()
+        _registry.append(self)
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # Taken once per thread, never per observation
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        totals: Dict[Tuple[str, ...], float] = {}
+        for shard in list(self._shards):
+            for key, value in list(shard.items()):
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        # [count per bucket..., count above the last bucket, sum]
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def values(self) -> Dict[Tuple[str, ...], List[float]]:
+        totals: Dict[Tuple[str, ...], List[float]] = {}
+        for shard in list(self._shards):
+            for key, counts in list(shard.items()):
+                total = totals.setdefault(key, [0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+        return totals
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation"""
+        counts = self.values().get(self._key(labels))
+        if not counts:
+            return None
+        target = q * sum(counts[:-1])
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts[:-1]):
+            seen += count
+            if seen >= target:
+                return bound
+        return math.inf
+
+def register_collector(collect):
+    """
+    collect() is called at scrape time and returns (name, type, help,
+    [(labels, value)]) tuples for values that live elsewhere, e.g. cache stats.
+    """
+    _collectors.append(collect)
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for key, value in sorted(metric.values().items()):
+            if metric.kind == "counter":
+                lines.append(f"{metric.name}{_labels(metric.labelnames, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (math.inf,), value[:-1]):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, key, le)} {cumulative}")
+            lines.append(f"{metric.name}_sum{_labels(metric.labelnames, key)} {_number(value[-1])}")
+            lines.append(f"{metric.name}_count{_labels(metric.labelnames, key)} {cumulative}")
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+http_request_seconds = Histogram(
+    "advocare_http_request_seconds", "HTTP request latency", ("method", "route", "status"))
+stage_seconds = Histogram(
+    "advocare_stage_seconds", "Analysis stage latency", ("stage", "outcome"))
+upstream_seconds = Histogram(
+    "advocare_upstream_seconds", "Latency of calls to upstream APIs", ("upstream", "outcome"))
+llm_tokens = Histogram(
+    "advocare_llm_tokens", "Tokens per Claude call as reported by the API", ("kind",), TOKEN_BUCKETS)
+llm_prompt_cache = Counter(
+    "advocare_llm_prompt_cache_total", "Claude calls by prompt-cache outcome (hit, write or none)",
+    ("stage", "outcome"))
+prompt_tokens = Histogram(
+    "advocare_prompt_tokens", "Estimated input tokens per built prompt", ("stage",), TOKEN_BUCKETS)
+reference_load_seconds = Histogram(
+    "advocare_reference_load_seconds", "Time to build the reference data", ("source",))
+
+# --- logs ----------------------------------------------------------------
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, tagged with the current request ID"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            "request_id": request_id_var.get(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+logger = logging.getLogger("advocare")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+def log_error(event: str, error: BaseException, **fields):
+    log_event(event, logging.ERROR, error=str(error), error_type=type(error).__name__, **fields)
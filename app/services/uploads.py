@@ -0,0 +1,158 @@
+# services/uploads.py
+#
+# Streams uploaded bill files to a content-addressed spool directory in
+# fixed-size chunks, so memory per request stays flat regardless of upload
+# size. Downstream stages read the spooled file through a memory map.
+from typing import Iterator, List
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+import asyncio
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+from fastapi import UploadFile
+
+UPLOAD_SPOOL_DIR = Path(os.getenv("UPLOAD_SPOOL_DIR", Path(tempfile.gettempdir()) / "advocare-uploads"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_REQUEST_UPLOAD_BYTES = int(os.getenv("MAX_REQUEST_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", "10"))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Spooled files older than this are removed by purge_spool
+UPLOAD_SPOOL_MAX_AGE = float(os.getenv("UPLOAD_SPOOL_MAX_AGE", str(24 * 3600)))
+
+class UploadTooLarge(Exception):
+    pass
+
+class UploadRejected(Exception):
+    pass
+
+# (magic prefix, content type), checked in order
+SIGNATURES = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+]
+
+def sniff_content_type(head: bytes) -> str:
+    """Content type from the file's leading bytes, ignoring the client's claim"""
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    try:
+        head.decode("utf-8")
+        return "text/plain"
+    except UnicodeDecodeError as e:
+        # A multi-byte character may straddle the end of the sniffed prefix
+        if e.start >= len(head) - 3:
+            return "text/plain"
+    return "application/octet-stream"
+
+@dataclass(frozen=True)
+class SpooledUpload:
+    filename: str
+    path: Path
+    sha256: str
+    size: int
+    content_type: str
+
+    @contextmanager
+    def view(self) -> Iterator[memoryview]:
+        """Read-only, zero-copy view of the file contents"""
+        if self.size == 0:
+            yield memoryview(b"")
+            return
+        with open(self.path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            yield view
+        finally:
+            view.release()
+            mapped.close()
+
+    def metadata(self):
+        return {
+            "filename": self.filename,
+            "sha256": self.sha256,
+            "size": self.size,
+            "content_type": self.content_type,
+        }
+
+async def spool_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledUpload:
+    """Copy one upload to the spool directory chunk by chunk, hashing as it goes"""
+    UPLOAD_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    fd, tmp_name = tempfile.mkstemp(dir=UPLOAD_SPOOL_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"{upload.filename} exceeds the {max_bytes} byte upload limit")
+                if len(head) < 512:
+                    head += chunk[:512 - len(head)]
+                digest.update(chunk)
+                await asyncio.to_thread(spool.write, chunk)
+
+        sha256 = digest.hexdigest()
+        path = UPLOAD_SPOOL_DIR / sha256
+        if path.exists():
+            # Same content was uploaded before; keep the existing copy
+            os.unlink(tmp_name)
+            os.utime(path)
+        else:
+            os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+    return SpooledUpload(
+        filename=upload.filename or sha256,
+        path=path,
+        sha256=sha256,
+        size=size,
+        content_type=sniff_content_type(head),
+    )
+
+async def ingest_uploads(files: List[UploadFile],
+                         max_request_bytes: int = MAX_REQUEST_UPLOAD_BYTES) -> List[SpooledUpload]:
+    """Spool every file of a request, enforcing the per-file and per-request caps"""
+    if not files:
+        raise UploadRejected("No files uploaded")
+    if len(files) > MAX_UPLOAD_FILES:
+        raise UploadRejected(f"Maximum {MAX_UPLOAD_FILES} files allowed")
+    spooled = []
+    remaining = max_request_bytes
+    for upload in files:
+        spooled_upload = await spool_upload(upload, min(MAX_UPLOAD_BYTES, remaining))
+        remaining -= spooled_upload.size
+        spooled.append(spooled_upload)
+    return spooled
+
+def purge_spool(max_age: float = UPLOAD_SPOOL_MAX_AGE) -> int:
+    """Delete spooled files not uploaded or used for max_age seconds"""
+    if not UPLOAD_SPOOL_DIR.exists():
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in UPLOAD_SPOOL_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
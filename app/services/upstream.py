@@ -0,0 +1,296 @@
+# services/upstream.py
+#
+# Shared guard for calls to the upstream APIs: an adaptive token bucket
+# sized to the account quota, retries with exponential backoff and full
+# jitter that honour Retry-After, a circuit breaker per upstream, and
+# optional hedging of slow idempotent calls.
+from typing import Awaitable, Callable, Optional, Tuple, Type, Union
+from collections import deque
+from email.utils import parsedate_to_datetime
+import asyncio
+import os
+import random
+import time
+from .telemetry import Counter, log_event, register_collector, upstream_seconds
+
+# Statuses worth retrying: timeouts, conflicts, rate limits, overload and 5xx.
+# Only 429 says we are over quota; 529 is the upstream itself being overloaded
+# and is left to backoff and the breaker.
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+THROTTLE_STATUSES = {429}
+
+# Processes serving the app (set by app.server). Account quotas are shared by
+# all of them, so each limits itself to its share.
+WORKER_PROCESSES = max(1, int(os.getenv("WORKER_PROCESSES", "1")))
+
+upstream_retries = Counter("advocare_upstream_retries_total", "Upstream attempts retried", ("upstream", "reason"))
+upstream_rejected = Counter("advocare_upstream_rejected_total", "Calls refused by an open circuit", ("upstream",))
+upstream_hedges = Counter("advocare_upstream_hedges_total", "Hedged attempts started and won", ("upstream", "outcome"))
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream that keeps failing"""
+
+def _env(prefix: str, name: str, default: str) -> str:
+    return os.getenv(f"{prefix}_{name}", default)
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTP status of an SDK or httpx error, if it has one"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the upstream asked us to wait, from Retry-After(-ms)"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+class TokenBucket:
+    """
+    Requests per second with bursts. The rate halves on every throttling
+    response and creeps back to the quota on success (AIMD), so we settle
+    just under whatever the upstream currently accepts.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 20
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttle(self):
+        if self.rate > 0:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def recover(self):
+        if self.rate > 0:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls
+    for reset_timeout seconds, then lets one trial call through (half-open).
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            # A failed trial re-opens the circuit for another full timeout
+            self.opened_at = time.monotonic()
+
+class Upstream:
+    """Rate limiting, retries, circuit breaking and hedging for one upstream API"""
+
+    def __init__(self, name: str, env_prefix: str, requests_per_minute: float = 0, burst: int = 10,
+                 max_retries: int = 3, hedge_after: float = 0,
+                 retryable_exceptions: Union[Tuple[Type[BaseException], ...],
+                                             Callable[[], Tuple[Type[BaseException], ...]]] = ()):
+        self.name = name
+        rpm = float(_env(env_prefix, "REQUESTS_PER_MINUTE", str(requests_per_minute))) / WORKER_PROCESSES
+        burst = -(-int(_env(env_prefix, "BURST", str(burst))) // WORKER_PROCESSES)
+        self.bucket = TokenBucket(rpm / 60, burst)
+        self.breaker = CircuitBreaker(
+            int(_env(env_prefix, "BREAKER_THRESHOLD", "5")),
+            float(_env(env_prefix, "BREAKER_RESET", "30")),
+        )
+        self.max_retries = int(_env(env_prefix, "MAX_RETRIES", str(max_retries)))
+        self.backoff_base = float(_env(env_prefix, "BACKOFF_BASE", "0.5"))
+        self.backoff_cap = float(_env(env_prefix, "BACKOFF_CAP", "20"))
+        # Hedge a call still running after this many seconds, or after the
+        # recent p95 latency when negative; 0 disables hedging
+        self.hedge_after = float(_env(env_prefix, "HEDGE_AFTER", str(hedge_after)))
+        # A callable is resolved on the first failure, so an SDK's exception
+        # classes can be named without importing the SDK at startup
+        self._retryable_exceptions = retryable_exceptions
+        self.latencies = deque(maxlen=200)
+        _upstreams.append(self)
+
+    # --- primitives, also used directly for streaming calls ----------------
+
+    async def admit(self):
+        """Wait for quota, or raise CircuitOpen if the upstream is failing"""
+        if not self.breaker.allow():
+            upstream_rejected.inc(upstream=self.name)
+            raise CircuitOpen(f"{self.name} is unavailable, retry in {self.breaker.reset_timeout:.0f}s")
+        await self.bucket.acquire()
+
+    def succeeded(self, seconds: float):
+        self.latencies.append(seconds)
+        self.breaker.record_success()
+        self.bucket.recover()
+        upstream_seconds.observe(seconds, upstream=self.name, outcome="ok")
+
+    @property
+    def retryable_exceptions(self) -> Tuple[Type[BaseException], ...]:
+        if callable(self._retryable_exceptions):
+            self._retryable_exceptions = self._retryable_exceptions()
+        return self._retryable_exceptions + (asyncio.TimeoutError, ConnectionError)
+
+    async def failed(self, error: BaseException, attempt: int, seconds: float, can_retry: bool = True) -> bool:
+        """
+        Record a failed attempt; sleep and return True if it should be
+        retried. Pass can_retry=False once a response has been partly used.
+        """
+        status = error_status(error)
+        upstream_seconds.observe(seconds, upstream=self.name, outcome="error")
+        retryable = status in RETRYABLE_STATUSES if status is not None else isinstance(error, self.retryable_exceptions)
+        if not retryable:
+            # The request itself is bad; the upstream is fine
+            self.breaker.trial_running = False
+            return False
+        self.breaker.record_failure()
+        if status in THROTTLE_STATUSES:
+            self.bucket.throttle()
+        if not can_retry or attempt >= self.max_retries or self.breaker.state == "open":
+            return False
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        wait = retry_after(error)
+        if wait is not None:
+            delay = max(delay, min(wait, self.backoff_cap))
+        reason = str(status) if status is not None else type(error).__name__
+        upstream_retries.inc(upstream=self.name, reason=reason)
+        log_event("upstream_retry", upstream=self.name, reason=reason, attempt=attempt + 1, delay=round(delay, 3))
+        await asyncio.sleep(delay)
+        return True
+
+    # --- whole calls -------------------------------------------------------
+
+    def _hedge_delay(self) -> Optional[float]:
+        if self.hedge_after > 0:
+            return self.hedge_after
+        if self.hedge_after < 0 and len(self.latencies) >= 20:
+            recent = sorted(self.latencies)
+            return recent[int(len(recent) * 0.95)]
+        return None
+
+    async def _attempt(self, call: Callable[[], Awaitable], hedge: bool):
+        delay = self._hedge_delay() if hedge else None
+        primary = asyncio.ensure_future(call())
+        tasks = [primary]
+        try:
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            # Only hedge with spare quota, never while the upstream is struggling
+            if done or self.breaker.state != "closed" or not self.bucket.try_acquire():
+                return await primary
+            upstream_hedges.inc(upstream=self.name, outcome="started")
+            hedged = asyncio.ensure_future(call())
+            tasks.append(hedged)
+            pending = {primary, hedged}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            upstream_hedges.inc(upstream=self.name, outcome="won")
+                        return task.result()
+            # Both failed; surface the primary's error
+            return primary.result()
+        finally:
+            # Also reached when our caller is cancelled: leave no attempt running
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Mark the loser's error as seen
+                    task.exception()
+
+    async def call(self, call: Callable[[], Awaitable], hedge: bool = False):
+        """
+        Run call() under the limiter and breaker, retrying transient
+        failures. hedge=True allows a second concurrent attempt when the
+        first is slow; only use it for idempotent requests.
+        """
+        attempt = 0
+        while True:
+            await self.admit()
+            start = time.perf_counter()
+            try:
+                result = await self._attempt(call, hedge)
+            except asyncio.CancelledError:
+                self.breaker.trial_running = False
+                raise
+            except Exception as e:
+                if await self.failed(e, attempt, time.perf_counter() - start):
+                    attempt += 1
+                    continue
+                raise
+            self.succeeded(time.perf_counter() - start)
+            return result
+
+_upstreams = []
+
+def _collect_upstream_metrics():
+    yield ("advocare_upstream_circuit_open", "gauge", "1 while the upstream's circuit is open",
+           [({"upstream": u.name}, 1 if u.breaker.state == "open" else 0) for u in _upstreams])
+    yield ("advocare_upstream_rate_limit", "gauge", "Current requests/s allowed by the adaptive limiter",
+           [({"upstream": u.name}, round(u.bucket.rate, 3)) for u in _upstreams if u.bucket.max_rate > 0])
+
+register_collector(_collect_upstream_metrics)
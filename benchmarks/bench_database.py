@@ -0,0 +1,62 @@
+# benchmarks/bench_database.py
+# Per-lookup latency of the reference data before (parse the files on every
+# call) and after (shared snapshot) with many concurrent requests.
+#
+#   python -m benchmarks.bench_database --concurrency 50 --lookups 20
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.services.database import (
+    load_cpt_database,
+    load_medicare_database,
+    get_reference_data,
+    get_cpt_code,
+    get_medicare_rate,
+)
+
+CODES = ["86152", "86153", "A9600", "C9159", "99999"]
+
+async def legacy_lookup(code):
+    # What get_cpt_code / get_medicare_rate did before the snapshot existed
+    return load_cpt_database().get(code), load_medicare_database().get(code)
+
+async def snapshot_lookup(code):
+    return await get_cpt_code(code), await get_medicare_rate(code)
+
+async def run(lookup, concurrency, lookups):
+    latencies = []
+
+    async def client(i):
+        for n in range(lookups):
+            start = time.perf_counter()
+            await lookup(CODES[(i + n) % len(CODES)])
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "lookups": len(latencies),
+        "mean_us": statistics.mean(latencies) * 1e6,
+        "p99_us": latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+        "lookups_per_sec": len(latencies) / elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--lookups", type=int, default=20)
+    args = parser.parse_args()
+
+    get_reference_data()
+    for name, lookup in (("per-call parse", legacy_lookup), ("snapshot", snapshot_lookup)):
+        result = asyncio.run(run(lookup, args.concurrency, args.lookups))
+        print(f"{name:>15}: {result['lookups']} lookups, mean {result['mean_us']:.1f}us, "
+              f"p99 {result['p99_us']:.1f}us, {result['lookups_per_sec']:.0f} lookups/s")
+
+if __name__ == "__main__":
+    main()
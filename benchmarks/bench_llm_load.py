@@ -0,0 +1,70 @@
+# benchmarks/bench_llm_load.py
+# Throughput of the LLM clients against a local stub server at increasing
+# concurrency, comparing the old blocking SDK client with the async one.
+#
+#   python -m benchmarks.bench_llm_load --latency 0.2
+import argparse
+import asyncio
+import itertools
+import os
+import time
+
+from benchmarks.stubs import spawn_server
+
+async def drive(call, concurrency, requests):
+    queue = iter(range(requests))
+
+    async def client():
+        for _ in queue:
+            await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--requests-per-client", type=int, default=3)
+    args = parser.parse_args()
+
+    base_url, stub = spawn_server(latency=args.latency)
+    os.environ.update({
+        "ANTHROPIC_API_KEY": "stub",
+        "PERPLEXITY_API_KEY": "stub",
+        "ANTHROPIC_BASE_URL": base_url,
+        "PERPLEXITY_BASE_URL": base_url,
+    })
+    from anthropic import Client
+    from app.services.claude import analyze_with_claude
+    from app.services.perplexity import search_ucr_rates
+    from app.services.http import close_http_client
+
+    counter = itertools.count()
+    blocking = Client(api_key="stub", base_url=base_url)
+
+    async def blocking_call():
+        # What analyze_with_claude did before: a sync SDK call on the event loop
+        blocking.messages.create(model="stub", max_tokens=10, messages=[{"role": "user", "content": "hi"}])
+
+    async def async_call():
+        # Fresh prompt/code per call so the response caches don't short-circuit upstream
+        n = next(counter)
+        await asyncio.gather(analyze_with_claude(f"hi {n}"), search_ucr_rates([f"C{n}"], "Anytown, USA"))
+
+    async def run():
+        for concurrency in (1, 10, 100):
+            requests = concurrency * args.requests_per_client
+            before = await drive(blocking_call, concurrency, min(requests, 30))
+            after = await drive(async_call, concurrency, requests)
+            print(f"concurrency {concurrency:>3}: blocking client {before:7.1f} req/s, "
+                  f"async clients {after:7.1f} req/s")
+        await close_http_client()
+
+    try:
+        asyncio.run(run())
+    finally:
+        stub.terminate()
+
+if __name__ == "__main__":
+    main()
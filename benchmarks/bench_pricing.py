@@ -0,0 +1,73 @@
+# benchmarks/bench_pricing.py
+# Lines per second of bulk pricing against the Medicare fee schedule: the
+# columnar join and arithmetic, the same join by binary search, the
+# per-bill price_lines path, and CSV parsing and output around them.
+#
+#   python -m benchmarks.bench_pricing --lines 1000000
+import argparse
+import bisect
+import random
+import time
+
+from app.services.database import get_reference_data
+from app.services.pricing import (
+    bulk_price, columns_to_csv, columns_to_json, get_fee_schedule, parse_csv_columns, price_columns
+)
+
+def make_lines(count: int):
+    """Claim lines over the schedule's codes, 5% of them unknown"""
+    rng = random.Random(0)
+    codes = list(get_reference_data().medicare_rates)
+    line_codes = [rng.choice(codes) if rng.random() > 0.05 else f"Z{rng.randint(1000, 9999)}" for _ in range(count)]
+    quantities = [float(rng.choice((1, 1, 1, 2, 3))) for _ in range(count)]
+    billed = [round(rng.uniform(10, 5000), 2) for _ in range(count)]
+    return line_codes, quantities, billed
+
+def bisect_join(table, codes):
+    """RateTable.lookup by binary search over the sorted codes instead of a dict"""
+    result = []
+    for code in codes:
+        i = bisect.bisect_left(table.codes, code)
+        result.append(table.rates[i] if i < len(table.codes) and table.codes[i] == code else float("nan"))
+    return result
+
+def timed(label, lines, run):
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    print(f"{label:>34}: {elapsed * 1000:8.1f}ms  {lines / elapsed:>12,.0f} lines/s")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--legacy-lines", type=int, default=100_000, help="lines for the slower per-bill path")
+    args = parser.parse_args()
+
+    schedule = get_fee_schedule()
+    codes, quantities, billed = make_lines(args.lines)
+    n = args.lines
+    print(f"{n:,} lines, {len(schedule.current):,} codes in the schedule, "
+          f"{len(schedule.effective_dates)} historical schedules")
+
+    timed("join: dict via map()", n, lambda: schedule.current.lookup(codes))
+    timed("join: bisect per line", n, lambda: bisect_join(schedule.current, codes))
+    result = timed("bulk_price (join + arithmetic)", n, lambda: bulk_price(codes, quantities, billed))
+    if schedule.effective_dates:
+        dates = [schedule.effective_dates[i % len(schedule.effective_dates)] for i in range(n)]
+        timed("bulk_price with dates of service", n, lambda: bulk_price(codes, quantities, billed, dates))
+
+    from app.services.bill_analyzer import price_lines
+    m = min(args.legacy_lines, n)
+    timed("price_lines (per-bill path)", m, lambda: price_lines(codes[:m], quantities[:m], billed[:m], [None] * m))
+
+    text = "code,quantity,billed\n" + "\n".join(f"{c},{q:g},{b}" for c, q, b in zip(codes, quantities, billed))
+    columns = timed("parse CSV", n, lambda: parse_csv_columns(text))
+    timed("price_columns (parse amounts + price)", n, lambda: price_columns(columns))
+    timed("JSON columns out", n, lambda: columns_to_json(result))
+    timed("CSV out", n, lambda: columns_to_csv(result))
+    summary = result["summary"]
+    print(f"priced {summary['priced']:,} of {summary['lines']:,} lines, {summary['outliers']:,} outliers")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_prompt_cache.py
+# Input tokens billed for the three Claude stages over a run of bills
+# against the local stub, with and without the static instructions and
+# tool schema marked as a cached prefix. Cache writes cost 1.25x and reads
+# 0.1x an uncached input token. The API ignores prefixes shorter than
+# 1024 tokens; lower --cache-min-tokens to see the effect on short ones.
+#
+#   python -m benchmarks.bench_prompt_cache --bills 20 --lines 10
+import argparse
+import asyncio
+import os
+
+from benchmarks.stubs import CACHE_MIN_TOKENS, spawn_server
+
+CACHE_WRITE_PRICE = 1.25
+CACHE_READ_PRICE = 0.1
+
+def bill_prompts(bill_number, lines):
+    from app.services.bill_analyzer import code_validation_prompt, explanation_prompt, price_bills, ucr_validation_prompt
+    from app.services.codes import get_code_engine
+    from benchmarks.bench_prompts import make_bill
+
+    bill = make_bill(lines)
+    for procedure in bill["billing_details"]["procedure_codes"]:
+        procedure["description"] += f" (bill {bill_number})"
+    engine = get_code_engine()
+    codes = [procedure["code"] for procedure in bill["billing_details"]["procedure_codes"]]
+    valid_codes = [info for info in map(engine.lookup, codes) if info is not None]
+    invalid_codes = [code for code in codes if engine.lookup(code) is None]
+    pricing = price_bills([bill], [{}])[0]
+    results = [{"code_validation": {"valid_codes": valid_codes, "invalid_codes": invalid_codes}},
+               {"ucr_validation": pricing}]
+    return {
+        "code_validation": code_validation_prompt(valid_codes, invalid_codes),
+        "ucr_validation": ucr_validation_prompt(pricing),
+        "explanation": explanation_prompt(results),
+    }
+
+async def run(bills, lines):
+    from app.services.claude import structured_with_claude
+
+    for n in range(bills):
+        for stage, prompt in bill_prompts(n, lines).items():
+            await structured_with_claude(stage, prompt)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bills", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=10)
+    parser.add_argument("--cache-min-tokens", type=int, default=CACHE_MIN_TOKENS)
+    args = parser.parse_args()
+
+    base_url, stub = spawn_server(latency=0, cache_min_tokens=args.cache_min_tokens)
+    os.environ.update({
+        "ANTHROPIC_API_KEY": "stub",
+        "ANTHROPIC_BASE_URL": base_url,
+        "CLAUDE_REQUESTS_PER_MINUTE": "100000",
+        # No response cache, so both runs send every prompt upstream
+        "LLM_CACHE_MAX_ENTRIES": "0",
+        "LLM_CACHE_PATH": "",
+        "CACHE_PATH": "",
+    })
+    from app.services import claude
+    from app.services.http import close_http_client
+
+    async def compare():
+        print(f"{'caching':<9}{'uncached':>10}{'cache read':>12}{'cache write':>13}{'billed as':>11}")
+        baseline = None
+        for caching in (False, True):
+            claude.CLAUDE_PROMPT_CACHING = caching
+            for field in claude.token_usage:
+                claude.token_usage[field] = 0
+            await run(args.bills, args.lines)
+            usage = claude.token_usage
+            billed = (usage["input_tokens"] + usage["cache_creation_input_tokens"] * CACHE_WRITE_PRICE
+                      + usage["cache_read_input_tokens"] * CACHE_READ_PRICE)
+            baseline = baseline or billed
+            print(f"{'on' if caching else 'off':<9}{usage['input_tokens']:>10}{usage['cache_read_input_tokens']:>12}"
+                  f"{usage['cache_creation_input_tokens']:>13}{billed:>11.0f}  ({billed / baseline:.0%})")
+        await close_http_client()
+
+    try:
+        asyncio.run(compare())
+    finally:
+        stub.terminate()
+
+if __name__ == "__main__":
+    main()
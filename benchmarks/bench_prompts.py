@@ -0,0 +1,135 @@
+# benchmarks/bench_prompts.py
+# Estimated input tokens per Claude stage for bills of growing size, with
+# the previous prompts (indented JSON, Python reprs, whole prior replies)
+# against the compact, budgeted ones from services/prompts.py.
+#
+#   python -m benchmarks.bench_prompts --lines 2 20 200
+import argparse
+import json
+
+from app.services.bill_analyzer import (
+    price_bills,
+    code_validation_prompt,
+    ucr_validation_prompt,
+    explanation_prompt,
+)
+from app.services.codes import get_code_engine
+from app.services.database import get_reference_data
+from app.services.prompts import count_tokens, prompt_metrics
+
+def make_bill(lines):
+    data = get_reference_data()
+    codes = list(data.medicare_rates)[:lines]
+    procedures = [
+        # Every fifth line is an unknown code, so UCR validation needs Claude
+        {"code": "Z999" + str(i % 10) if i % 5 == 4 else code, "description": f"Procedure {i}",
+         "quantity": 1 + i % 3, "cost": 100.0 + i * 17}
+        for i, code in enumerate(codes)
+    ]
+    return {"patient_info": {}, "visit_info": {}, "billing_details": {"procedure_codes": procedures}}
+
+def legacy_code_prompt(valid_codes, invalid_codes):
+    return (
+        f"Analyze the following procedure codes and check for any discrepancies:\n\n"
+        f"Valid Codes:\n{valid_codes}\n"
+        f"Invalid Codes:\n{invalid_codes}\n\n"
+        "Provide your analysis in the following JSON format:\n"
+        "{\n"
+        '  "code_validation": {\n'
+        '    "valid_codes": [{"code": "...", "description": "...", "type": "..."}],\n'
+        '    "invalid_codes": ["..."],\n'
+        '    "discrepancies": ["..."],\n'
+        '    "upcoding_risks": ["..."],\n'
+        '    "errors": ["..."]\n'
+        "  }\n"
+        "}\n\n"
+    )
+
+def legacy_ucr_prompt(pricing):
+    return f"""
+    Analyze the following medical bill information. Lines with is_reasonable
+    null have no Medicare or UCR benchmark; judge those from the description.
+
+    Pricing Analysis:
+    {json.dumps(pricing["procedure_analysis"], indent=2)}
+
+    Provide your analysis in the following JSON format:
+    {{
+        "ucr_validation": {{
+            "procedure_analysis": [
+                {{
+                    "code": "...",
+                    "description": "...",
+                    "billed_cost": 0,
+                    "medicare_rate": 0,
+                    "ucr_rate": 0,
+                    "is_reasonable": true/false,
+                    "comments": "..."
+                }}
+            ],
+            "overall_assessment": "...",
+            "recommendations": ["..."]
+        }}
+    }}
+    """
+
+def legacy_explanation_prompt(results):
+    report = "Explanation Summary:\n"
+    for result in results:
+        for key, value in result.items():
+            report += f"{key}: {value}\n"
+    return f"""
+    Please analyze this medical bill report and provide a structured response:
+
+    {report}
+
+    Provide your analysis in the following JSON format:
+    {{
+        "summary": "Brief overview of findings",
+        "code_validation": {{
+            "issues_found": true/false,
+            "details": ["..."]
+        }},
+        "ucr_validation": {{
+            "concerns": ["..."],
+            "recommendations": ["..."]
+        }},
+        "overall_recommendation": "..."
+    }}
+    """
+
+def measure(lines):
+    bill = make_bill(lines)
+    engine = get_code_engine()
+    codes = [procedure["code"] for procedure in bill["billing_details"]["procedure_codes"]]
+    valid_codes = [info for info in map(engine.lookup, codes) if info is not None]
+    invalid_codes = [code for code in codes if engine.lookup(code) is None]
+    pricing = price_bills([bill], [{}])[0]
+    # What Claude's code_validation reply looks like: the same records, pretty-printed
+    code_reply = json.dumps({"code_validation": {"valid_codes": valid_codes, "invalid_codes": invalid_codes,
+                                                 "discrepancies": [], "upcoding_risks": [], "errors": []}}, indent=2)
+    results = [{"code_validation": code_reply}, {"ucr_validation": pricing}]
+
+    legacy = (legacy_code_prompt(valid_codes, invalid_codes), legacy_ucr_prompt(pricing),
+              legacy_explanation_prompt(results))
+    prompt_metrics.clear()
+    compact = (code_validation_prompt(valid_codes, invalid_codes), ucr_validation_prompt(pricing),
+               explanation_prompt(results))
+    truncated = sum(metrics["rows_omitted"] for metrics in prompt_metrics.values())
+    return [count_tokens(prompt) for prompt in legacy], [count_tokens(prompt.text) for prompt in compact], truncated
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, nargs="+", default=[2, 20, 200])
+    args = parser.parse_args()
+
+    print(f"{'lines':>5}  {'stage':<16}{'before':>8}{'after':>8}{'saved':>8}")
+    for lines in args.lines:
+        legacy, compact, omitted = measure(lines)
+        for stage, before, after in zip(("code_validation", "ucr_validation", "explanation"), legacy, compact):
+            print(f"{lines:>5}  {stage:<16}{before:>8}{after:>8}{1 - after / before:>8.0%}")
+        print(f"{lines:>5}  {'total':<16}{sum(legacy):>8}{sum(compact):>8}{1 - sum(compact) / sum(legacy):>8.0%}"
+              f"  ({omitted} rows omitted by the budget)")
+
+if __name__ == "__main__":
+    main()
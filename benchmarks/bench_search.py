@@ -0,0 +1,45 @@
+# benchmarks/bench_search.py
+# Build time of the code search index and per-query latency for code
+# prefixes, typos, description words and misspellings.
+#
+#   python -m benchmarks.bench_search --repeat 1000
+import argparse
+import statistics
+import time
+
+from app.services.codes import get_code_engine
+
+QUERIES = {
+    "exact code": ["99213", "J0120", "86152"],
+    "code prefix": ["9921", "J01", "C91"],
+    "mistyped code": ["8615Z", "99O13", "J012"],
+    "description": ["frozen blood", "mri brain", "x-ray chest", "office visit"],
+    "misspelt": ["cell enumaration", "colonoscpy", "ambulanse"],
+}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = get_code_engine()
+    start = time.perf_counter()
+    index = engine.search_index()
+    print(f"index: {len(index)} codes, {len(index.vocabulary)} words, built in "
+          f"{(time.perf_counter() - start) * 1000:.0f}ms")
+    for kind, queries in QUERIES.items():
+        latencies = []
+        for _ in range(args.repeat):
+            for query in queries:
+                start = time.perf_counter()
+                engine.search(query, args.limit)
+                latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        top = engine.search(queries[0], 1)
+        print(f"{kind:>15}: mean {statistics.mean(latencies) * 1e6:7.1f}us, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1e6:7.1f}us   "
+              f"{queries[0]!r} -> {top[0]['code'] if top else None}")
+
+if __name__ == "__main__":
+    main()
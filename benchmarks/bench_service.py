@@ -0,0 +1,259 @@
+# benchmarks/bench_service.py
+# End-to-end load test. The app runs under uvicorn in its own process with
+# every upstream API (Anthropic, Perplexity, NLM) pointed at the stub
+# server, and is driven at increasing concurrency. Reports p50/p95/p99
+# latency, requests/s and the app's CPU and RSS (summed over its worker
+# processes), and writes them as JSON so runs can be compared. --workers
+# runs the app under app.server at each worker count in turn.
+#
+#   python -m benchmarks.bench_service --concurrency 1 10 50 --requests 200 --output after.json
+#   python -m benchmarks.bench_service --workers 1 2 4 8 --concurrency 50 --endpoints /api/analyze
+#   python -m benchmarks.bench_service --compare before.json after.json
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.stubs import LATENCY_DISTRIBUTIONS, free_port, spawn_server
+
+ENDPOINTS = ("/api/analyze", "/api/analyze/stream")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+def spawn_app(stub_url: str, env: dict, workers: int = 0):
+    """Run app.main under uvicorn (or app.server with workers) with its upstreams pointed at the stub"""
+    port = free_port()
+    if workers:
+        command = ["app.server", "--workers", str(workers)]
+    else:
+        command = ["uvicorn", "app.main:app"]
+    process = subprocess.Popen(
+        [sys.executable, "-m", *command, "--port", str(port), "--log-level", "warning"],
+        env={
+            **os.environ,
+            "ANTHROPIC_API_KEY": "stub",
+            "PERPLEXITY_API_KEY": "stub",
+            "ANTHROPIC_BASE_URL": stub_url,
+            "PERPLEXITY_BASE_URL": stub_url,
+            "NLM_BASE_URL": stub_url,
+            "CODE_VALIDATION_REMOTE": "1",
+            "LOG_LEVEL": "WARNING",
+            **env,
+        },
+        # Its own process group, so extraction pool workers are stopped with it
+        start_new_session=True,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    while True:
+        try:
+            httpx.get(f"{base_url}/metrics")
+            return base_url, process
+        except httpx.TransportError:
+            if process.poll() is not None:
+                raise RuntimeError("App exited during startup")
+            time.sleep(0.1)
+
+def stop_app(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def process_usage(pid: int):
+    """(CPU seconds used so far, current RSS in MB, peak RSS in MB) of a process"""
+    with open(f"/proc/{pid}/stat") as file:
+        # Fields after the parenthesised command name; utime and stime are 14 and 15
+        fields = file.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    status = dict(line.split(":", 1) for line in open(f"/proc/{pid}/status"))
+    return cpu, int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+
+def proportional_set_mb(pid: int) -> float:
+    """PSS: RSS with each shared page split between the processes mapping it"""
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        return next(int(line.split()[1]) for line in file if line.startswith("Pss:")) / 1024
+
+def group_usage(pgid: int):
+    """process_usage and PSS summed over the live processes of a process group (the app, its workers and pools)"""
+    total = [0.0, 0.0, 0.0, 0.0]
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            if os.getpgid(int(entry)) != pgid:
+                continue
+            usage = (*process_usage(int(entry)), proportional_set_mb(int(entry)))
+        except (ProcessLookupError, FileNotFoundError):
+            continue
+        total = [a + b for a, b in zip(total, usage)]
+    return tuple(total)
+
+def make_bills(count: int, lines: int):
+    """Distinct text bills, so the response caches see a realistic mix of hits and misses"""
+    from app.services.database import get_reference_data
+
+    codes = list(get_reference_data().medicare_rates)[:500]
+    rng = random.Random(0)
+    bills = []
+    for _ in range(count):
+        rows = [f"{code}  Procedure  {rng.randint(1, 3)}  ${rng.randint(50, 5000)}.00"
+                for code in rng.sample(codes, lines)]
+        bills.append(("Statement of charges\n" + "\n".join(rows) + "\n").encode())
+    return bills
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+async def drive(base_url, endpoint, bills, concurrency, requests):
+    latencies = []
+    errors = {}
+    counter = iter(range(requests))
+
+    async def client(http):
+        for n in counter:
+            start = time.perf_counter()
+            try:
+                response = await http.post(
+                    base_url + endpoint,
+                    files={"files": ("bill.txt", bills[n % len(bills)], "text/plain")},
+                    data={"firstName": "Load", "lastName": "Test", "dateOfBirth": "1990-01-01"},
+                )
+                # The stream always answers 200; failures arrive as an error event
+                failed = response.status_code != 200 or "event: error" in response.text
+                outcome = f"http_{response.status_code}" if response.status_code != 200 else "error_event"
+            except httpx.HTTPError as e:
+                failed, outcome = True, type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if failed:
+                errors[outcome] = errors.get(outcome, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return latencies, errors, elapsed
+
+def run_level(base_url, pid, endpoint, bills, concurrency, requests, workers=0):
+    cpu_before = group_usage(pid)[0]
+    latencies, errors, elapsed = asyncio.run(drive(base_url, endpoint, bills, concurrency, requests))
+    cpu_after, rss_mb, peak_rss_mb, pss_mb = group_usage(pid)
+    return {
+        "workers": workers,
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "cpu_seconds": round(cpu_after - cpu_before, 2),
+        "cpu_percent": round((cpu_after - cpu_before) / elapsed * 100, 1),
+        "rss_mb": round(rss_mb, 1),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "pss_mb": round(pss_mb, 1),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def print_results(results):
+    print(f"{'workers':>7} {'endpoint':<22}{'conc':>5}{'reqs':>6}{'errs':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'req/s':>8}{'cpu%':>7}{'rss MB':>8}{'pss MB':>8}")
+    for r in results:
+        print(f"{r.get('workers', 0):>7} {r['endpoint']:<22}{r['concurrency']:>5}{r['requests']:>6}{r['errors']:>6}{r['p50_ms']:>9}"
+              f"{r['p95_ms']:>9}{r['p99_ms']:>9}{r['requests_per_sec']:>8}{r['cpu_percent']:>7}{r['rss_mb']:>8}{r.get('pss_mb', ''):>8}")
+
+def compare(before_path, after_path):
+    """Per (endpoint, concurrency) change in latency and throughput between two result files"""
+    with open(before_path) as file:
+        before = {(r.get("workers", 0), r["endpoint"], r["concurrency"]): r for r in json.load(file)["results"]}
+    with open(after_path) as file:
+        after = json.load(file)["results"]
+    print(f"{'endpoint':<22}{'conc':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}")
+    for r in after:
+        old = before.get((r.get("workers", 0), r["endpoint"], r["concurrency"]))
+        if old is None:
+            continue
+        change = lambda key: f"{(r[key] - old[key]) / old[key]:+.0%}" if old[key] else "n/a"
+        print(f"{r['endpoint']:<22}{r['concurrency']:>5}{change('p50_ms'):>9}{change('p95_ms'):>9}"
+              f"{change('p99_ms'):>9}{change('requests_per_sec'):>9}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--bills", type=int, default=50, help="distinct bills to cycle through")
+    parser.add_argument("--lines", type=int, default=5, help="procedure lines per bill")
+    parser.add_argument("--latency", type=float, default=0.2, help="mean upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--distribution", choices=LATENCY_DISTRIBUTIONS, default="gauss")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls that fail")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of tool calls needing repair")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0],
+                        help="worker counts to run app.server with (default: plain uvicorn)")
+    parser.add_argument("--app-env", nargs="*", default=[], metavar="NAME=VALUE",
+                        help="extra environment for the app, e.g. LLM_CACHE_MAX_ENTRIES=0")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    stub_url, stub = spawn_server(args.latency, args.jitter, args.invalid_rate, args.error_rate, args.distribution)
+    app = None
+    results = []
+    try:
+        bills = make_bills(args.bills, args.lines)
+        for workers in args.workers:
+            # Fresh stores per run, so one worker count does not start with another's results
+            store_dir = tempfile.mkdtemp(prefix="advocare-bench-")
+            env = {"RESULT_STORE_PATH": f"{store_dir}/results.sqlite3"}
+            if workers:
+                # The same shared cache tier at every worker count, one worker included
+                env["CACHE_PATH"] = f"{store_dir}/cache.sqlite3"
+            app_url, app = spawn_app(stub_url, {**env, **dict(pair.split("=", 1) for pair in args.app_env)}, workers)
+            for endpoint in args.endpoints:
+                for concurrency in args.concurrency:
+                    results.append(run_level(app_url, app.pid, endpoint, bills, concurrency, args.requests, workers))
+                    print_results(results[-1:])
+            stop_app(app)
+            app = None
+    finally:
+        if app is not None:
+            stop_app(app)
+        stub.terminate()
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/bench_startup.py
+# Startup time and per-worker memory of the reference data loaded by parsing
+# the source files vs. memory-mapping the compiled snapshot, and cold starts
+# of the app itself: import time, first response, /readyz and full warmup.
+#
+#   python databases/map.py compile
+#   python -m benchmarks.bench_startup --workers 4 --cold-starts 5
+import argparse
+import http.client
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.stubs import free_port
+
+# Runs in a fresh interpreter so every measurement is a cold start
+WORKER = r"""
+import json, time
+start = time.perf_counter()
+from app.services import database
+data = database.{loader}()
+for code in list(data.medicare_rates)[:200]:
+    data.medicare_rates[code]
+elapsed = time.perf_counter() - start
+status = dict(line.split(":", 1) for line in open("/proc/self/status"))
+kb = lambda key: int(status[key].split()[0])
+print(json.dumps({{"startup_ms": elapsed * 1000, "rss_anon_kb": kb("RssAnon"), "rss_file_kb": kb("RssFile")}}))
+"""
+
+def measure(loader, workers):
+    procs = [
+        subprocess.Popen([sys.executable, "-c", WORKER.format(loader=loader)], stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    results = [json.loads(proc.communicate()[0]) for proc in procs]
+    return {key: sum(r[key] for r in results) / workers for key in results[0]}
+
+IMPORT_APP = "import time; start = time.perf_counter(); import app.main; print((time.perf_counter() - start) * 1000)"
+
+def get(port, path):
+    """(status, JSON body) of a GET, or None while nothing listens on port"""
+    # http.client rather than httpx: polling must not compete with the app for the CPU
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    except ConnectionError:
+        return None
+    finally:
+        connection.close()
+
+def cold_start():
+    """Milliseconds from spawning uvicorn to its first response, to ready and to a finished warmup"""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                                "--log-level", "warning"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    marks = {}
+    try:
+        while "warm_ms" not in marks:
+            result = get(port, "/readyz")
+            elapsed = (time.perf_counter() - start) * 1000
+            if result is None:
+                if process.poll() is not None:
+                    raise RuntimeError("App exited during startup")
+                time.sleep(0.005)
+                continue
+            marks.setdefault("first_response_ms", elapsed)
+            status, body = result
+            if status == 200:
+                marks.setdefault("ready_ms", elapsed)
+                if {"search_index", "sdk_imports"} <= body["startup_seconds"].keys():
+                    marks["warm_ms"] = elapsed
+            time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait()
+    return marks
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--cold-starts", type=int, default=5, help="app cold starts to take the median of")
+    args = parser.parse_args()
+
+    for name, loader in (("parse sources", "parse_reference_data"), ("mmap snapshot", "build_reference_data")):
+        result = measure(loader, args.workers)
+        print(f"{name:>14}: startup {result['startup_ms']:.1f}ms, "
+              f"private RSS {result['rss_anon_kb'] / 1024:.1f}MB, "
+              f"shared file RSS {result['rss_file_kb'] / 1024:.1f}MB per worker")
+
+    imports = [float(subprocess.run([sys.executable, "-c", IMPORT_APP], capture_output=True, text=True).stdout)
+               for _ in range(args.cold_starts)]
+    print(f"{'import app.main':>14}: {statistics.median(imports):.0f}ms")
+    starts = [cold_start() for _ in range(args.cold_starts)]
+    for key in ("first_response_ms", "ready_ms", "warm_ms"):
+        print(f"{key[:-3].replace('_', ' '):>14}: {statistics.median(start[key] for start in starts):.0f}ms "
+              f"after spawning uvicorn (median of {len(starts)})")
+
+if __name__ == "__main__":
+    main()
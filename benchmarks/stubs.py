@@ -0,0 +1,244 @@
+# benchmarks/stubs.py
+# Local stand-ins for the upstream APIs (Anthropic, Perplexity and the NLM
+# clinicaltables search) so the service can be load tested without network
+# access or API spend.
+import argparse
+import asyncio
+import json
+import math
+import re
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import httpx
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_DISTRIBUTIONS = ("gauss", "lognormal", "exponential")
+# Shortest prefix the Messages API caches, for Sonnet and Opus
+CACHE_MIN_TOKENS = 1024
+
+def example_from_schema(schema, defs=None):
+    """Smallest value that satisfies a pydantic-generated JSON schema"""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return example_from_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    if "anyOf" in schema:
+        return example_from_schema(schema["anyOf"][0], defs)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: example_from_schema(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [example_from_schema(schema.get("items", {}), defs)]
+    return {"string": "stub", "number": 100.0, "integer": 1, "boolean": True}.get(kind)
+
+def sample_latency(latency: float, jitter: float, distribution: str = "gauss") -> float:
+    """
+    One response time: gauss is latency +/- jitter; lognormal has mean
+    latency and log-space sigma jitter (a long tail); exponential has mean
+    latency.
+    """
+    if distribution == "lognormal":
+        return random.lognormvariate(math.log(latency) - jitter ** 2 / 2, jitter) if latency > 0 else 0.0
+    if distribution == "exponential":
+        return random.expovariate(1 / latency) if latency > 0 else 0.0
+    return max(0.0, random.gauss(latency, jitter))
+
+def estimate_tokens(value) -> int:
+    return len(value if isinstance(value, str) else json.dumps(value)) // 4
+
+def create_stub_app(latency: float = 0.2, jitter: float = 0.0, invalid_rate: float = 0.0,
+                    error_rate: float = 0.0, distribution: str = "gauss",
+                    cache_min_tokens: int = CACHE_MIN_TOKENS) -> FastAPI:
+    """
+    Stub Anthropic Messages, Perplexity chat-completions and NLM search
+    endpoints. Forced tool calls get schema-valid input, except for
+    invalid_rate of first attempts, which leave out the required fields.
+    error_rate of all requests fail with the API's overloaded status.
+    Usage is estimated from the request, with prompt caching: a prefix
+    ending in a cache_control block is written the first time it is seen
+    and read after that, if it is at least cache_min_tokens long.
+    """
+    stub = FastAPI()
+    cached_prefixes = set()
+
+    async def wait():
+        await asyncio.sleep(sample_latency(latency, jitter, distribution))
+
+    def failure(status, body):
+        return JSONResponse(status_code=status, content=body) if random.random() < error_rate else None
+
+    def message_content(body):
+        tool_choice = body.get("tool_choice") or {}
+        if tool_choice.get("type") != "tool":
+            return {"type": "text", "text": '{"summary": "stub analysis"}'}
+        tool = next(tool for tool in body["tools"] if tool["name"] == tool_choice["name"])
+        repairing = any(isinstance(message["content"], list) and message["content"][0].get("type") == "tool_result"
+                        for message in body["messages"])
+        if not repairing and random.random() < invalid_rate:
+            tool_input = {}
+        else:
+            tool_input = example_from_schema(tool["input_schema"])
+        return {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex}", "name": tool["name"], "input": tool_input}
+
+    def message_usage(body):
+        """Input token counts: tools, then system, then messages, split at the last cache_control"""
+        system = body.get("system") or []
+        blocks = [*body.get("tools", []), *([{"text": system}] if isinstance(system, str) else system)]
+        marked = max((i + 1 for i, block in enumerate(blocks) if block.get("cache_control")), default=0)
+        # The marker itself is not billed
+        blocks = [{key: value for key, value in block.items() if key != "cache_control"} for block in blocks]
+        prefix = estimate_tokens(blocks[:marked]) if marked else 0
+        total = estimate_tokens(blocks) + estimate_tokens(body["messages"])
+        usage = {"input_tokens": total, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        if prefix >= cache_min_tokens:
+            key = json.dumps([body.get("model"), blocks[:marked]], sort_keys=True)
+            usage["cache_read_input_tokens" if key in cached_prefixes else "cache_creation_input_tokens"] = prefix
+            usage["input_tokens"] = total - prefix
+            cached_prefixes.add(key)
+        return usage
+
+    def message_events(model, content, usage):
+        """Anthropic streaming events for one content block, a few characters per delta"""
+        def event(name, data):
+            return f"event: {name}\ndata: {json.dumps({'type': name, **data})}\n\n"
+
+        yield event("message_start", {"message": {
+            "id": f"msg_{uuid.uuid4().hex}", "type": "message", "role": "assistant", "model": model,
+            "content": [], "stop_reason": None, "stop_sequence": None,
+            "usage": {**usage, "output_tokens": 1},
+        }})
+        if content["type"] == "tool_use":
+            text = json.dumps(content["input"])
+            yield event("content_block_start", {"index": 0, "content_block": {**content, "input": {}}})
+            deltas = ({"type": "input_json_delta", "partial_json": text[i:i + 4]} for i in range(0, len(text), 4))
+        else:
+            text = content["text"]
+            yield event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+            deltas = ({"type": "text_delta", "text": text[i:i + 4]} for i in range(0, len(text), 4))
+        for delta in deltas:
+            yield event("content_block_delta", {"index": 0, "delta": delta})
+        yield event("content_block_stop", {"index": 0})
+        stop_reason = "tool_use" if content["type"] == "tool_use" else "end_turn"
+        yield event("message_delta", {"delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                                      "usage": {"output_tokens": 10}})
+        yield event("message_stop", {})
+
+    @stub.post("/v1/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        content = message_content(body)
+        usage = message_usage(body)
+        await wait()
+        error = failure(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+        if error is not None:
+            return error
+        if body.get("stream"):
+            return StreamingResponse(message_events(body.get("model", "stub"), content, usage), media_type="text/event-stream")
+        return {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "stub"),
+            "content": [content],
+            "stop_reason": "tool_use" if content["type"] == "tool_use" else "end_turn",
+            "stop_sequence": None,
+            "usage": {**usage, "output_tokens": 10},
+        }
+
+    @stub.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await wait()
+        error = failure(503, {"error": {"message": "Service unavailable", "type": "server_error"}})
+        if error is not None:
+            return error
+        # Answer UCR lookups with a rate for every code listed in the prompt
+        prompt = body["messages"][-1]["content"]
+        match = re.search(r"Codes: (\[.*?\])", prompt)
+        codes = json.loads(match.group(1)) if match else []
+        content = json.dumps({"ucr_rates": {code: 100.0 for code in codes}})
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {"prompt_tokens": 50, "completion_tokens": 10, "total_tokens": 60},
+        }
+
+    @stub.get("/api/{table}/v3/search")
+    async def clinical_tables_search(table: str, terms: str = ""):
+        await wait()
+        error = failure(503, {"error": "Service unavailable"})
+        if error is not None:
+            return error
+        # [total, codes, extra fields, [[code, display]]], as clinicaltables answers
+        return [1, [terms], None, [[terms, f"Stub {table} code"]]]
+
+    return stub
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(app, port: int = 0) -> str:
+    """Serve app on a background thread and return its base URL"""
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+def spawn_server(latency: float = 0.2, jitter: float = 0.0, invalid_rate: float = 0.0,
+                 error_rate: float = 0.0, distribution: str = "gauss", cache_min_tokens: int = CACHE_MIN_TOKENS):
+    """
+    Run the stub in its own process so it does not compete with the code
+    under test for the GIL. Returns (base URL, process).
+    """
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.stubs",
+        "--port", str(port), "--latency", str(latency), "--jitter", str(jitter),
+        "--invalid-rate", str(invalid_rate), "--error-rate", str(error_rate), "--distribution", distribution,
+        "--cache-min-tokens", str(cache_min_tokens),
+    ])
+    base_url = f"http://127.0.0.1:{port}"
+    while True:
+        try:
+            httpx.get(f"{base_url}/docs")
+            return base_url, process
+        except httpx.TransportError:
+            if process.poll() is not None:
+                raise RuntimeError("Stub server exited during startup")
+            time.sleep(0.05)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--distribution", choices=LATENCY_DISTRIBUTIONS, default="gauss")
+    parser.add_argument("--cache-min-tokens", type=int, default=CACHE_MIN_TOKENS)
+    args = parser.parse_args()
+    uvicorn.run(create_stub_app(args.latency, args.jitter, args.invalid_rate, args.error_rate, args.distribution,
+                                args.cache_min_tokens),
+                host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,219 @@
-import pandas as pd
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+from datetime import date
+from pathlib import Path
 
-# Read the CSV files
-addendum_a = pd.read_csv('addendum_a.csv')
-addendum_b = pd.read_csv('addendum_b.csv')
+DATABASE_DIR = Path(__file__).resolve().parent
+# Let the build commands reuse the app's parsers
+sys.path.insert(0, str(DATABASE_DIR.parent))
 
-# Merge the datasets on the APC column
-merged_data = pd.merge(addendum_a, addendum_b, on='APC', how='inner')
+OUTPUT_PATH = DATABASE_DIR / 'medicare_rates.csv'
+# Row hashes of the addenda the output was last built from
+MANIFEST_PATH = DATABASE_DIR / 'medicare_rates.manifest.json'
 
-# Group the data by APC and aggregate HCPCS Codes, Descriptions, and Payment Rates
-grouped_data = merged_data.groupby('APC').agg({
-    'HCPCS Code': lambda x: '; '.join(x),
-    'Short Descriptor': lambda x: '; '.join(x),
-    'Payment Rate': 'first'  # Assuming Payment Rate is the same for each APC
-}).reset_index()
+OUTPUT_COLUMNS = ['APC', 'HCPCS Code', 'Description', 'Payment Rate']
+HISTORY_COLUMNS = ['HCPCS Code', 'Effective Date', 'APC', 'Payment Rate']
 
-# Rename the columns to match final requirements
-grouped_data = grouped_data.rename(columns={'Short Descriptor': 'Description'})
+def row_hash(row):
+    """Stable hash of a CSV row's values"""
+    encoded = '\x1f'.join(f'{key}={row[key]}' for key in sorted(row))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
 
-# Reorder columns to desired order
-final_data = grouped_data[['APC', 'HCPCS Code', 'Description', 'Payment Rate']]
+def apc_sort_key(apc):
+    return (0, int(apc), apc) if apc.isdigit() else (1, 0, apc)
 
-# Save the final merged data to a new CSV file
-final_data.to_csv('medicare_rates.csv', index=False)
+def atomic_write(path, write):
+    """Write through a temporary file and rename it over path, so readers never see a partial file"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
 
-# Print the final grouped data
-print(final_data)
\ No newline at end of file
+def write_csv(path, columns, rows):
+    def write(file):
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    atomic_write(path, write)
+
+def read_csv(path):
+    if not path.exists():
+        return []
+    with open(path, 'r', newline='', encoding='utf-8-sig') as file:
+        return list(csv.DictReader(file))
+
+def read_addenda():
+    from app.services.database import _read_addendum
+
+    apcs = {row['APC']: row for row in _read_addendum(DATABASE_DIR / 'addendum_a.csv')}
+    codes = {row['HCPCS Code']: row for row in _read_addendum(DATABASE_DIR / 'addendum_b.csv')}
+    return apcs, codes
+
+def code_rates(apcs, codes):
+    """(APC, payment rate) of every separately paid code, resolved as the app does"""
+    from app.services.database import parse_payment_rate
+
+    rates = {}
+    for code, row in codes.items():
+        apc = row['APC']
+        if not apc:
+            continue
+        rate = parse_payment_rate(row['Payment Rate'])
+        if rate is None and apc in apcs:
+            rate = parse_payment_rate(apcs[apc]['Payment Rate'])
+        rates[code] = (apc, '' if rate is None else str(rate))
+    return rates
+
+def build_group(apc, apc_row, members):
+    """One medicare_rates.csv row: an APC with its codes and descriptors joined"""
+    return {
+        'APC': apc,
+        'HCPCS Code': '; '.join(row['HCPCS Code'] for row in members),
+        'Description': '; '.join(row['Short Descriptor'] for row in members),
+        # The APC's rate; every code in the group shares it
+        'Payment Rate': apc_row['Payment Rate'],
+    }
+
+def diff_keys(before, after):
+    added = sorted(after.keys() - before.keys())
+    removed = sorted(before.keys() - after.keys())
+    changed = sorted(key for key in after.keys() & before.keys() if after[key] != before[key])
+    return added, removed, changed
+
+def update_history(history_path, effective_date, rates):
+    """
+    Append a version for every code whose APC or rate differs from its
+    latest recorded version, and an empty one for codes no longer paid.
+    Re-running for the same effective date replaces that date's versions.
+    """
+    rows = read_csv(history_path)
+    replaced = [row for row in rows if row['Effective Date'] == effective_date]
+    rows = [row for row in rows if row['Effective Date'] != effective_date]
+    later = sorted({row['Effective Date'] for row in rows if row['Effective Date'] > effective_date})
+    if later:
+        raise SystemExit(f'{history_path.name} already has versions effective {later[-1]}, '
+                         f'after {effective_date}')
+    latest = {}
+    for row in sorted(rows, key=lambda row: row['Effective Date']):
+        latest[row['HCPCS Code']] = (row['APC'], row['Payment Rate'])
+    versions = []
+    for code in sorted(rates.keys() | latest.keys()):
+        current = rates.get(code, ('', ''))
+        if latest.get(code, ('', '')) != current:
+            versions.append({'HCPCS Code': code, 'Effective Date': effective_date,
+                             'APC': current[0], 'Payment Rate': current[1]})
+    return rows + versions, versions, latest, versions != replaced
+
+def merge(effective_date, report_path=None, dry_run=False):
+    """
+    Rebuild medicare_rates.csv from the addenda, recomputing only the APC
+    groups whose rows changed since the last build, and record rate
+    versions effective from effective_date.
+    """
+    from app.services.database import RATE_HISTORY_PATH
+
+    apcs, codes = read_addenda()
+    apc_hashes = {apc: row_hash(row) for apc, row in apcs.items()}
+    code_hashes = {code: row_hash(row) for code, row in codes.items()}
+
+    # Inner join: APCs with at least one code, codes in their file order
+    members = {}
+    for row in codes.values():
+        if row['APC'] in apcs:
+            members.setdefault(row['APC'], []).append(row)
+    group_hashes = {
+        apc: row_hash({'apc': apc_hashes[apc], 'codes': ','.join(code_hashes[row['HCPCS Code']] for row in rows)})
+        for apc, rows in members.items()
+    }
+
+    manifest = json.loads(MANIFEST_PATH.read_text()) if MANIFEST_PATH.exists() else {}
+    previous_rows = {row['APC']: row for row in read_csv(OUTPUT_PATH)}
+    previous_groups = manifest.get('groups', {})
+    output_rows = []
+    recomputed = 0
+    for apc in sorted(members, key=apc_sort_key):
+        if previous_groups.get(apc) == group_hashes[apc] and apc in previous_rows:
+            output_rows.append(previous_rows[apc])
+        else:
+            output_rows.append(build_group(apc, apcs[apc], members[apc]))
+            recomputed += 1
+
+    code_added, code_removed, code_changed = diff_keys(manifest.get('codes', {}), code_hashes)
+    group_added, group_removed, group_changed = diff_keys(previous_groups, group_hashes)
+    rates = code_rates(apcs, codes)
+    history_rows, versions, latest, history_changed = update_history(RATE_HISTORY_PATH, effective_date, rates)
+    report = {
+        'effective_date': effective_date,
+        'codes': {'added': code_added, 'removed': code_removed, 'changed': code_changed},
+        'apc_groups': {'added': group_added, 'removed': group_removed, 'changed': group_changed,
+                       'unchanged': len(output_rows) - recomputed},
+        'recomputed_groups': recomputed,
+        'rate_versions': [
+            {'code': row['HCPCS Code'], 'apc': row['APC'], 'payment_rate': row['Payment Rate'],
+             'previous': latest.get(row['HCPCS Code'])}
+            for row in versions
+        ],
+    }
+
+    print(f"Codes: {len(code_added)} added, {len(code_removed)} removed, {len(code_changed)} changed")
+    print(f"APC groups: {len(group_added)} added, {len(group_removed)} removed, {len(group_changed)} changed, "
+          f"{recomputed} of {len(output_rows)} recomputed")
+    print(f"Rate versions effective {effective_date}: {len(versions)}")
+    if report_path:
+        report_path.write_text(json.dumps(report, indent=2))
+        print(f"Diff report written to {report_path}")
+    if dry_run:
+        return report
+
+    # The manifest goes last: if anything before it fails, the next run recomputes
+    if recomputed or group_removed or not OUTPUT_PATH.exists():
+        write_csv(OUTPUT_PATH, OUTPUT_COLUMNS, output_rows)
+    if history_changed or not RATE_HISTORY_PATH.exists():
+        history_rows.sort(key=lambda row: (row['HCPCS Code'], row['Effective Date']))
+        write_csv(RATE_HISTORY_PATH, HISTORY_COLUMNS, history_rows)
+    manifest = {'effective_date': effective_date, 'groups': group_hashes, 'codes': code_hashes}
+    atomic_write(MANIFEST_PATH, lambda file: json.dump(manifest, file, separators=(',', ':')))
+    return report
+
+def compile_snapshot(path):
+    from app.services.database import compile_reference_snapshot
+
+    # Compile cpt.txt and the addenda into the memory-mappable binary snapshot
+    data = compile_reference_snapshot(path)
+    print(f"Wrote {path} ({path.stat().st_size} bytes): "
+          f"{len(data.cpt_codes)} CPT codes, {len(data.medicare_rates)} HCPCS rates, "
+          f"{len(data.apc_rates)} APCs")
+
+def quarter_start(day):
+    return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1).isoformat()
+
+def main():
+    from app.services.database import SNAPSHOT_PATH
+
+    parser = argparse.ArgumentParser(description="Build the reference databases")
+    subparsers = parser.add_subparsers(dest="command")
+    merge_parser = subparsers.add_parser(
+        "merge", help="rebuild medicare_rates.csv and the rate history from the addenda (default)")
+    merge_parser.add_argument("--effective-date", default=quarter_start(date.today()),
+                              help="date the addenda take effect, YYYY-MM-DD (default: start of this quarter)")
+    merge_parser.add_argument("--report", type=Path, help="write the diff report as JSON to this file")
+    merge_parser.add_argument("--dry-run", action="store_true", help="report the changes without writing")
+    compile_parser = subparsers.add_parser("compile", help="compile the binary reference snapshot")
+    compile_parser.add_argument("--output", type=Path, default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        compile_snapshot(args.output)
+    elif args.command == "merge":
+        merge(date.fromisoformat(args.effective_date).isoformat(), args.report, args.dry_run)
+    else:
+        merge(quarter_start(date.today()))
+
+if __name__ == "__main__":
+    main()
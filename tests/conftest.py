@@ -0,0 +1,123 @@
+# tests/conftest.py
+# The app reads its configuration from the environment at import, so the
+# test settings go in before any app module is imported: no shared cache
+# file, result store and upload spool in a scratch directory, placeholder
+# API keys and quotas high enough never to throttle a test.
+import os
+import tempfile
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="advocare-tests-")
+
+os.environ.update({
+    "ANTHROPIC_API_KEY": "test",
+    "PERPLEXITY_API_KEY": "test",
+    "CACHE_PATH": "",
+    "LLM_CACHE_PATH": "",
+    "UCR_CACHE_PATH": "",
+    "CODE_CACHE_PATH": "",
+    "EXTRACTION_CACHE_PATH": "",
+    "RESULT_STORE_PATH": os.path.join(SCRATCH_DIR, "results.sqlite3"),
+    "UPLOAD_SPOOL_DIR": os.path.join(SCRATCH_DIR, "uploads"),
+    "CLAUDE_REQUESTS_PER_MINUTE": "100000",
+    "PERPLEXITY_REQUESTS_PER_MINUTE": "100000",
+    "NLM_REQUESTS_PER_MINUTE": "100000",
+    "REFERENCE_DATA_RELOAD_INTERVAL": "0",
+    "EXTRACTION_WORKERS": "1",
+    "LOG_LEVEL": "WARNING",
+})
+
+import pytest
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    # Every test gets its own event loop, so whatever opens connections on
+    # it (see upstreams) closes them before the loop goes away
+    return "asyncio"
+
+@pytest.fixture(scope="session")
+def stub_url():
+    """Base URL of the local Anthropic/Perplexity/NLM stub (benchmarks/stubs.py)"""
+    from benchmarks.stubs import spawn_server
+
+    base_url, process = spawn_server(latency=0)
+    yield base_url
+    process.terminate()
+    process.wait()
+
+@pytest.fixture
+async def upstreams(stub_url, monkeypatch):
+    """Point the Claude, Perplexity and NLM clients at the stub"""
+    from app.services import claude, codes, perplexity
+    from app.services.http import close_http_client
+
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", stub_url)
+    monkeypatch.setattr(perplexity, "PERPLEXITY_BASE_URL", stub_url)
+    monkeypatch.setattr(claude, "_client", None)
+    monkeypatch.setattr(perplexity, "_client", None)
+    for code_type, (url, fields) in codes.REMOTE_APIS.items():
+        monkeypatch.setitem(codes.REMOTE_APIS, code_type, (url.replace(codes.NLM_BASE_URL, stub_url), fields))
+    yield stub_url
+    await close_http_client()
+
+# A few rows in each reference file's format
+ADDENDUM_A = '﻿APC,Group Title ,Payment Rate \n5012,Clinic visit,"$1,130.49 "\n5021,Emergency visit,$80.00\n'
+ADDENDUM_B = (
+    "HCPCS Code,Short Descriptor,APC,Payment Rate\n"
+    "0001F,Heart failure composite,,\n"
+    "G0463,Hospital outpt clinic visit,5012,$134.59\n"
+    "99283,Emergency dept visit,5021,\n"
+)
+CPT = "99213: Office visit\nnot a code line\n"
+ICD10 = "R109    Unspecified abdominal pain\nA000    Cholera\n"
+HISTORY = (
+    "HCPCS Code,Effective Date,APC,Payment Rate\n"
+    "G0463,2024-01-01,5012,$120.00\n"
+    "G0463,2025-01-01,5012,$134.59\n"
+    "99283,2025-07-01,,\n"
+)
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    """Small reference files in a scratch directory, and no snapshot loaded yet"""
+    from app.services import database
+
+    files = {"CPT_PATH": ("cpt.txt", CPT), "ADDENDUM_A_PATH": ("addendum_a.csv", ADDENDUM_A),
+             "ADDENDUM_B_PATH": ("addendum_b.csv", ADDENDUM_B), "ICD10_PATH": ("icd10.txt", ICD10),
+             "RATE_HISTORY_PATH": ("history.csv", HISTORY)}
+    paths = {}
+    for name, (filename, content) in files.items():
+        path = paths[name] = tmp_path / filename
+        path.write_text(content, encoding="utf-8")
+        monkeypatch.setattr(database, name, path)
+    monkeypatch.setattr(database, "SOURCE_PATHS", tuple(paths.values()))
+    monkeypatch.setattr(database, "SNAPSHOT_PATH", tmp_path / "reference.snapshot")
+    monkeypatch.setattr(database, "_snapshot", None)
+    return paths
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    """Every test starts with empty in-memory caches"""
+    from app.services.cache import _caches
+
+    for cache in list(_caches):
+        cache._entries.clear()
+    yield
+
+@pytest.fixture
+async def client():
+    """HTTP client for the app, without running its lifespan"""
+    import httpx
+    from app.main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+        yield http
+
+@pytest.fixture
+async def started_app(client, monkeypatch):
+    """The client, with the app's lifespan (job queue, warmup) running"""
+    from app import main
+
+    monkeypatch.setattr(main, "startup_steps", {})
+    monkeypatch.setattr(main, "shutting_down", False)
+    async with main.app.router.lifespan_context(main.app):
+        yield client
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from app.services import bill_analyzer
+from app.services.bill_analyzer import analyze_bill, run_stage
+
+pytestmark = pytest.mark.anyio
+
+BILL = {"billing_details": {"procedure_codes": [{"code": "0101T", "cost": 300}]}}
+
+@pytest.fixture
+def stages(monkeypatch):
+    """Replace the three stages with ones that sleep, then return or raise the given outcome"""
+    def use(code=("code", 0.1), ucr=("ucr", 0.1), explanation=("explained", 0)):
+        def stage(name, outcome, delay):
+            async def run(*args):
+                await asyncio.sleep(delay)
+                if isinstance(outcome, BaseException):
+                    raise outcome
+                return {name: outcome}
+            return run
+
+        monkeypatch.setattr(bill_analyzer, "code_validation", stage("code_validation", *code))
+        monkeypatch.setattr(bill_analyzer, "ucr_validation", stage("ucr_validation", *ucr))
+        monkeypatch.setattr(bill_analyzer, "explanation_handler", stage("summary", *explanation))
+    return use
+
+async def test_run_stage_records_latency_and_result():
+    latency, errors = {}, {}
+
+    async def stage():
+        return "done"
+
+    assert await run_stage("code_validation", stage(), latency, errors) == "done"
+    assert set(latency) == {"code_validation"} and not errors
+
+async def test_run_stage_turns_timeouts_and_errors_into_none(monkeypatch):
+    monkeypatch.setitem(bill_analyzer.STAGE_TIMEOUTS, "code_validation", 0.01)
+    latency, errors = {}, {}
+    assert await run_stage("code_validation", asyncio.sleep(1), latency, errors) is None
+    assert errors["code_validation"] == "Timed out after 0.01s"
+
+    async def failing():
+        raise ValueError("bad reply")
+
+    assert await run_stage("ucr_validation", failing(), latency, errors) is None
+    assert errors["ucr_validation"] == "bad reply"
+    assert set(latency) == {"code_validation", "ucr_validation"}
+
+async def test_code_and_ucr_validation_run_concurrently(stages):
+    stages()
+    analysis = await analyze_bill(BILL)
+    assert analysis["summary"] == "explained"
+    assert analysis["latency"]["code_validation"] >= 0.1 and analysis["latency"]["ucr_validation"] >= 0.1
+    assert analysis["latency"]["total"] < 0.19
+    assert "errors" not in analysis
+
+async def test_one_failed_stage_still_reports_the_other(stages):
+    stages(ucr=(RuntimeError("Perplexity down"), 0))
+    analysis = await analyze_bill(BILL)
+    assert analysis["errors"] == {"ucr_validation": "Perplexity down"}
+    assert analysis["summary"] == "explained"
+
+async def test_failed_explanation_falls_back_to_the_stage_results(stages):
+    stages(explanation=(RuntimeError("overloaded"), 0))
+    analysis = await analyze_bill(BILL)
+    assert analysis["summary"] == "The final explanation could not be generated."
+    assert analysis["code_validation"] == "code" and analysis["ucr_validation"] == "ucr"
+    assert analysis["errors"] == {"explanation": "overloaded"}
+
+async def test_analysis_fails_when_every_stage_fails(stages):
+    stages(code=(RuntimeError("a"), 0), ucr=(RuntimeError("b"), 0))
+    with pytest.raises(Exception) as failure:
+        await analyze_bill(BILL)
+    assert "code_validation: a" in str(failure.value) and "ucr_validation: b" in str(failure.value)
+
+async def test_the_cached_explanation_is_not_written_into(stages, monkeypatch):
+    cached = {"summary": "explained"}
+
+    async def explanation_handler(results):
+        # What the response cache hands every request that hits it
+        return cached
+
+    stages(ucr=(RuntimeError("Perplexity down"), 0))
+    monkeypatch.setattr(bill_analyzer, "explanation_handler", explanation_handler)
+    partial = await analyze_bill(BILL)
+    stages()
+    monkeypatch.setattr(bill_analyzer, "explanation_handler", explanation_handler)
+    complete = await analyze_bill(BILL)
+    assert cached == {"summary": "explained"}
+    assert partial["errors"] == {"ucr_validation": "Perplexity down"}
+    assert "errors" not in complete and complete["latency"] is not partial["latency"]
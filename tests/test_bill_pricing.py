@@ -0,0 +1,57 @@
+import pytest
+
+from app.services import bill_analyzer
+from app.services.bill_analyzer import price_bills, price_lines
+
+RATE = 224.69  # 0101T in the shipped addenda
+
+def bill(*procedures, visit_date=None):
+    return {"visit_info": {"date_of_visit": visit_date} if visit_date else {},
+            "billing_details": {"procedure_codes": list(procedures)}}
+
+def test_price_lines_against_medicare_and_ucr():
+    columns = price_lines(["0101T", "0101T", "ZZZZZ"], [1, 2, 1], [300.0, 2000.0, 80.0], [250.0, None, 100.0])
+    assert columns["expected_medicare"] == [RATE, round(2 * RATE, 2), None]
+    assert columns["expected_ucr"] == [250.0, None, 100.0]
+    # 300 is within 3x Medicare and 1.25x UCR; 2000 is not within 3x; 80 only has UCR
+    assert columns["is_reasonable"] == [True, False, True]
+
+def test_price_lines_accepts_string_quantities_and_amounts():
+    columns = price_lines(["0101T", "0101T"], ["2", "0"], ["$1,000.50", "300"], [None, None])
+    assert columns["quantity"] == [2.0, 1]
+    assert columns["billed_cost"] == [1000.5, 300.0]
+    assert columns["expected_medicare"] == [round(2 * RATE, 2), RATE]
+
+@pytest.mark.parametrize("quantity", [None, "", "two", "nan", float("inf"), True, [2]])
+def test_unreadable_quantities_count_as_one(quantity):
+    assert price_lines(["0101T"], [quantity], [100.0], [None])["quantity"] == [1]
+
+@pytest.mark.parametrize("billed", [None, "", "n/a", "inf", {"amount": 5}])
+def test_unreadable_amounts_count_as_zero(billed):
+    assert price_lines(["0101T"], [1], [billed], [None])["billed_cost"] == [0.0]
+
+def test_lines_without_any_benchmark_are_left_to_judge():
+    columns = price_lines(["ZZZZZ"], [1], [100.0], [None])
+    assert columns["is_reasonable"] == [None]
+
+def test_price_bills_splits_results_per_bill():
+    bills = [bill({"code": " 0101t ", "cost": "300", "quantity": "1"}),
+             bill({"code": "0101T", "cost": 2000}, {"code": "ZZZZZ", "cost": 50})]
+    first, second = price_bills(bills, [{}, {"ZZZZZ": 40.0}])
+    assert [line["code"] for line in first["procedure_analysis"]] == ["0101T"]
+    assert first["totals"]["billed"] == 300.0
+    assert [line["is_reasonable"] for line in second["procedure_analysis"]] == [False, True]
+    assert "0101T" in second["overall_assessment"]
+
+@pytest.mark.anyio
+async def test_ucr_validation_skips_claude_when_every_line_is_benchmarked(monkeypatch):
+    async def ucr_rates(codes, locality):
+        return {}
+
+    async def claude(*args):
+        raise AssertionError("Claude should not be called")
+
+    monkeypatch.setattr(bill_analyzer, "search_ucr_rates", ucr_rates)
+    monkeypatch.setattr(bill_analyzer, "structured_with_claude", claude)
+    result = await bill_analyzer.ucr_validation(bill({"code": "0101T", "cost": 300}))
+    assert result["ucr_validation"]["procedure_analysis"][0]["is_reasonable"] is True
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from app.services.cache import ResponseCache, cache_key
+
+pytestmark = pytest.mark.anyio
+
+def make_cache(**kwargs):
+    return ResponseCache("test", ttl=kwargs.pop("ttl", 60), max_entries=kwargs.pop("max_entries", 10), **kwargs)
+
+def test_cache_key_is_stable_and_content_addressed():
+    assert cache_key("model", 0, {"b": 1, "a": 2}) == cache_key("model", 0, {"a": 2, "b": 1})
+    assert cache_key("model", 0, "prompt") != cache_key("model", 0, "prompt ")
+
+async def test_computes_once_then_serves_from_memory():
+    cache = make_cache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {"answer": 42}
+
+    assert await cache.get_or_compute("k", compute) == {"answer": 42}
+    assert await cache.get_or_compute("k", compute) == {"answer": 42}
+    assert len(calls) == 1
+    assert cache.metrics["hits"] == 1
+
+async def test_concurrent_misses_share_one_computation():
+    cache = make_cache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    results = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert cache.metrics["joined"] == 4
+
+async def test_cancelled_leader_does_not_cancel_joiners():
+    cache = make_cache()
+    started = asyncio.Event()
+
+    async def compute():
+        started.set()
+        await asyncio.sleep(0.1)
+        return "value"
+
+    leader = asyncio.create_task(cache.get_or_compute("k", compute))
+    await started.wait()
+    joiner = asyncio.create_task(cache.get_or_compute("k", compute))
+    await asyncio.sleep(0)
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert await joiner == "value"
+    assert await cache.get("k") == "value"
+
+async def test_leader_timeout_does_not_fail_joiners():
+    cache = make_cache()
+
+    async def compute():
+        await asyncio.sleep(0.1)
+        return "value"
+
+    async def impatient():
+        return await asyncio.wait_for(cache.get_or_compute("k", compute), 0.01)
+
+    leader = asyncio.create_task(impatient())
+    await asyncio.sleep(0)
+    joiner = asyncio.create_task(cache.get_or_compute("k", compute))
+    with pytest.raises(asyncio.TimeoutError):
+        await leader
+    assert await joiner == "value"
+
+async def test_computation_is_cancelled_when_every_caller_gives_up():
+    cache = make_cache()
+    cancelled = asyncio.Event()
+
+    async def compute():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    caller = asyncio.create_task(cache.get_or_compute("k", compute))
+    await asyncio.sleep(0.01)
+    caller.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+    async def fresh():
+        return "fresh"
+
+    # A later caller starts its own computation rather than joining the cancelled one
+    assert await cache.get_or_compute("k", fresh) == "fresh"
+
+async def test_errors_reach_every_caller_and_are_not_cached():
+    cache = make_cache()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    results = await asyncio.gather(*(cache.get_or_compute("k", failing) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(calls) == 1
+    assert cache.metrics["errors"] == 1
+    with pytest.raises(ValueError):
+        await cache.get_or_compute("k", failing)
+    assert len(calls) == 2
+
+async def test_store_if_rejects_values():
+    cache = make_cache()
+
+    async def partial():
+        return {"errors": ["timed out"]}
+
+    await cache.get_or_compute("k", partial, store_if=lambda value: not value["errors"])
+    assert await cache.get("k") is None
+
+async def test_entries_expire_after_ttl():
+    cache = make_cache(ttl=0.01)
+    await cache.set("k", "value")
+    await asyncio.sleep(0.02)
+    assert await cache.get("k") is None
+
+async def test_least_recently_used_entries_are_evicted():
+    cache = make_cache(max_entries=2)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    await cache.get("a")
+    await cache.set("c", 3)
+    assert await cache.get("b") is None
+    assert await cache.get("a") == 1
+    assert cache.metrics["evictions"] == 1
+
+async def test_sqlite_tier_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    await make_cache(path=path).set("k", {"rows": [1, 2]})
+    reopened = make_cache(path=path)
+    assert await reopened.get("k") == {"rows": [1, 2]}
+    assert reopened.metrics["disk_hits"] == 1
@@ -0,0 +1,96 @@
+import pytest
+
+from app.services import claude
+from app.services.bill_analyzer import code_validation_prompt, explanation_prompt, ucr_validation_prompt
+from app.services.prompts import Prompt, PromptBuilder
+from app.services.schemas import tool_definition
+from app.services.telemetry import llm_prompt_cache
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture(scope="module")
+def short_prefix_stub():
+    """A stub that caches prefixes from 256 estimated tokens, below the API's minimum"""
+    from benchmarks.stubs import spawn_server
+
+    base_url, process = spawn_server(latency=0, cache_min_tokens=256)
+    yield base_url
+    process.terminate()
+    process.wait()
+
+@pytest.fixture
+async def short_prefix_upstream(short_prefix_stub, upstreams, monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", short_prefix_stub)
+    monkeypatch.setattr(claude, "_client", None)
+    monkeypatch.setattr(claude, "CLAUDE_CACHE_MIN_TOKENS", 256)
+    return short_prefix_stub
+
+def stage_prompts(n):
+    """One prompt per stage, with content that differs for each n"""
+    valid = [{"code": "0101T", "type": "CPT", "description": f"Shock wave therapy (bill {n})"}]
+    pricing = {"procedure_analysis": [{"code": "0101T", "description": f"Shock wave therapy (bill {n})",
+                                       "quantity": 1, "billed_cost": 300.0, "medicare_rate": 224.69,
+                                       "ucr_rate": None, "is_reasonable": None}]}
+    return {
+        "code_validation": code_validation_prompt(valid, [f"9999{n}"]),
+        "ucr_validation": ucr_validation_prompt(pricing),
+        "explanation": explanation_prompt([{"code_validation": {"valid_codes": valid}}]),
+    }
+
+def cache_outcomes(stage):
+    values = llm_prompt_cache.values()
+    return {outcome: values.get((stage, outcome), 0) for outcome in ("hit", "write", "none")}
+
+def test_messages_send_the_content_as_is():
+    assert claude._messages(Prompt("Rules", "Codes: 0101T")) == [{"role": "user", "content": "Codes: 0101T"}]
+    assert claude._messages("plain text") == [{"role": "user", "content": "plain text"}]
+
+@pytest.mark.parametrize("stage", ["code_validation", "ucr_validation", "explanation"])
+def test_stage_prefixes_are_marked_only_past_the_minimum(stage, monkeypatch):
+    prompt = stage_prompts(0)[stage]
+    # Today's prefixes are below the API's 1024-token minimum
+    system = claude._system(prompt, [tool_definition(stage)])["system"]
+    assert "cache_control" not in system[0]
+    assert system[0]["text"] == prompt.instructions
+    monkeypatch.setattr(claude, "CLAUDE_CACHE_MIN_TOKENS", 256)
+    system = claude._system(prompt, [tool_definition(stage)])["system"]
+    assert system[0]["cache_control"] == {"type": "ephemeral"}
+
+def test_short_prefixes_and_disabled_caching_are_not_marked(monkeypatch):
+    assert "cache_control" not in claude._system(Prompt("Be brief.", "content"))["system"][0]
+    assert claude._system("plain text") == {}
+    monkeypatch.setattr(claude, "CLAUDE_CACHE_MIN_TOKENS", 256)
+    monkeypatch.setattr(claude, "CLAUDE_PROMPT_CACHING", False)
+    prompt = stage_prompts(0)["explanation"]
+    assert "cache_control" not in claude._system(prompt, [tool_definition("explanation")])["system"][0]
+
+async def test_short_prefixes_are_sent_uncached(upstreams):
+    before = cache_outcomes("code_validation")
+    await claude.structured_with_claude("code_validation", stage_prompts(0)["code_validation"])
+    after = cache_outcomes("code_validation")
+    assert after["none"] - before["none"] == 1 and after["hit"] == before["hit"]
+
+async def test_repeated_stage_calls_read_the_cached_prefix(short_prefix_upstream):
+    for stage in ("code_validation", "ucr_validation", "explanation"):
+        before = cache_outcomes(stage)
+        read_before = claude.token_usage["cache_read_input_tokens"]
+        for n in range(3):
+            await claude.structured_with_claude(stage, stage_prompts(n)[stage])
+        after = cache_outcomes(stage)
+        # The first call may find the prefix already written by an earlier test
+        assert after["hit"] - before["hit"] >= 2
+        assert after["none"] == before["none"]
+        assert claude.token_usage["cache_read_input_tokens"] > read_before
+
+async def test_metrics_endpoint_exports_cache_outcomes(client):
+    claude._record_usage(type("Usage", (), {"input_tokens": 10, "output_tokens": 5,
+                                            "cache_read_input_tokens": 1200})(), "code_validation")
+    response = await client.get("/metrics")
+    assert 'advocare_llm_prompt_cache_total{stage="code_validation",outcome="hit"}' in response.text
+
+def test_budget_covers_the_instructions_too():
+    rows = [{"code": f"{n:05d}", "description": "Office visit"} for n in range(10)]
+    prompt = PromptBuilder("test", budget=200).table("Codes", rows).build()
+    assert "omitted" not in prompt.content
+    prompt = PromptBuilder("test", budget=200).instructions("Rule. " * 150).table("Codes", rows).build()
+    assert "more rows omitted" in prompt.content
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.services import claude, perplexity
+from app.services.http import close_http_client, get_http_client
+from app.services.telemetry import request_id_var
+
+pytestmark = pytest.mark.anyio
+
+async def test_one_pool_is_shared_until_closed():
+    pool = get_http_client()
+    assert get_http_client() is pool
+    await close_http_client()
+    assert pool.is_closed
+    assert get_http_client() is not pool
+    await close_http_client()
+
+async def test_sdk_clients_use_the_shared_pool_and_follow_it(upstreams):
+    pool = get_http_client()
+    anthropic_client = claude.get_client()
+    openai_client = perplexity.get_client()
+    assert claude.get_client() is anthropic_client and perplexity.get_client() is openai_client
+    assert anthropic_client._client is pool and openai_client._client is pool
+    await close_http_client()
+    # A new pool (e.g. after a restart of the lifespan) gets new SDK clients
+    assert claude.get_client() is not anthropic_client
+    assert perplexity.get_client()._client is get_http_client()
+
+async def test_missing_api_keys_fail_fast(monkeypatch):
+    monkeypatch.setattr(claude, "api_key", None)
+    monkeypatch.setattr(perplexity, "api_key", None)
+    with pytest.raises(RuntimeError, match="ANTHROPIC_API_KEY"):
+        claude.get_client()
+    with pytest.raises(RuntimeError, match="PERPLEXITY_API_KEY"):
+        perplexity.get_client()
+
+async def test_requests_carry_the_request_id(upstreams):
+    seen = []
+
+    async def record(request):
+        seen.append(request.headers.get("X-Request-ID"))
+
+    pool = get_http_client()
+    pool.event_hooks["request"].append(record)
+    token = request_id_var.set("req-123")
+    try:
+        await pool.get(f"{upstreams}/api/hcpcs/v3/search", params={"terms": "G0103"})
+    finally:
+        request_id_var.reset(token)
+    assert seen == ["req-123"]
+
+async def test_concurrent_calls_through_the_async_clients(upstreams):
+    results = await asyncio.gather(
+        claude.analyze_with_claude("first bill"),
+        claude.analyze_with_claude("second bill"),
+        perplexity.search_ucr_rates(["99213"], "Austin, TX"),
+    )
+    assert results[0] == results[1] == '{"summary": "stub analysis"}'
+    assert results[2] == {"99213": 100.0}
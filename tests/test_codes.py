@@ -0,0 +1,87 @@
+from types import MappingProxyType, SimpleNamespace
+
+import pytest
+
+from app.services import codes
+from app.services.bill_analyzer import code_validation_prompt
+from app.services.codes import CPT, HCPCS, ICD10, CodeEngine, classify_code, validate_codes
+
+pytestmark = pytest.mark.anyio
+
+def make_engine(icd10_codes=None):
+    data = SimpleNamespace(
+        cpt_codes=MappingProxyType({"99213": {"code": "99213", "description": "Office visit"}}),
+        hcpcs_codes=MappingProxyType({"G0103": {"code": "G0103", "description": "Psa screening"}}),
+        icd10_codes=MappingProxyType(icd10_codes or {}),
+    )
+    return CodeEngine(data)
+
+@pytest.fixture
+def engine(monkeypatch):
+    def use(icd10_codes=None):
+        engine = make_engine(icd10_codes)
+        monkeypatch.setattr(codes, "get_code_engine", lambda: engine)
+        return engine
+    return use
+
+def test_classify_code_most_likely_first():
+    assert classify_code("99213") == [CPT]
+    assert classify_code("g0103") == [HCPCS, ICD10]
+    assert classify_code("R10.9") == [ICD10]
+    assert classify_code("12") == []
+
+async def test_codes_are_valid_or_invalid_against_local_sets(engine):
+    engine({"R109": {"code": "R109", "description": "Unspecified abdominal pain"}})
+    valid, invalid, unverified = await validate_codes(["99213", "g0103", "R10.9", "99999", "R99.9", "??"])
+    assert [(info["code"], info["type"]) for info in valid] == [("99213", CPT), ("G0103", HCPCS), ("R10.9", ICD10)]
+    assert invalid == ["99999", "R99.9", "??"]
+    assert unverified == []
+
+async def test_icd10_codes_are_unverified_without_a_code_set(engine):
+    engine()
+    valid, invalid, unverified = await validate_codes(["R10.9", "R109", "G9999", "99213"])
+    assert unverified == ["R10.9", "R109"]
+    # G9999 is most likely HCPCS, whose set is loaded
+    assert invalid == ["G9999"]
+    assert [info["code"] for info in valid] == ["99213"]
+
+async def test_remote_api_answers_for_missing_code_sets(engine, upstreams, monkeypatch):
+    engine()
+    monkeypatch.setattr(codes, "REMOTE_ENABLED", True)
+    valid, invalid, unverified = await validate_codes(["R10.9"])
+    assert valid == [{"code": "R10.9", "description": "Stub icd10cm code", "type": ICD10}]
+    assert invalid == unverified == []
+
+async def test_remote_not_found_is_invalid_and_remote_failure_unverified(engine, monkeypatch):
+    engine()
+    monkeypatch.setattr(codes, "REMOTE_ENABLED", True)
+
+    async def not_found(code, code_type):
+        return None
+
+    monkeypatch.setattr(codes, "_remote_lookup", not_found)
+    assert await validate_codes(["R10.9"]) == ([], ["R10.9"], [])
+
+    async def unavailable(code, code_type):
+        raise ConnectionError("clinicaltables down")
+
+    monkeypatch.setattr(codes, "_remote_lookup", unavailable)
+    assert await validate_codes(["R10.9"]) == ([], [], ["R10.9"])
+
+def test_prompt_keeps_unverified_codes_apart_from_invalid_ones():
+    prompt = code_validation_prompt([], ["99999"], None, ["R10.9"])
+    assert "Invalid codes: 99999" in prompt.text
+    assert "R10.9" in prompt.text.split("Invalid codes")[1]
+    assert "not to be reported as invalid" in prompt.content
+    assert "could not be checked" not in code_validation_prompt([], ["99999"]).content
+
+def test_suggestions_come_from_the_loaded_code_sets():
+    engine = make_engine()
+    assert engine.suggest("99214")[0]["code"] == "99213"
+    assert engine.suggest("G0104", "Psa screening")[0]["code"] == "G0103"
+
+def test_prompt_counts_repeated_invalid_codes():
+    prompt = code_validation_prompt([{"code": "99213", "type": "CPT", "description": "Office visit"}] * 2,
+                                    ["99999", "99999", "88888"])
+    assert "Invalid codes: 99999 (x2), 88888" in prompt.content
+    assert "99213,CPT,Office visit,2" in prompt.content
@@ -0,0 +1,92 @@
+from decimal import Decimal
+
+import pytest
+
+from app.services import database
+from app.services.database import (
+    get_reference_data, medicare_rate_on, parse_payment_rate, parse_reference_data, parse_visit_date,
+    reload_reference_data,
+)
+
+pytestmark = pytest.mark.anyio
+
+def test_reference_data_is_read_only(sources):
+    data = parse_reference_data()
+    with pytest.raises(TypeError):
+        data.medicare_rates["X"] = {}
+    with pytest.raises(AttributeError):
+        data.cpt_codes = {}
+
+def test_snapshot_is_shared_until_a_source_changes(sources):
+    first = get_reference_data()
+    assert get_reference_data() is first
+    assert reload_reference_data() is first
+    with open(sources["CPT_PATH"], "a", encoding="utf-8") as file:
+        file.write("99214: Office visit, moderate\n")
+    second = reload_reference_data()
+    assert second is not first
+    assert "99214" in second.cpt_codes and "99214" not in first.cpt_codes
+    assert reload_reference_data(force=True) is not second
+
+def test_missing_sources_leave_tables_empty(sources):
+    for path in sources.values():
+        path.unlink()
+    data = parse_reference_data()
+    assert not data.medicare_rates and not data.cpt_codes and not data.icd10_codes and not data.rate_history
+
+async def test_get_cpt_code(sources):
+    assert (await database.get_cpt_code("99213"))["description"] == "Office visit"
+    assert await database.get_cpt_code("99999") is None
+
+def test_parse_payment_rate():
+    assert parse_payment_rate('$4,156.57 ') == Decimal("4156.57")
+    assert parse_payment_rate(" ") is None
+    assert parse_payment_rate("n/a") is None
+
+def test_medicare_index_has_one_parsed_entry_per_paid_code(sources):
+    data = parse_reference_data()
+    assert data.medicare_rates["G0463"] == {
+        "code": "G0463", "apc": "5012", "description": "Hospital outpt clinic visit", "payment_rate": Decimal("134.59"),
+    }
+    # A blank rate falls back to the APC's rate from Addendum A
+    assert data.medicare_rates["99283"]["payment_rate"] == Decimal("80.00")
+    # Codes without an APC are not separately paid, but are still valid codes
+    assert "0001F" not in data.medicare_rates
+    assert "0001F" in data.hcpcs_codes
+    assert data.apc_codes["5012"] == ("G0463",)
+    assert data.apc_rates["5012"]["payment_rate"] == Decimal("1130.49")
+    assert data.cpt_codes == {"99213": {"code": "99213", "description": "Office visit"}}
+    assert data.icd10_codes["R109"]["description"] == "Unspecified abdominal pain"
+
+async def test_medicare_and_apc_lookups(sources):
+    assert (await database.get_medicare_rate("G0463"))["payment_rate"] == Decimal("134.59")
+    assert await database.get_medicare_rate("0001F") is None
+    assert await database.get_apc_codes("5021") == ("99283",)
+    assert await database.get_apc_codes("9999") == ()
+
+@pytest.mark.parametrize("value, expected", [
+    ("2025-03-01", "2025-03-01"), ("2025-03-01T10:00:00", "2025-03-01"), ("03/01/2025", "2025-03-01"),
+    ("3/1/25", "2025-03-01"), ("03-01-2025", "2025-03-01"), ("", None), ("soon", None), (None, None),
+])
+def test_parse_visit_date(value, expected):
+    assert parse_visit_date(value) == expected
+
+def test_medicare_rate_on_the_date_of_visit(sources):
+    data = parse_reference_data()
+
+    def rate(code, visit_date):
+        info = medicare_rate_on(code, visit_date, data.medicare_rates, data.rate_history)
+        return info and info["payment_rate"]
+
+    assert rate("G0463", "2024-06-30") == Decimal("120.00")
+    assert rate("G0463", "2025-01-01") == Decimal("134.59")
+    # Before the recorded history, and without a date, the current addendum applies
+    assert rate("G0463", "2023-12-31") == Decimal("134.59")
+    assert rate("G0463", None) == Decimal("134.59")
+    # No longer separately paid from 2025-07-01
+    assert rate("99283", "2025-06-30") == Decimal("80.00")
+    assert rate("99283", "2025-07-01") is None
+
+async def test_get_medicare_rate_reads_the_visit_date(sources):
+    assert (await database.get_medicare_rate("G0463", "06/30/2024"))["payment_rate"] == Decimal("120.00")
+    assert (await database.get_medicare_rate("G0463", "not a date"))["payment_rate"] == Decimal("134.59")
@@ -0,0 +1,89 @@
+import hashlib
+import zlib
+
+import pytest
+
+from app.services import extraction
+from app.services.extraction import extract_bill_items, extract_file, parse_line_items, pdf_text
+from app.services.uploads import SpooledUpload
+
+BILL_TEXT = """General Hospital
+Date of service: 11/01/2024
+Diagnosis: R10.9 Abdominal pain
+99213 Office visit established 2 $150.00 $300.00
+71045 X-ray chest Qty: 1 $85.50
+Account 12345 Total $385.50
+"""
+
+def make_pdf(text, compress=False):
+    lines = text.splitlines()
+    content = b"BT /F1 12 Tf " + b" ".join(
+        b"1 0 0 1 50 %d Tm (%s) Tj" % (700 - 20 * i, line.encode("latin-1")) for i, line in enumerate(lines)) + b" ET"
+    header = b"<< /Length %d >>" % len(content)
+    if compress:
+        content = zlib.compress(content)
+        header = b"<< /Length %d /Filter /FlateDecode >>" % len(content)
+    return b"%PDF-1.4\n1 0 obj\n" + header + b"\nstream\n" + content + b"\nendstream\nendobj\n%%EOF\n"
+
+def spooled(tmp_path, data, content_type):
+    path = tmp_path / "upload"
+    path.write_bytes(data)
+    return SpooledUpload("bill", path, hashlib.sha256(data).hexdigest(), len(data), content_type)
+
+def test_parse_line_items_finds_procedures_diagnoses_and_the_visit_date():
+    items = parse_line_items(BILL_TEXT)
+    assert items["date_of_visit"] == "11/01/2024"
+    assert items["diagnoses"] == [{"code": "R10.9", "description": "Abdominal pain"}]
+    assert items["procedure_codes"] == [
+        {"code": "99213", "description": "Office visit established", "quantity": 2, "cost": 300.0},
+        {"code": "71045", "description": "X-ray chest", "quantity": 1, "cost": 85.5},
+    ]
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_pdf_text_reads_plain_and_deflated_streams(compress):
+    text = pdf_text(make_pdf("99213 Office visit $300.00\nSecond line", compress))
+    assert [line.strip() for line in text.splitlines()] == ["99213 Office visit $300.00", "Second line"]
+
+def test_extract_file_by_content_type(tmp_path):
+    pdf = spooled(tmp_path, make_pdf(BILL_TEXT), "application/pdf")
+    assert [line["code"] for line in extract_file(str(pdf.path), pdf.content_type)["procedure_codes"]] == ["99213", "71045"]
+    image = spooled(tmp_path, b"\x89PNG\r\n\x1a\n....", "image/png")
+    assert extract_file(str(image.path), image.content_type)["procedure_codes"] == []
+
+@pytest.mark.anyio
+async def test_extraction_is_cached_per_extractor_version(tmp_path, monkeypatch):
+    upload = spooled(tmp_path, BILL_TEXT.encode(), "text/plain")
+    cache = extraction.extraction_cache
+    first = await extract_bill_items([upload])
+    assert [line["code"] for line in first["procedure_codes"]] == ["99213", "71045"]
+    misses = cache.metrics["misses"]
+    assert await extract_bill_items([upload]) == first
+    assert cache.metrics["misses"] == misses
+    # A new extractor version does not see results cached by the old one
+    monkeypatch.setattr(extraction, "EXTRACTOR_VERSION", extraction.EXTRACTOR_VERSION + 1)
+    assert await extract_bill_items([upload]) == first
+    assert cache.metrics["misses"] == misses + 1
+
+def test_unreadable_streams_are_skipped():
+    good = make_pdf("99213 Office visit $300.00")
+    corrupt = b"1 0 obj\n<< /Filter /FlateDecode >>\nstream\nnot deflate data\nendstream\nendobj\n"
+    unsupported = b"2 0 obj\n<< /Filter /DCTDecode >>\nstream\nBT (hidden) Tj ET\nendstream\nendobj\n"
+    assert pdf_text(corrupt + unsupported + good).strip() == "99213 Office visit $300.00"
+    assert pdf_text(corrupt) == ""
+
+def test_empty_files_have_no_line_items(tmp_path):
+    empty = spooled(tmp_path, b"", "application/pdf")
+    assert extract_file(str(empty.path), empty.content_type) == {"procedure_codes": [], "diagnoses": []}
+
+@pytest.mark.anyio
+async def test_uploads_are_merged_and_the_pool_restarts_after_shutdown(tmp_path):
+    (tmp_path / "first").mkdir()
+    (tmp_path / "second").mkdir()
+    first = spooled(tmp_path / "first", b"85025 CBC $40.00\n", "text/plain")
+    second = spooled(tmp_path / "second", make_pdf(BILL_TEXT), "application/pdf")
+    extraction.shutdown_executor()
+    items = await extract_bill_items([first, second])
+    assert [line["code"] for line in items["procedure_codes"]] == ["85025", "99213", "71045"]
+    # The first visit date found wins; the text file has none
+    assert items["date_of_visit"] == "11/01/2024"
+    assert [diagnosis["code"] for diagnosis in items["diagnoses"]] == ["R10.9"]
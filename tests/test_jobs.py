@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from app import main
+from app.services.cache import ResponseCache
+from app.services.jobs import JobQueue, JobQueueFull
+
+pytestmark = pytest.mark.anyio
+
+BILL = {"patient_info": {"address": "1 Main St, Springfield, IL"},
+        "billing_details": {"procedure_codes": [{"code": "0101T", "cost": "300"}]}}
+
+async def wait_for(queue, job_id, status):
+    for _ in range(200):
+        job = await queue.find(job_id)
+        if job is not None and job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {status}")
+
+@pytest.fixture
+async def queue():
+    queue = JobQueue(workers=2, max_queued=3, retention=3)
+    await queue.start()
+    yield queue
+    await queue.stop()
+
+async def test_jobs_run_and_record_results_and_errors(queue):
+    async def ok():
+        return {"answer": 42}
+
+    async def broken():
+        raise ValueError("bad bill")
+
+    done, failed = queue.create("analysis"), queue.create("analysis")
+    queue.enqueue(done, ok)
+    queue.enqueue(failed, broken)
+    assert (await wait_for(queue, done, "done"))["result"] == {"answer": 42}
+    assert (await wait_for(queue, failed, "failed"))["error"] == "bad bill"
+    assert queue.waiting == 0
+
+async def test_queue_refuses_jobs_beyond_its_bound(queue):
+    for _ in range(3):
+        queue.create("analysis")
+    with pytest.raises(JobQueueFull):
+        queue.create("analysis")
+
+async def test_only_finished_jobs_are_evicted(queue):
+    async def ok():
+        return 1
+
+    finished = queue.create("analysis")
+    queue.enqueue(finished, ok)
+    await wait_for(queue, finished, "done")
+    pending = [queue.create("analysis") for _ in range(3)]
+    assert finished not in queue.jobs
+    assert all(job_id in queue.jobs for job_id in pending)
+
+async def test_jobs_are_published_to_the_store(tmp_path):
+    store = ResponseCache("jobs", ttl=60, max_entries=0, path=str(tmp_path / "jobs.sqlite3"), disk_max_entries=100)
+    queue = JobQueue(workers=1, store=store)
+    await queue.start()
+    try:
+        async def ok():
+            return "result"
+
+        job_id = queue.create("analysis")
+        queue.enqueue(job_id, ok)
+        # Another worker process only has the store
+        other = JobQueue(workers=0, store=store)
+        assert (await wait_for(other, job_id, "done"))["result"] == "result"
+    finally:
+        await queue.stop()
+
+@pytest.mark.parametrize("bill, problem", [
+    ({"billing_details": []}, "billing_details"),
+    ({"billing_details": {"procedure_codes": "0101T"}}, "billing_details"),
+    ({"billing_details": {"procedure_codes": []}}, "no procedure codes"),
+    ({"billing_details": {"procedure_codes": ["0101T"]}}, "procedure 0 must be an object"),
+    ({"billing_details": {"procedure_codes": [{"cost": 5}]}}, "procedure 0 has no code"),
+    ({"billing_details": {"procedure_codes": [{"code": "0101T", "cost": "a lot"}]}}, "procedure 0 has no readable cost"),
+    ({"patient_info": "Jane", "billing_details": {"procedure_codes": [{"code": "0101T", "cost": 5}]}}, "patient_info"),
+])
+async def test_batch_rejects_malformed_bills_with_their_index(client, bill, problem):
+    response = await client.post("/api/analyze/batch", json={"bills": [BILL, bill]})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Bill 1 ")
+    assert problem in response.json()["detail"]
+
+async def test_batch_rejects_an_empty_batch(client):
+    assert (await client.post("/api/analyze/batch", json={"bills": []})).status_code == 400
+
+async def test_batch_runs_every_bill_as_a_job(started_app, monkeypatch):
+    async def prefetch(bills):
+        return {}
+
+    async def analyze(bill):
+        return {"codes": [line["code"] for line in bill["billing_details"]["procedure_codes"]]}
+
+    monkeypatch.setattr(main, "prefetch_batch", prefetch)
+    monkeypatch.setattr(main, "run_bill_analysis", analyze)
+    response = await started_app.post("/api/analyze/batch", json={"bills": [BILL, BILL]})
+    assert response.status_code == 202
+    jobs = response.json()["jobs"]
+    assert len(jobs) == 2
+    for job_id in jobs:
+        job = await wait_for(main.job_queue, job_id, "done")
+        assert job["result"] == {"codes": ["0101T"]}
+        polled = await started_app.get(f"/api/jobs/{job_id}")
+        assert polled.json()["status"] == "done"
+    assert (await started_app.get("/api/jobs/unknown")).status_code == 404
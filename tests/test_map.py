@@ -0,0 +1,117 @@
+import csv
+import json
+
+import pytest
+
+import databases.map as rebuild
+from app.services import database
+
+@pytest.fixture
+def database_dir(sources, tmp_path, monkeypatch):
+    """The sources' addenda, with no previous build or rate history"""
+    sources["RATE_HISTORY_PATH"].unlink()
+    monkeypatch.setattr(rebuild, "DATABASE_DIR", tmp_path)
+    monkeypatch.setattr(rebuild, "OUTPUT_PATH", tmp_path / "medicare_rates.csv")
+    monkeypatch.setattr(rebuild, "MANIFEST_PATH", tmp_path / "medicare_rates.manifest.json")
+    return tmp_path
+
+def edit_addendum_b(database_dir, *replacements):
+    path = database_dir / "addendum_b.csv"
+    text = path.read_text(encoding="utf-8")
+    for old, new in replacements:
+        text = text.replace(old, new)
+    path.write_text(text, encoding="utf-8")
+
+def read_rows(path):
+    with open(path, newline="", encoding="utf-8") as file:
+        return list(csv.DictReader(file))
+
+def test_row_hash_ignores_key_order():
+    assert rebuild.row_hash({"a": "1", "b": "2"}) == rebuild.row_hash({"b": "2", "a": "1"})
+    assert rebuild.row_hash({"a": "1", "b": "2"}) != rebuild.row_hash({"a": "1", "b": "3"})
+
+def test_quarter_start():
+    from datetime import date
+
+    assert rebuild.quarter_start(date(2025, 1, 1)) == "2025-01-01"
+    assert rebuild.quarter_start(date(2025, 8, 15)) == "2025-07-01"
+    assert rebuild.quarter_start(date(2025, 12, 31)) == "2025-10-01"
+
+def test_atomic_write_keeps_the_old_file_when_writing_fails(tmp_path):
+    path = tmp_path / "out.csv"
+    path.write_text("old")
+
+    def write(file):
+        file.write("partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        rebuild.atomic_write(path, write)
+    assert path.read_text() == "old"
+    rebuild.atomic_write(path, lambda file: file.write("new"))
+    assert path.read_text() == "new"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["out.csv"]
+
+def test_first_build_writes_every_group_and_version(database_dir, capsys):
+    report = rebuild.merge("2025-01-01")
+    assert read_rows(rebuild.OUTPUT_PATH) == [
+        {"APC": "5012", "HCPCS Code": "G0463", "Description": "Hospital outpt clinic visit", "Payment Rate": "$1,130.49"},
+        {"APC": "5021", "HCPCS Code": "99283", "Description": "Emergency dept visit", "Payment Rate": "$80.00"},
+    ]
+    # A code without its own rate is priced at its APC's
+    assert read_rows(database.RATE_HISTORY_PATH) == [
+        {"HCPCS Code": "99283", "Effective Date": "2025-01-01", "APC": "5021", "Payment Rate": "80.00"},
+        {"HCPCS Code": "G0463", "Effective Date": "2025-01-01", "APC": "5012", "Payment Rate": "134.59"},
+    ]
+    assert report["codes"]["added"] == ["0001F", "99283", "G0463"]
+    assert report["apc_groups"]["added"] == ["5012", "5021"] and report["recomputed_groups"] == 2
+    assert "2 of 2 recomputed" in capsys.readouterr().out
+
+def test_rebuild_recomputes_only_changed_groups(database_dir):
+    rebuild.merge("2025-01-01")
+    output_mtime = rebuild.OUTPUT_PATH.stat().st_mtime_ns
+    history_mtime = database.RATE_HISTORY_PATH.stat().st_mtime_ns
+    unchanged = rebuild.merge("2025-04-01")
+    assert unchanged["recomputed_groups"] == 0 and unchanged["rate_versions"] == []
+    assert rebuild.OUTPUT_PATH.stat().st_mtime_ns == output_mtime
+    assert database.RATE_HISTORY_PATH.stat().st_mtime_ns == history_mtime
+
+    edit_addendum_b(database_dir, ("$134.59", "$140.00"), ("99283,Emergency dept visit,5021,\n", ""))
+    report = rebuild.merge("2025-07-01")
+    assert report["codes"] == {"added": [], "removed": ["99283"], "changed": ["G0463"]}
+    assert report["apc_groups"] == {"added": [], "removed": ["5021"], "changed": ["5012"], "unchanged": 0}
+    assert report["rate_versions"] == [
+        {"code": "99283", "apc": "", "payment_rate": "", "previous": ("5021", "80.00")},
+        {"code": "G0463", "apc": "5012", "payment_rate": "140.00", "previous": ("5012", "134.59")},
+    ]
+    assert [row["APC"] for row in read_rows(rebuild.OUTPUT_PATH)] == ["5012"]
+    history = read_rows(database.RATE_HISTORY_PATH)
+    assert [(row["HCPCS Code"], row["Effective Date"]) for row in history] == [
+        ("99283", "2025-01-01"), ("99283", "2025-07-01"), ("G0463", "2025-01-01"), ("G0463", "2025-07-01")]
+
+def test_rerunning_a_date_replaces_its_versions(database_dir):
+    rebuild.merge("2025-01-01")
+    edit_addendum_b(database_dir, ("$134.59", "$140.00"))
+    rebuild.merge("2025-01-01")
+    history = read_rows(database.RATE_HISTORY_PATH)
+    assert [(row["HCPCS Code"], row["Payment Rate"]) for row in history] == [("99283", "80.00"), ("G0463", "140.00")]
+
+def test_versions_cannot_predate_the_history(database_dir):
+    rebuild.merge("2025-07-01")
+    with pytest.raises(SystemExit, match="already has versions effective 2025-07-01"):
+        rebuild.merge("2025-01-01")
+
+def test_dry_run_reports_without_writing(database_dir):
+    report_path = database_dir / "report.json"
+    report = rebuild.merge("2025-01-01", report_path, dry_run=True)
+    assert json.loads(report_path.read_text()) == report
+    assert not rebuild.OUTPUT_PATH.exists() and not rebuild.MANIFEST_PATH.exists()
+    assert not database.RATE_HISTORY_PATH.exists()
+
+def test_built_history_prices_visits_by_date(database_dir):
+    rebuild.merge("2025-01-01")
+    edit_addendum_b(database_dir, ("$134.59", "$140.00"))
+    rebuild.merge("2025-07-01")
+    data = database.parse_reference_data()
+    assert str(database.medicare_rate_on("G0463", "2025-03-01", data.medicare_rates, data.rate_history)
+               ["payment_rate"]) == "134.59"
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from app.services import perplexity
+from app.services.perplexity import bill_locality, parse_rate, parse_ucr_response, search_ucr_rates
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Record each batch sent upstream and answer it with the given rates"""
+    batches = []
+
+    def use(rates=None, error=None):
+        async def search_batch(codes, locality):
+            batches.append((codes, locality))
+            if error is not None:
+                raise error
+            return {code: (rates or {}).get(code) for code in codes}
+
+        monkeypatch.setattr(perplexity, "_search_batch", search_batch)
+        return batches
+    return use
+
+@pytest.mark.parametrize("bill, locality", [
+    ({"visit_info": {"locality": "Austin, TX"}, "patient_info": {"address": "1 Main St, Boston, MA"}}, "Austin, TX"),
+    ({"patient_info": {"address": "123 Main St, Anytown, USA"}}, "Anytown, USA"),
+    ({"patient_info": {"address": "Springfield"}}, "Springfield"),
+    ({}, "United States"),
+])
+def test_bill_locality_never_includes_the_street(bill, locality):
+    assert bill_locality(bill) == locality
+
+def test_parse_ucr_response_reads_json_and_prose():
+    text = 'Here you go: {"ucr_rates": {"99213": "$1,125.50", "85025": null}} and for 80053 about $45.'
+    assert parse_ucr_response(text, ["99213", "85025", "80053"]) == {"99213": 1125.5, "85025": None, "80053": 45.0}
+    assert parse_ucr_response("no idea", ["99213"]) == {"99213": None}
+
+@pytest.mark.parametrize("value, rate", [
+    (125.5, 125.5), ("$1,125", 1125.0), ("about $ 80", 80.0), ("1,125.50 USD", 1125.5),
+    # Bare numbers in the prose are codes or counts, not rates
+    ("see 99213", None), ("2 sources", None), ("99213.5", None), (None, None),
+])
+def test_parse_rate_reads_only_dollar_amounts(value, rate):
+    assert parse_rate(value) == rate
+
+async def test_cache_lookups_run_together(upstream, monkeypatch):
+    upstream({})
+    waiting = []
+    release = asyncio.Event()
+
+    async def get(key):
+        waiting.append(key)
+        if len(waiting) == 3:
+            release.set()
+        await release.wait()
+        return 50.0
+
+    monkeypatch.setattr(perplexity.ucr_cache, "get", get)
+    rates = await asyncio.wait_for(search_ucr_rates(["99213", "85025", "80053"], "Austin, TX"), 5)
+    assert rates == {"99213": 50.0, "85025": 50.0, "80053": 50.0}
+
+async def test_uncached_codes_go_up_in_one_batch_then_come_from_the_cache(upstream):
+    batches = upstream({"99213": 125.0, "85025": 30.0})
+    assert await search_ucr_rates([" 99213", "85025", "99213"], "Austin, TX") == {"99213": 125.0, "85025": 30.0}
+    assert batches == [(["99213", "85025"], "Austin, TX")]
+    assert await search_ucr_rates(["85025", "80053"], "austin, tx ") == {"85025": 30.0, "80053": None}
+    # Only the code that was not cached is looked up; the locality is matched case-insensitively
+    assert batches[1] == (["80053"], "austin, tx")
+
+async def test_rates_are_cached_per_locality(upstream):
+    batches = upstream({"99213": 125.0})
+    await search_ucr_rates(["99213"], "Austin, TX")
+    await search_ucr_rates(["99213"], "Boston, MA")
+    assert [locality for _, locality in batches] == ["Austin, TX", "Boston, MA"]
+
+async def test_missing_rates_and_failures_are_not_cached(upstream):
+    batches = upstream(error=RuntimeError("Perplexity down"))
+    assert await search_ucr_rates(["99213"], "Austin, TX") == {"99213": None}
+    upstream({})
+    assert await search_ucr_rates(["99213"], "Austin, TX") == {"99213": None}
+    upstream({"99213": 125.0})
+    assert await search_ucr_rates(["99213"], "Austin, TX") == {"99213": 125.0}
+    assert len(batches) == 3
+
+async def test_batch_lookup_against_the_stub(upstreams):
+    assert await search_ucr_rates(["99213", "85025"], "Austin, TX") == {"99213": 100.0, "85025": 100.0}
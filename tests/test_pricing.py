@@ -0,0 +1,114 @@
+import json
+import math
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.pricing import (
+    FeeSchedule, PricingInputError, bulk_price, columns_to_csv, columns_to_json, parse_csv_columns, price_columns,
+)
+
+RATE = 224.69  # 0101T in the shipped addenda
+
+def test_bulk_price_joins_rates_and_flags_outliers():
+    result = bulk_price(["0101T", "0101T", "ZZZZZ"], [1.0, 2.0, 1.0], [200.0, 2000.0, 50.0])
+    columns = result["columns"]
+    assert columns["medicare_rate"][:2] == [RATE, RATE]
+    assert math.isnan(columns["medicare_rate"][2])
+    assert columns["expected_payment"][1] == pytest.approx(2 * RATE)
+    assert columns["outlier"] == [False, True, False]
+    assert result["summary"]["priced"] == 2
+    assert result["summary"]["billed"] == 2250.0
+    assert result["summary"]["billed_priced"] == 2200.0
+
+def test_bulk_price_rejects_ragged_columns():
+    with pytest.raises(PricingInputError):
+        bulk_price(["0101T"], [1.0, 1.0], [100.0])
+
+def test_bulk_price_zero_quantities_have_no_ratio():
+    columns = bulk_price(["0101T"], [0.0], [200.0])["columns"]
+    assert columns["expected_payment"] == [0.0]
+    assert math.isnan(columns["ratio"][0]) and columns["outlier"] == [False]
+
+def test_price_columns_parses_amounts_and_defaults_quantities():
+    result = price_columns({"code": [" 0101t "], "billed": ["$1,000.50"], "quantity": [""]})
+    assert result["columns"]["code"] == ["0101T"]
+    assert result["columns"]["billed"] == [1000.5]
+    assert result["columns"]["quantity"] == [1.0]
+
+@pytest.mark.parametrize("billed", ["nan", "inf", "-Infinity", "1e400", float("nan"), True, [100], {"a": 1}])
+def test_price_columns_rejects_bad_amounts(billed):
+    with pytest.raises(PricingInputError, match="Line 2"):
+        price_columns({"code": ["0101T", "0101T"], "billed": [100, billed]})
+
+@pytest.mark.parametrize("dates", [[["2024-01-01"]], [{"d": 1}], [20240101]])
+def test_price_columns_rejects_non_string_dates(dates):
+    with pytest.raises(PricingInputError, match="date"):
+        price_columns({"code": ["0101T"], "billed": [100], "date": dates})
+
+def test_price_columns_requires_lists():
+    with pytest.raises(PricingInputError):
+        price_columns({"code": "0101T", "billed": [100]})
+
+def test_fee_schedule_prices_by_date_of_visit():
+    data = SimpleNamespace(
+        medicare_rates={"A0001": {"payment_rate": Decimal("120")}, "A0002": {"payment_rate": Decimal("50")}},
+        rate_history={"A0001": [("2024-01-01", "1", "100"), ("2025-01-01", "1", "120")],
+                      "A0002": [("2025-01-01", "", "")]},
+    )
+    schedule = FeeSchedule(data)
+    rates = schedule.rates(["A0001", "A0001", "A0001", "A0002"], ["2024-06-01", "2025-03-01", None, "2025-02-01"])
+    assert rates[:3] == [100.0, 120.0, 120.0]
+    # Not paid from 2025 on
+    assert math.isnan(rates[3])
+
+def test_parse_csv_columns_fast_and_quoted_paths_agree():
+    plain = parse_csv_columns("HCPCS,Qty,Charge\n0101T,2,300\n0071T,1,4000\n")
+    quoted = parse_csv_columns('HCPCS,Qty,Charge\n0101T,2,300\n"0071T",1,"4000"\n')
+    assert plain == quoted == {"code": ["0101T", "0071T"], "quantity": ["2", "1"], "billed": ["300", "4000"]}
+
+def test_parse_csv_columns_rejects_missing_columns_and_ragged_rows():
+    with pytest.raises(PricingInputError):
+        parse_csv_columns("code,qty\n0101T,1\n")
+    with pytest.raises(PricingInputError):
+        parse_csv_columns("code,billed\n0101T,1,9\n")
+
+def test_outputs_blank_unpriced_lines():
+    result = price_columns({"code": ["0101T", "ZZZZZ"], "billed": [300, 10]})
+    payload = columns_to_json(result)
+    assert payload["columns"]["medicare_rate"] == [RATE, None]
+    assert payload["columns"]["outlier"] == [False, None]
+    json.dumps(payload, allow_nan=False)
+    lines = columns_to_csv(result).splitlines()
+    assert lines[0] == "code,quantity,billed,medicare_rate,expected_payment,delta,ratio,outlier"
+    assert lines[2].startswith("ZZZZZ,1,10.00,,,,,")
+
+@pytest.mark.anyio
+async def test_bulk_endpoint_rejects_non_finite_amounts(client):
+    response = await client.post("/api/pricing/bulk", json={"code": ["0101T"], "billed": ["nan"]})
+    assert response.status_code == 400
+    assert "finite" in response.json()["detail"]
+
+@pytest.mark.anyio
+async def test_bulk_endpoint_prices_csv_and_json(client):
+    response = await client.post("/api/pricing/bulk", content="code,billed\n0101T,300\n",
+                                 headers={"content-type": "text/csv"})
+    assert response.status_code == 200
+    assert response.json()["summary"]["priced"] == 1
+    response = await client.post("/api/pricing/bulk?format=csv", json={"code": ["0101T"], "billed": [300]})
+    assert response.headers["content-type"].startswith("text/csv")
+    response = await client.post("/api/pricing/bulk?format=xml", json={"code": ["0101T"], "billed": [300]})
+    assert response.status_code == 400
+
+@pytest.mark.anyio
+async def test_bulk_pricing_has_its_own_request_limit(client, monkeypatch):
+    from app import main
+
+    body = "code,billed\n" + "0101T,300\n" * 20
+    monkeypatch.setattr(main, "MAX_REQUEST_UPLOAD_BYTES", 100)
+    response = await client.post("/api/pricing/bulk", content=body, headers={"content-type": "text/csv"})
+    assert response.status_code == 200 and response.json()["summary"]["lines"] == 20
+    monkeypatch.setattr(main, "MAX_BULK_PRICING_BYTES", 100)
+    response = await client.post("/api/pricing/bulk", content=body, headers={"content-type": "text/csv"})
+    assert response.status_code == 413
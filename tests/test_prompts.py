@@ -0,0 +1,96 @@
+import pytest
+
+from app.services.prompts import (
+    PromptBuilder, add_result, count_tokens, counted_values, format_value, parse_json, prompt_metrics, prompt_stats,
+    table_columns, table_rows,
+)
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    prompt_metrics.clear()
+    yield
+    prompt_metrics.clear()
+
+def rows(count):
+    return [{"code": f"{n:05d}", "description": f"Procedure number {n}", "cost": 100.0 + n} for n in range(count)]
+
+def test_count_tokens_errs_high():
+    assert count_tokens("") == 0
+    assert count_tokens("code") == 1
+    assert count_tokens("description") == 3
+    assert count_tokens("99213, $150.00") == 7
+
+@pytest.mark.parametrize("value, text", [
+    (None, ""), (True, "true"), (150.0, "150"), (150.5, "150.5"), (0.125, "0.12"),
+    ({"a": [1, 2]}, '{"a":[1,2]}'), ("  two\n lines ", "two lines"),
+])
+def test_format_value(value, text):
+    assert format_value(value) == text
+
+def test_parse_json_finds_the_object_in_a_reply():
+    assert parse_json('Sure! {"issues": []} Hope that helps') == {"issues": []}
+    assert parse_json("no json here") == "no json here"
+    assert parse_json("{broken") == "{broken"
+    assert parse_json({"already": "parsed"}) == {"already": "parsed"}
+
+def test_tables_drop_empty_columns_and_keep_every_row():
+    records = [{"code": "99213", "note": None, "cost": 1.5}, {"code": "99213", "note": "", "cost": 1.5},
+               {"code": "85025, CBC", "note": None, "cost": None}]
+    columns = table_columns(records)
+    assert columns == ["code", "cost"]
+    assert table_rows(records, columns) == ["99213,1.5", "99213,1.5", '"85025, CBC",']
+
+def test_identical_rows_are_sent_once_with_a_count():
+    rows = [{"code": "99213", "cost": 150.0}, {"code": "71045", "cost": 85.5}, {"code": "99213", "cost": 150.0}]
+    assert PromptBuilder("test").table("Codes", rows).build().content == (
+        "Codes (CSV):\ncode,cost,count\n99213,150,2\n71045,85.5,1")
+    # Without duplicates there is no count column
+    assert PromptBuilder("test").table("Codes", rows[:2]).build().content == (
+        "Codes (CSV):\ncode,cost\n99213,150\n71045,85.5")
+
+def test_repeated_values_are_counted():
+    assert counted_values(["99999", "88888", "99999"]) == ["99999 (x2)", "88888"]
+    assert counted_values([]) == []
+
+def test_prompt_splits_instructions_from_content():
+    prompt = (PromptBuilder("test").instructions("  Check the codes. ").text("Bill 1")
+              .table("Codes", rows(2), ["code", "cost"]).table("Diagnoses", []).build())
+    assert prompt.instructions == "Check the codes."
+    assert prompt.content == "Bill 1\n\nCodes (CSV):\ncode,cost\n00000,100\n00001,101\n\nDiagnoses: none"
+    assert prompt.text == f"{prompt.instructions}\n\n{prompt.content}"
+
+def test_largest_table_is_trimmed_from_the_end_to_fit_the_budget():
+    prompt = PromptBuilder("test", budget=300).table("Small", rows(3)).table("Large", rows(100)).build()
+    small, large = prompt.content.split("\n\n")
+    assert small.count("\n") == 4
+    assert "00000" in large and "00099" not in large
+    assert large.endswith("more rows omitted")
+    assert count_tokens(prompt.content) <= 300
+    metrics = prompt_metrics["test"]
+    assert metrics["truncated"] == 1 and metrics["rows_omitted"] > 0 and metrics["over_budget"] == 0
+
+def test_prompts_within_budget_are_untouched():
+    prompt = PromptBuilder("test", budget=10_000).table("Codes", rows(50)).build()
+    assert "omitted" not in prompt.content
+    assert prompt_stats()["test"]["avg_tokens"] == count_tokens(prompt.content)
+
+def test_text_over_budget_is_counted_but_not_cut():
+    text = "word " * 200
+    prompt = PromptBuilder("test", budget=10).text(text).build()
+    assert prompt.content == text.strip()
+    assert prompt_metrics["test"]["over_budget"] == 1
+
+def test_add_result_turns_stage_output_into_tables_and_lines():
+    builder = PromptBuilder("test")
+    add_result(builder, "ucr_validation", {"ucr_validation": {
+        "overall_assessment": "High",
+        "procedure_analysis": [{"code": "99213", "billed_cost": 300.0, "comments": "long prose"}],
+        "recommendations": ["Ask for an itemized bill", "Ask for an itemized bill", "Negotiate"],
+    }})
+    add_result(builder, "note", '"plain text reply"')
+    assert builder.build().content == (
+        "ucr_validation.overall_assessment: High\n\n"
+        "ucr_validation.procedure_analysis (CSV):\ncode,billed_cost\n99213,300\n\n"
+        "ucr_validation.recommendations: Ask for an itemized bill (x2); Negotiate\n\n"
+        'note: "plain text reply"'
+    )
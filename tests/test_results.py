@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from app import main
+from app.services.cache import ResponseCache
+from app.services.results import idempotency_key, is_complete
+
+pytestmark = pytest.mark.anyio
+
+FORM = {"firstName": "Jane", "lastName": "Doe", "dateOfBirth": "1990-01-01"}
+PATIENT = {"first_name": "Jane", "last_name": "Doe", "date_of_birth": "1990-01-01"}
+BILL = b"99213 Office visit $150.00"
+
+def new_store(path):
+    return ResponseCache("analysis", ttl=3600, max_entries=10, path=str(path))
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    result_store = new_store(tmp_path / "results.sqlite3")
+    monkeypatch.setattr(main, "result_store", result_store)
+    return result_store
+
+@pytest.fixture
+def runs(monkeypatch):
+    """Analyses started, with the next one's result settable"""
+    runs = {"count": 0, "result": {"summary": "ok"}, "release": None}
+
+    async def analyze(user_input):
+        runs["count"] += 1
+        if runs["release"] is not None:
+            await runs["release"].wait()
+        return runs["result"]
+
+    monkeypatch.setattr(main, "analyze_medical_bill", analyze)
+    return runs
+
+def post(client, content=BILL, filename="bill.txt"):
+    return client.post("/api/analyze", data=FORM, files={"files": (filename, content, "text/plain")})
+
+def test_idempotency_key_normalizes_the_patient_and_file_order():
+    key = idempotency_key(PATIENT, ["a", "b"])
+    assert idempotency_key({"first_name": " JANE", "last_name": "doe ", "date_of_birth": "1990-01-01 "},
+                           ["b", "a"]) == key
+    assert idempotency_key(PATIENT, ["a"]) != key
+    assert idempotency_key({**PATIENT, "date_of_birth": "1990-01-02"}, ["a", "b"]) != key
+
+def test_only_complete_analyses_are_kept():
+    assert is_complete({"summary": "ok", "errors": {}})
+    assert not is_complete({"summary": "partial", "errors": {"ucr_validation": "timed out"}})
+    assert not is_complete("not an analysis")
+
+async def test_resubmissions_replay_the_stored_analysis(client, store, runs):
+    first = (await post(client)).json()
+    # A renamed copy of the same file is the same submission
+    second = (await post(client, filename="retry.txt")).json()
+    assert runs["count"] == 1
+    assert first["analysis"] == second["analysis"] == {"summary": "ok"}
+    assert first["idempotency_key"] == second["idempotency_key"]
+    assert second["files"][0]["filename"] == "retry.txt"
+    other = (await post(client, content=b"99214 Office visit $200.00")).json()
+    assert runs["count"] == 2 and other["idempotency_key"] != first["idempotency_key"]
+
+async def test_duplicates_in_flight_join_the_running_analysis(client, store, runs):
+    runs["release"] = asyncio.Event()
+    pending = [asyncio.create_task(post(client)) for _ in range(3)]
+    while runs["count"] == 0:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    runs["release"].set()
+    responses = await asyncio.gather(*pending)
+    assert runs["count"] == 1
+    assert [response.json()["analysis"] for response in responses] == [{"summary": "ok"}] * 3
+
+async def test_partial_analyses_are_returned_but_recomputed(client, store, runs):
+    runs["result"] = {"summary": "partial", "errors": {"ucr_validation": "timed out"}}
+    response = (await post(client)).json()
+    assert response["analysis"]["errors"] == {"ucr_validation": "timed out"}
+    assert (await client.get(f"/api/analyses/{response['idempotency_key']}")).status_code == 404
+    runs["result"] = {"summary": "ok"}
+    assert (await post(client)).json()["analysis"] == {"summary": "ok"}
+    assert runs["count"] == 2
+
+async def test_failed_analyses_are_not_stored(client, store, monkeypatch):
+    async def failing(user_input):
+        raise RuntimeError("Claude overloaded")
+
+    monkeypatch.setattr(main, "analyze_medical_bill", failing)
+    response = await post(client)
+    assert response.status_code == 500 and response.json()["detail"] == "Claude overloaded"
+    assert await store.get(idempotency_key(PATIENT, [hashlib.sha256(BILL).hexdigest()])) is None
+
+async def test_stored_analyses_are_fetched_by_key_and_survive_a_restart(client, store, runs, tmp_path, monkeypatch):
+    key = (await post(client)).json()["idempotency_key"]
+    response = await client.get(f"/api/analyses/{key}")
+    assert response.json() == {"analysis": {"summary": "ok"}, "idempotency_key": key}
+    monkeypatch.setattr(main, "result_store", new_store(tmp_path / "results.sqlite3"))
+    assert (await client.get(f"/api/analyses/{key}")).json()["analysis"] == {"summary": "ok"}
+    assert (await post(client)).status_code == 200 and runs["count"] == 1
+    missing = await client.get("/api/analyses/unknown")
+    assert missing.status_code == 404 and missing.json()["detail"] == "Analysis not found"
+
+def test_analyses_stay_in_memory_unless_a_store_path_is_set():
+    env = {name: value for name, value in os.environ.items() if name != "RESULT_STORE_PATH"}
+    check = "from app.services.results import result_store; print(result_store.disk is None)"
+    output = subprocess.run([sys.executable, "-c", check], cwd=Path(__file__).parent.parent, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "True"
@@ -0,0 +1,58 @@
+import pytest
+
+from app.services.codes import get_code_engine
+from app.services.search import CodeSearchIndex
+
+ENTRIES = [
+    ("99213", "Office visit established patient low complexity", "CPT"),
+    ("99214", "Office visit established patient moderate complexity", "CPT"),
+    ("71045", "X-ray chest single view", "CPT"),
+    ("70551", "MRI brain without contrast", "CPT"),
+    ("A0427", "Ambulance service advanced life support emergency", "HCPCS"),
+    ("99213", "A later duplicate that must not win", "HCPCS"),
+]
+
+@pytest.fixture(scope="module")
+def index():
+    return CodeSearchIndex(ENTRIES)
+
+def codes(results):
+    return [result["code"] for result in results]
+
+def test_first_entry_for_a_code_wins(index):
+    assert len(index) == 5
+    assert index.search("99213")[0]["description"].startswith("Office visit")
+
+def test_exact_prefix_and_mistyped_codes(index):
+    assert index.search("99213") == [index.result(index._positions["99213"], "exact")]
+    assert codes(index.search("9921")) == ["99213", "99214"]
+    # One substituted and one transposed character
+    assert "70551" in codes(index.search("70552"))
+    assert "99213" in codes(index.search("92913"))
+
+def test_description_words_prefixes_and_hyphens(index):
+    assert codes(index.search("mri brain"))[0] == "70551"
+    assert codes(index.search("office vis")) == ["99213", "99214"]
+    assert codes(index.search("xray chest"))[0] == "71045"
+
+def test_misspelt_words_match_fuzzily(index):
+    results = index.search("ambulanse")
+    assert codes(results)[0] == "A0427"
+    assert results[0]["match"] == "fuzzy"
+
+def test_empty_and_unmatched_queries(index):
+    assert index.search("   ") == []
+    assert index.search("zzzzqqq") == []
+
+def test_suggestions_use_the_billed_description():
+    engine = get_code_engine()
+    suggestions = engine.suggest("0101X", "Esw muscskel sys nos")
+    assert suggestions and suggestions[0]["code"] == "0101T"
+
+@pytest.mark.anyio
+async def test_search_endpoint_validates_its_parameters(client):
+    assert (await client.get("/api/codes/search", params={"q": " "})).status_code == 400
+    assert (await client.get("/api/codes/search", params={"q": "mri", "limit": 0})).status_code == 400
+    response = await client.get("/api/codes/search", params={"q": "0101T"})
+    assert response.status_code == 200
+    assert response.json()["results"][0]["code"] == "0101T"
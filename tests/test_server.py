@@ -0,0 +1,91 @@
+import os
+import signal
+import time
+
+import httpx
+import pytest
+
+from app import server
+from app.services import upstream
+from app.services.cache import ResponseCache
+
+@pytest.fixture
+def environ(monkeypatch):
+    """The launch settings unset, and restored after the test"""
+    for name in ("WORKER_PROCESSES", "CACHE_PATH", "EXTRACTION_WORKERS"):
+        monkeypatch.delenv(name, raising=False)
+    return os.environ
+
+def children(pid):
+    """PIDs of a process's live children"""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        # State and parent PID follow the command name; Z is an unreaped zombie
+        if int(fields[1]) == pid and fields[0] != "Z":
+            pids.append(int(entry))
+    return sorted(pids)
+
+def wait_for(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+def test_one_worker_keeps_per_process_caches(environ):
+    server.configure_environment(1)
+    assert environ["WORKER_PROCESSES"] == "1"
+    assert "CACHE_PATH" not in environ and "EXTRACTION_WORKERS" not in environ
+
+def test_several_workers_share_a_cache_file_and_split_the_cores(environ, monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    server.configure_environment(4)
+    assert environ["WORKER_PROCESSES"] == "4"
+    assert environ["CACHE_PATH"].endswith("advocare-cache.sqlite3")
+    assert environ["EXTRACTION_WORKERS"] == "2"
+
+def test_explicit_settings_win(environ, monkeypatch):
+    monkeypatch.setenv("CACHE_PATH", "/srv/cache.sqlite3")
+    monkeypatch.setenv("EXTRACTION_WORKERS", "6")
+    server.configure_environment(16)
+    assert (environ["CACHE_PATH"], environ["EXTRACTION_WORKERS"]) == ("/srv/cache.sqlite3", "6")
+
+def test_upstream_quotas_are_split_between_workers(monkeypatch):
+    monkeypatch.setattr(upstream, "WORKER_PROCESSES", 4)
+    limited = upstream.Upstream("split", "SPLITTEST", requests_per_minute=600, burst=10)
+    assert limited.bucket.max_rate == pytest.approx(2.5)
+    # Rounded up, so every worker can send at least one
+    assert limited.bucket.burst == 3
+
+@pytest.mark.anyio
+async def test_a_result_cached_by_one_worker_is_a_hit_in_another(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = ResponseCache("ucr", 60, 10, path=path), ResponseCache("ucr", 60, 10, path=path)
+    await first.set("99213", {"rate": 100.0})
+    assert await second.get("99213") == {"rate": 100.0}
+    assert second.metrics["disk_hits"] == 1
+
+def test_supervisor_restarts_dead_workers_and_stops_them_all(stub_url, tmp_path):
+    from benchmarks.bench_service import spawn_app, stop_app
+
+    base_url, process = spawn_app(stub_url, {"CACHE_PATH": str(tmp_path / "cache.sqlite3"),
+                                             "WORKER_RESTART_BACKOFF": "0"}, workers=2)
+    try:
+        wait_for(lambda: len(children(process.pid)) == 2)
+        workers = children(process.pid)
+        assert httpx.get(f"{base_url}/healthz").status_code == 200
+        os.kill(workers[0], signal.SIGKILL)
+        wait_for(lambda: len(children(process.pid)) == 2 and workers[0] not in children(process.pid))
+        assert workers[1] in children(process.pid)
+        assert httpx.get(f"{base_url}/healthz").status_code == 200
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
+        assert children(process.pid) == []
+    finally:
+        stop_app(process)
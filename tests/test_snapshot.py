@@ -0,0 +1,99 @@
+import os
+import struct
+
+import pytest
+
+from app.services import database
+from app.services.database import build_reference_data, compile_reference_snapshot, parse_reference_data
+from app.services.snapshot import (
+    KIND_INT, KIND_STR, MAGIC, Snapshot, SnapshotError, cents_to_rate, open_reference_tables, rate_to_cents,
+    write_snapshot,
+)
+
+def table(keys, numbers=None):
+    columns = [("key", KIND_STR, keys)]
+    if numbers is not None:
+        columns.append(("number", KIND_INT, numbers))
+    return columns
+
+def test_tables_round_trip_with_point_and_range_lookups(tmp_path):
+    path = tmp_path / "test.snapshot"
+    keys = [f"K{n:04d}" for n in range(100)] + ["ünïcode"]
+    write_snapshot({"things": table(keys, list(range(-1, 100)))}, path)
+    things = Snapshot(path).table("things", lambda t, i: t.value("number", i))
+    assert len(things) == 101
+    assert list(things) == keys
+    assert things["K0042"] == 41
+    assert things["ünïcode"] == 99
+    assert "K9999" not in things and 42 not in things
+    with pytest.raises(KeyError):
+        things["K9999"]
+    assert things.bisect("K0050") == 50
+    assert things.bisect("L") == 100
+
+def test_empty_tables_are_valid(tmp_path):
+    path = tmp_path / "empty.snapshot"
+    write_snapshot({"nothing": table([])}, path)
+    nothing = Snapshot(path).table("nothing", lambda t, i: i)
+    assert len(nothing) == 0 and "x" not in nothing
+
+def test_keys_must_be_sorted_and_unique(tmp_path):
+    with pytest.raises(SnapshotError):
+        write_snapshot({"t": table(["b", "a"])}, tmp_path / "t.snapshot")
+    with pytest.raises(SnapshotError):
+        write_snapshot({"t": table(["a", "a"])}, tmp_path / "t.snapshot")
+    with pytest.raises(SnapshotError):
+        write_snapshot({"t": table(["a", "b"], [1])}, tmp_path / "t.snapshot")
+    assert not (tmp_path / "t.snapshot").exists()
+
+def test_unreadable_files_are_rejected(tmp_path):
+    path = tmp_path / "bad.snapshot"
+    path.write_bytes(b"NOTASNAP" + bytes(8))
+    with pytest.raises(SnapshotError, match="not a reference snapshot"):
+        Snapshot(path)
+    path.write_bytes(struct.pack("<8sHI", MAGIC, 1, 0))
+    with pytest.raises(SnapshotError, match="version"):
+        Snapshot(path)
+    write_snapshot({"t": table(["a"])}, path)
+    with pytest.raises(SnapshotError, match="no table"):
+        Snapshot(path).table("other", lambda t, i: i)
+
+def test_rates_are_stored_as_cents():
+    from decimal import Decimal
+
+    assert rate_to_cents(Decimal("134.59")) == 13459
+    assert cents_to_rate(13459) == Decimal("134.59")
+    assert rate_to_cents(None) == -1 and cents_to_rate(-1) is None
+
+def test_compiled_snapshot_matches_the_sources(sources):
+    parsed = compile_reference_snapshot(database.SNAPSHOT_PATH)
+    tables = open_reference_tables(database.SNAPSHOT_PATH)
+    for name in ("cpt_codes", "hcpcs_codes", "icd10_codes", "medicare_rates", "apc_rates", "apc_codes", "rate_history"):
+        assert dict(tables[name]) == dict(getattr(parsed, name)), name
+
+def test_current_snapshot_is_used_and_a_stale_one_ignored(sources):
+    compile_reference_snapshot(database.SNAPSHOT_PATH)
+    data = build_reference_data()
+    assert type(data.medicare_rates).__name__ == "SnapshotTable"
+    # A source edited after the snapshot was compiled wins
+    built = database.SNAPSHOT_PATH.stat().st_mtime_ns
+    os.utime(sources["CPT_PATH"], ns=(built + 10**9, built + 10**9))
+    data = build_reference_data()
+    assert type(data.medicare_rates).__name__ == "mappingproxy"
+    assert dict(data.medicare_rates) == dict(parse_reference_data().medicare_rates)
+
+def test_truncated_files_are_rejected(tmp_path):
+    path = tmp_path / "cut.snapshot"
+    write_snapshot({"t": table(["a", "b"])}, path)
+    path.write_bytes(path.read_bytes()[:20])
+    with pytest.raises(SnapshotError, match="truncated"):
+        Snapshot(path)
+    path.write_bytes(b"")
+    with pytest.raises(SnapshotError, match="truncated"):
+        Snapshot(path)
+
+@pytest.mark.parametrize("content", [b"", b"garbage", b"NOTASNAP" + bytes(8)])
+def test_unreadable_snapshot_falls_back_to_the_sources(sources, content):
+    database.SNAPSHOT_PATH.write_bytes(content)
+    data = build_reference_data()
+    assert data.cpt_codes["99213"]["description"] == "Office visit"
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from app import main
+from app.services import claude, perplexity
+
+pytestmark = pytest.mark.anyio
+
+# Runs in a fresh interpreter, so nothing an earlier test imported counts
+IMPORT_APP = """
+import json, sys
+import app.main
+import databases.map
+from app.services import database
+heavy = ["anthropic", "openai", "httpx", "pandas", "pdfplumber"]
+print(json.dumps({"imported": [name for name in heavy if name in sys.modules],
+                  "reference_data_loaded": database._snapshot is not None}))
+"""
+
+def test_importing_the_app_and_build_tool_loads_no_sdks_or_reference_data():
+    output = subprocess.run([sys.executable, "-c", IMPORT_APP], cwd=Path(__file__).parent.parent,
+                            capture_output=True, text=True, check=True).stdout
+    assert json.loads(output) == {"imported": [], "reference_data_loaded": False}
+
+@pytest.mark.parametrize("module, variable", [(claude, "ANTHROPIC_API_KEY"), (perplexity, "PERPLEXITY_API_KEY")])
+def test_a_missing_api_key_fails_on_use_with_its_name(module, variable, monkeypatch):
+    monkeypatch.setattr(module, "api_key", None)
+    with pytest.raises(RuntimeError, match=f"{variable} is not set"):
+        module.get_client()
+
+async def test_health_needs_nothing_loaded(client, monkeypatch):
+    monkeypatch.setattr(main, "startup_steps", {})
+    response = await client.get("/healthz")
+    assert response.status_code == 200 and response.json() == {"status": "ok"}
+    ready = await client.get("/readyz")
+    assert ready.status_code == 503
+    assert ready.json()["pending"] == ["job_queue", "reference_data"]
+
+async def test_ready_once_the_required_steps_ran(started_app):
+    while "reference_data" not in main.startup_steps:
+        await asyncio.sleep(0.01)
+    response = await started_app.get("/readyz")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["ready"] is True and body["pending"] == [] and body["shutting_down"] is False
+    assert {"job_queue", "reference_data"} <= set(body["startup_seconds"])
+
+async def test_not_ready_while_shutting_down(client, monkeypatch):
+    monkeypatch.setattr(main, "startup_steps", {"job_queue": 0.0, "reference_data": 0.1})
+    monkeypatch.setattr(main, "shutting_down", True)
+    response = await client.get("/readyz")
+    assert response.status_code == 503 and response.json()["shutting_down"] is True
+
+async def test_failed_startup_steps_are_logged_and_left_pending(monkeypatch, caplog):
+    monkeypatch.setattr(main, "startup_steps", {})
+
+    def broken():
+        raise OSError("cpt.txt missing")
+
+    await main.run_startup_step("reference_data", broken)
+    await main.run_startup_step("sdk_imports", lambda: None)
+    assert list(main.startup_steps) == ["sdk_imports"]
+    assert "startup_step_failed" in caplog.messages
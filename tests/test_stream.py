@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from app import main
+from app.main import sse_event
+
+pytestmark = pytest.mark.anyio
+
+BILL_TEXT = b"""General Hospital
+Date of service: 11/01/2024
+99213 Office visit established 1 $150.00
+71045 X-ray chest Qty: 1 $85.50
+"""
+
+FORM = {"firstName": "Jane", "lastName": "Doe", "dateOfBirth": "1990-01-01"}
+
+def parse_events(body):
+    """[(event, data)] of a Server-Sent Events body"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+def test_sse_event_format():
+    assert sse_event("done", {"latency": {"total": 1.5}}) == 'event: done\ndata: {"latency": {"total": 1.5}}\n\n'
+
+async def test_stream_sends_each_stage_as_it_finishes(client, upstreams):
+    async with client.stream("POST", "/api/analyze/stream", data=FORM,
+                             files={"files": ("bill.txt", BILL_TEXT, "text/plain")}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.headers["cache-control"] == "no-cache"
+        body = "".join([chunk async for chunk in response.aiter_text()])
+    events = parse_events(body)
+    names = [event for event, _ in events]
+    assert names[:4] == ["files", "code_validation", "medicare_comparison", "ucr_validation"]
+    assert names[-2:] == ["summary", "done"]
+    assert set(names[4:-2]) == {"summary_delta"}
+    data = dict(events)
+    assert data["files"][0]["content_type"] == "text/plain"
+    assert [info["code"] for info in data["code_validation"]["valid_codes"]] == ["99213", "71045"]
+    assert data["ucr_validation"]["ucr_rates"] == {"99213": 100.0, "71045": 100.0}
+    assert {"code_validation", "medicare_comparison", "ucr_validation", "total"} <= set(data["done"]["latency"])
+
+async def test_errors_after_the_headers_arrive_as_an_error_event(client, monkeypatch):
+    async def failing(user_input):
+        yield "code_validation", {"valid_codes": []}
+        raise RuntimeError("Claude overloaded")
+
+    monkeypatch.setattr(main, "stream_medical_bill_analysis", failing)
+    response = await client.post("/api/analyze/stream", data=FORM,
+                                 files={"files": ("bill.txt", BILL_TEXT, "text/plain")})
+    assert [event for event, _ in parse_events(response.text)] == ["files", "code_validation", "error"]
+    assert parse_events(response.text)[-1][1] == {"detail": "Claude overloaded"}
+
+async def test_stream_rejects_requests_without_files(client):
+    response = await client.post("/api/analyze/stream", data=FORM)
+    assert response.status_code == 422
+
+async def test_a_summary_stream_without_a_result_ends_in_an_error_event(client, upstreams, monkeypatch):
+    from app.services import bill_analyzer
+
+    async def truncated(stage, prompt):
+        yield "delta", '{"summ'
+
+    monkeypatch.setattr(bill_analyzer, "stream_structured_with_claude", truncated)
+    response = await client.post("/api/analyze/stream", data=FORM,
+                                 files={"files": ("bill.txt", BILL_TEXT, "text/plain")})
+    events = parse_events(response.text)
+    assert [event for event, _ in events][-2:] == ["summary_delta", "error"]
+    assert events[-1][1] == {"detail": "The summary stream ended without a result"}
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+
+from app.services import claude
+from app.services.schemas import STAGE_TOOLS, CodeValidation, tool_definition
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture(scope="module")
+def invalid_stub():
+    """A stub whose first reply to every tool call leaves out the required fields"""
+    from benchmarks.stubs import spawn_server
+
+    base_url, process = spawn_server(latency=0, invalid_rate=1.0)
+    yield base_url
+    process.terminate()
+    process.wait()
+
+@pytest.fixture
+async def invalid_upstream(invalid_stub, upstreams, monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", invalid_stub)
+    monkeypatch.setattr(claude, "_client", None)
+    return invalid_stub
+
+def block(**fields):
+    return SimpleNamespace(**fields)
+
+@pytest.mark.parametrize("stage", list(STAGE_TOOLS))
+def test_every_stage_has_a_tool(stage):
+    tool = tool_definition(stage)
+    assert tool["name"] == f"record_{stage}"
+    assert tool["input_schema"]["type"] == "object"
+    request = claude._tool_request(stage, "content")
+    assert request["tool_choice"] == {"type": "tool", "name": tool["name"]}
+
+def test_tool_output_prefers_the_tool_call_and_falls_back_to_text():
+    tool_use = block(type="tool_use", id="toolu_1", name="record_code_validation", input={"valid_codes": []})
+    assert claude._tool_output(block(content=[block(type="text", text="thinking"), tool_use])) == (
+        tool_use, {"valid_codes": []})
+    text_reply = block(content=[block(type="text", text='Result: {"invalid_codes": ["9999X"]}')])
+    assert claude._tool_output(text_reply) == (None, {"invalid_codes": ["9999X"]})
+
+def test_repair_messages_name_the_invalid_fields():
+    try:
+        CodeValidation.model_validate({"valid_codes": [{"description": "no code"}]})
+    except ValidationError as e:
+        error = e
+    tool_use = block(type="tool_use", id="toolu_1", name="record_code_validation", input={"valid_codes": []})
+    messages = claude._repair_messages([{"role": "user", "content": "bill"}], tool_use, {}, error)
+    assert messages[1]["content"][0]["id"] == "toolu_1"
+    result = messages[2]["content"][0]
+    assert result["tool_use_id"] == "toolu_1" and result["is_error"] is True
+    assert "valid_codes.0.code: Field required" in result["content"]
+    messages = claude._repair_messages([], None, "not json", error)
+    assert messages[0] == {"role": "assistant", "content": "not json"}
+    assert "valid_codes.0.code" in messages[1]["content"]
+
+async def test_valid_replies_are_returned_as_validated_dicts(upstreams):
+    result = await claude.structured_with_claude("ucr_validation", "Bill 1")
+    assert set(result) == {"procedure_analysis", "overall_assessment", "recommendations"}
+    assert isinstance(result["procedure_analysis"][0]["billed_cost"], float)
+
+async def test_invalid_replies_are_repaired_once(invalid_upstream):
+    before = dict(claude.structured_metrics)
+    result = await claude.structured_with_claude("explanation", "Bill 2")
+    assert set(result) == {"summary", "code_validation", "ucr_validation", "overall_recommendation"}
+    assert claude.structured_metrics["invalid"] - before["invalid"] == 1
+    assert claude.structured_metrics["repairs"] - before["repairs"] == 1
+
+async def test_replies_still_invalid_after_the_retries_raise(invalid_upstream, monkeypatch):
+    monkeypatch.setattr(claude, "CLAUDE_REPAIR_RETRIES", 0)
+    with pytest.raises(ValidationError):
+        await claude.structured_with_claude("explanation", "Bill 3")
+    # Failures are not cached
+    monkeypatch.setattr(claude, "CLAUDE_REPAIR_RETRIES", 1)
+    assert "summary" in await claude.structured_with_claude("explanation", "Bill 3")
+
+async def test_streamed_tool_input_arrives_as_deltas_then_a_result(upstreams):
+    events = [event async for event in claude.stream_structured_with_claude("explanation", "Bill 4")]
+    kinds = [kind for kind, _ in events]
+    assert kinds[-1] == "result" and set(kinds[:-1]) == {"delta"} and len(kinds) > 2
+    assert "summary" in events[-1][1]
+    # A second request is answered from the response cache in one delta
+    cached = [event async for event in claude.stream_structured_with_claude("explanation", "Bill 4")]
+    assert [kind for kind, _ in cached] == ["delta", "result"]
+    assert cached[-1][1] == events[-1][1]
@@ -0,0 +1,153 @@
+import json
+import os
+import statistics
+
+import httpx
+import pytest
+from fastapi import FastAPI, Form
+from fastapi.responses import PlainTextResponse
+
+from app.services.schemas import tool_definition
+from benchmarks import bench_service
+from benchmarks.bench_service import compare, drive, percentile, process_usage
+from benchmarks.stubs import create_stub_app, example_from_schema, sample_latency, start_server
+
+pytestmark = pytest.mark.anyio
+
+def stub_client(**options):
+    app = create_stub_app(latency=0, **options)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stub")
+
+def tool_call(stage="code_validation", system="Check the codes."):
+    tool = tool_definition(stage)
+    return {
+        "model": "stub-model", "max_tokens": 100, "tools": [tool],
+        "tool_choice": {"type": "tool", "name": tool["name"]},
+        "system": [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}],
+        "messages": [{"role": "user", "content": "Bill"}],
+    }
+
+def test_example_from_schema_follows_refs_and_unions():
+    schema = {
+        "type": "object",
+        "properties": {
+            "items": {"type": "array", "items": {"$ref": "#/$defs/Item"}},
+            "note": {"anyOf": [{"type": "string"}, {"type": "null"}]},
+            "flag": {"type": "boolean"},
+        },
+        "$defs": {"Item": {"type": "object", "properties": {"code": {"type": "string"}, "cost": {"type": "number"},
+                                                            "units": {"type": "integer"}}}},
+    }
+    assert example_from_schema(schema) == {"items": [{"code": "stub", "cost": 100.0, "units": 1}],
+                                           "note": "stub", "flag": True}
+
+@pytest.mark.parametrize("distribution", ["gauss", "lognormal", "exponential"])
+def test_sampled_latencies_have_the_requested_mean(distribution):
+    samples = [sample_latency(0.2, 0.5 if distribution == "lognormal" else 0.05, distribution) for _ in range(20_000)]
+    assert min(samples) >= 0
+    assert statistics.mean(samples) == pytest.approx(0.2, rel=0.05)
+    assert sample_latency(0, 0, distribution) == 0.0
+
+async def test_forced_tool_calls_get_schema_valid_input():
+    async with stub_client() as http:
+        reply = (await http.post("/v1/messages", json=tool_call())).json()
+    assert reply["stop_reason"] == "tool_use"
+    tool_use = reply["content"][0]
+    assert tool_use["name"] == "record_code_validation"
+    assert set(tool_use["input"]) == set(tool_definition("code_validation")["input_schema"]["properties"])
+
+async def test_invalid_rate_spares_repair_attempts():
+    body = tool_call()
+    async with stub_client(invalid_rate=1.0) as http:
+        first = (await http.post("/v1/messages", json=body)).json()["content"][0]
+        assert first["input"] == {}
+        body["messages"] += [
+            {"role": "assistant", "content": [first]},
+            {"role": "user", "content": [{"type": "tool_result", "tool_use_id": first["id"], "content": "invalid"}]},
+        ]
+        repaired = (await http.post("/v1/messages", json=body)).json()["content"][0]
+    assert repaired["input"] != {}
+
+async def test_cached_prefixes_are_written_once_then_read():
+    body = tool_call()
+    async with stub_client(cache_min_tokens=10) as http:
+        first = (await http.post("/v1/messages", json=body)).json()["usage"]
+        second = (await http.post("/v1/messages", json=body)).json()["usage"]
+    assert first["cache_creation_input_tokens"] > 0 and first["cache_read_input_tokens"] == 0
+    assert second["cache_read_input_tokens"] == first["cache_creation_input_tokens"]
+    assert second["input_tokens"] == first["input_tokens"]
+    # Below the minimum nothing is cached
+    async with stub_client(cache_min_tokens=100_000) as http:
+        usage = (await http.post("/v1/messages", json=body)).json()["usage"]
+    assert usage["cache_creation_input_tokens"] == usage["cache_read_input_tokens"] == 0
+
+async def test_streamed_replies_carry_the_tool_input_in_deltas():
+    async with stub_client() as http:
+        response = await http.post("/v1/messages", json={**tool_call(), "stream": True})
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert events[0]["type"] == "message_start" and events[-1]["type"] == "message_stop"
+    partial = "".join(event["delta"]["partial_json"] for event in events if event["type"] == "content_block_delta")
+    assert set(json.loads(partial)) == set(tool_definition("code_validation")["input_schema"]["properties"])
+
+async def test_perplexity_and_nlm_answers():
+    async with stub_client() as http:
+        chat = await http.post("/chat/completions", json={
+            "model": "sonar", "messages": [{"role": "user", "content": 'Codes: ["99213", "71045"] in 10001'}]})
+        search = await http.get("/api/icd10cm/v3/search", params={"terms": "R109"})
+    content = json.loads(chat.json()["choices"][0]["message"]["content"])
+    assert content == {"ucr_rates": {"99213": 100.0, "71045": 100.0}}
+    assert search.json() == [1, ["R109"], None, [["R109", "Stub icd10cm code"]]]
+
+async def test_error_rate_returns_each_apis_overloaded_status():
+    async with stub_client(error_rate=1.0) as http:
+        messages = await http.post("/v1/messages", json=tool_call())
+        chat = await http.post("/chat/completions", json={"messages": [{"role": "user", "content": ""}]})
+        search = await http.get("/api/hcpcs/v3/search", params={"terms": "G0463"})
+    assert messages.status_code == 529 and messages.json()["error"]["type"] == "overloaded_error"
+    assert chat.status_code == 503 and search.status_code == 503
+
+def test_percentile():
+    ordered = list(range(1, 101))
+    assert (percentile(ordered, 0.5), percentile(ordered, 0.99), percentile(ordered, 1.0)) == (51, 100, 100)
+    assert percentile([], 0.5) is None
+
+async def test_drive_counts_latencies_and_errors_by_kind():
+    target = FastAPI()
+
+    @target.post("/ok")
+    async def ok(firstName: str = Form(...)):
+        return {"name": firstName}
+
+    @target.post("/stream")
+    async def stream():
+        return PlainTextResponse("event: error\ndata: {}\n\n")
+
+    base_url = start_server(target)
+    latencies, errors, elapsed = await drive(base_url, "/ok", [b"bill"], concurrency=3, requests=10)
+    assert len(latencies) == 10 and latencies == sorted(latencies) and errors == {}
+    _, errors, _ = await drive(base_url, "/stream", [b"bill"], concurrency=2, requests=4)
+    assert errors == {"error_event": 4}
+    _, errors, _ = await drive(base_url, "/missing", [b"bill"], concurrency=1, requests=2)
+    assert errors == {"http_404": 2}
+
+def test_process_usage_reads_proc():
+    cpu, rss_mb, peak_rss_mb = process_usage(os.getpid())
+    assert cpu > 0 and 0 < rss_mb <= peak_rss_mb
+
+def test_compare_reports_the_relative_change(tmp_path, capsys):
+    def result(p50, rate, concurrency=10):
+        return {"endpoint": "/api/analyze", "concurrency": concurrency, "p50_ms": p50, "p95_ms": p50 * 2,
+                "p99_ms": p50 * 3, "requests_per_sec": rate}
+
+    before, after = tmp_path / "before.json", tmp_path / "after.json"
+    before.write_text(json.dumps({"results": [result(100.0, 50.0)]}))
+    after.write_text(json.dumps({"results": [result(50.0, 100.0), result(10.0, 10.0, concurrency=99)]}))
+    compare(before, after)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert lines[1].split() == ["/api/analyze", "10", "-50%", "-50%", "-50%", "+100%"]
+
+def test_bills_are_distinct_and_priced_from_reference_codes():
+    bills = bench_service.make_bills(5, 3)
+    assert len(set(bills)) == 5
+    assert all(bill.startswith(b"Statement of charges\n") and bill.count(b"\n") == 4 for bill in bills)
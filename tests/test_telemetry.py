@@ -0,0 +1,102 @@
+import json
+import logging
+import threading
+
+import pytest
+
+from app.services import telemetry
+from app.services.telemetry import (
+    Counter, Histogram, JsonFormatter, http_request_seconds, new_request_id, register_collector, render_prometheus,
+    request_id_var,
+)
+
+@pytest.fixture
+def registry(monkeypatch):
+    """An empty metric registry, so test metrics stay out of /metrics"""
+    monkeypatch.setattr(telemetry, "_registry", [])
+    monkeypatch.setattr(telemetry, "_collectors", [])
+
+def test_request_ids_are_reused_only_when_sane():
+    assert new_request_id("abc-123") == "abc-123"
+    assert len(new_request_id(None)) == 32
+    assert new_request_id("x" * 129) != "x" * 129
+    assert new_request_id("bad\nid") != "bad\nid"
+
+def test_counter_shards_are_summed_across_threads(registry):
+    counter = Counter("test_total", "Things", ("kind",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(kind="a")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(2.5, kind="b")
+    assert counter.values() == {("a",): 4000, ("b",): 2.5}
+
+def test_histogram_buckets_and_quantiles(registry):
+    histogram = Histogram("test_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value, stage="x")
+    assert histogram.values() == {("x",): [2, 1, 1, 5.65]}
+    assert histogram.quantile(0.5, stage="x") == 0.1
+    assert histogram.quantile(0.75, stage="x") == 1.0
+    assert histogram.quantile(1.0, stage="x") == float("inf")
+    assert histogram.quantile(0.5, stage="unseen") is None
+
+def test_prometheus_exposition(registry):
+    counter = Counter("test_total", "Things counted", ("kind",))
+    histogram = Histogram("test_seconds", "Latency", (), buckets=(1.0,))
+    counter.inc(kind='say "hi"')
+    with histogram.time():
+        pass
+    register_collector(lambda: [("test_entries", "gauge", "Entries", [({"cache": "ucr"}, 3)])])
+    assert render_prometheus().splitlines() == [
+        "# HELP test_total Things counted",
+        "# TYPE test_total counter",
+        'test_total{kind="say \\"hi\\""} 1',
+        "# HELP test_seconds Latency",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="1.0"} 1',
+        'test_seconds_bucket{le="+Inf"} 1',
+        f"test_seconds_sum {histogram.values()[()][-1]!r}",
+        "test_seconds_count 1",
+        "# HELP test_entries Entries",
+        "# TYPE test_entries gauge",
+        'test_entries{cache="ucr"} 3',
+    ]
+
+def test_log_lines_are_json_tagged_with_the_request_id():
+    record = logging.LogRecord("advocare", logging.INFO, __file__, 1, "stage_failed", None, None)
+    record.fields = {"stage": "ucr_validation", "seconds": 1.5}
+    token = request_id_var.set("req-1")
+    try:
+        entry = json.loads(JsonFormatter().format(record))
+    finally:
+        request_id_var.reset(token)
+    assert entry["event"] == "stage_failed" and entry["level"] == "info"
+    assert entry["request_id"] == "req-1"
+    assert entry["stage"] == "ucr_validation" and entry["seconds"] == 1.5
+
+@pytest.mark.anyio
+async def test_requests_are_traced_and_timed_by_route(client):
+    def count():
+        values = http_request_seconds.values().get(("GET", "/api/codes/search", "200"))
+        return sum(values[:-1]) if values else 0
+
+    before = count()
+    response = await client.get("/api/codes/search", params={"q": "office visit"}, headers={"X-Request-ID": "trace-me"})
+    assert response.headers["X-Request-ID"] == "trace-me"
+    assert count() == before + 1
+    minted = await client.get("/healthz")
+    assert len(minted.headers["X-Request-ID"]) == 32
+
+@pytest.mark.anyio
+async def test_metrics_endpoint(client):
+    response = await client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE advocare_stage_seconds histogram" in response.text
+    assert "# TYPE advocare_http_request_seconds histogram" in response.text
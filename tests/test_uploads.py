@@ -0,0 +1,96 @@
+import hashlib
+import io
+import os
+import time
+
+import pytest
+from fastapi import UploadFile
+
+from app.services import uploads
+from app.services.uploads import (
+    UploadRejected, UploadTooLarge, ingest_uploads, purge_spool, sniff_content_type, spool_upload,
+)
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture(autouse=True)
+def spool_dir(tmp_path, monkeypatch):
+    path = tmp_path / "spool"
+    monkeypatch.setattr(uploads, "UPLOAD_SPOOL_DIR", path)
+    return path
+
+def upload(data, filename="bill.pdf"):
+    return UploadFile(io.BytesIO(data), filename=filename)
+
+@pytest.mark.parametrize("head, content_type", [
+    (b"%PDF-1.7\n...", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n\x00", "image/png"),
+    (b"\xff\xd8\xff\xe0", "image/jpeg"),
+    (b"II*\x00", "image/tiff"),
+    (b"99213 Office visit $150.00", "text/plain"),
+    # A multi-byte character cut off by the end of the sniffed prefix
+    ("Café".encode("utf-8")[:-1], "text/plain"),
+    (b"\x00\xff\xfe\x80 binary", "application/octet-stream"),
+])
+def test_content_type_is_sniffed_from_the_bytes(head, content_type):
+    assert sniff_content_type(head) == content_type
+
+async def test_uploads_are_spooled_in_chunks_under_their_hash(spool_dir, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 1000)
+    data = b"%PDF-1.4\n" + os.urandom(10_000)
+    spooled = await spool_upload(upload(data))
+    assert spooled.sha256 == hashlib.sha256(data).hexdigest()
+    assert spooled.path == spool_dir / spooled.sha256
+    assert (spooled.size, spooled.content_type, spooled.filename) == (len(data), "application/pdf", "bill.pdf")
+    with spooled.view() as view:
+        assert bytes(view) == data
+    # The same content again reuses the spooled copy
+    again = await spool_upload(upload(data, "copy.pdf"))
+    assert again.path == spooled.path
+    assert sorted(path.name for path in spool_dir.iterdir()) == [spooled.sha256]
+
+async def test_empty_uploads_have_an_empty_view():
+    spooled = await spool_upload(upload(b"", "empty.txt"))
+    with spooled.view() as view:
+        assert bytes(view) == b""
+
+async def test_oversized_files_are_rejected_and_leave_nothing_behind(spool_dir):
+    with pytest.raises(UploadTooLarge, match="big.pdf"):
+        await spool_upload(upload(b"x" * 101, "big.pdf"), max_bytes=100)
+    assert list(spool_dir.iterdir()) == []
+
+async def test_request_limits(monkeypatch):
+    with pytest.raises(UploadRejected, match="No files"):
+        await ingest_uploads([])
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_FILES", 2)
+    with pytest.raises(UploadRejected, match="Maximum 2 files"):
+        await ingest_uploads([upload(b"a"), upload(b"b"), upload(b"c")])
+    # The request total caps the files together
+    with pytest.raises(UploadTooLarge):
+        await ingest_uploads([upload(b"a" * 60), upload(b"b" * 60)], max_request_bytes=100)
+    spooled = await ingest_uploads([upload(b"a" * 50), upload(b"b" * 50)], max_request_bytes=100)
+    assert [item.size for item in spooled] == [50, 50]
+
+async def test_purge_spool_removes_only_stale_files(spool_dir):
+    fresh = await spool_upload(upload(b"fresh"))
+    stale = await spool_upload(upload(b"stale"))
+    old = time.time() - 3600
+    os.utime(stale.path, (old, old))
+    assert purge_spool(max_age=60) == 1
+    assert [path.name for path in spool_dir.iterdir()] == [fresh.sha256]
+
+async def test_oversized_requests_are_refused_before_parsing(client, monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main, "MAX_REQUEST_UPLOAD_BYTES", 100)
+    response = await client.post("/api/analyze", data={"firstName": "J", "lastName": "D", "dateOfBirth": "1990-01-01"},
+                                 files={"files": ("bill.pdf", b"x" * 200, "application/pdf")})
+    assert response.status_code == 413
+
+async def test_upload_limit_errors_map_to_http_statuses(client, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 10)
+    form = {"firstName": "J", "lastName": "D", "dateOfBirth": "1990-01-01"}
+    response = await client.post("/api/analyze/stream", data=form,
+                                 files={"files": ("bill.pdf", b"x" * 20, "application/pdf")})
+    assert response.status_code == 413
+    assert "bill.pdf" in response.json()["detail"]
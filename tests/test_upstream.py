@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from app.services.upstream import CircuitOpen, TokenBucket, Upstream, retry_after
+
+pytestmark = pytest.mark.anyio
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers or {}})()
+
+@pytest.fixture
+def make_upstream(monkeypatch):
+    monkeypatch.setenv("TESTUP_BACKOFF_BASE", "0.001")
+    monkeypatch.setenv("TESTUP_BREAKER_RESET", "60")
+
+    def make(**kwargs):
+        return Upstream("test", "TESTUP", **kwargs)
+    return make
+
+def flaky(*outcomes):
+    """A call returning or raising each outcome in turn, recording how often it ran"""
+    calls = []
+
+    async def call():
+        outcome = outcomes[len(calls)]
+        calls.append(1)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    return call, calls
+
+async def test_transient_failures_are_retried(make_upstream):
+    upstream = make_upstream(max_retries=2)
+    call, calls = flaky(StatusError(529), ConnectionError(), "ok")
+    assert await upstream.call(call) == "ok"
+    assert len(calls) == 3
+
+async def test_retries_stop_at_max_retries(make_upstream):
+    upstream = make_upstream(max_retries=1)
+    call, calls = flaky(StatusError(503), StatusError(503), "ok")
+    with pytest.raises(StatusError):
+        await upstream.call(call)
+    assert len(calls) == 2
+
+async def test_client_errors_are_not_retried_and_do_not_trip_the_breaker(make_upstream):
+    upstream = make_upstream(max_retries=3)
+    call, calls = flaky(StatusError(400), "ok")
+    with pytest.raises(StatusError):
+        await upstream.call(call)
+    assert len(calls) == 1
+    assert upstream.breaker.failures == 0
+
+async def test_breaker_opens_after_consecutive_failures(make_upstream):
+    upstream = make_upstream(max_retries=0)
+    for _ in range(upstream.breaker.failure_threshold):
+        call, _ = flaky(StatusError(500))
+        with pytest.raises(StatusError):
+            await upstream.call(call)
+    assert upstream.breaker.state == "open"
+    call, calls = flaky("ok")
+    with pytest.raises(CircuitOpen):
+        await upstream.call(call)
+    assert not calls
+
+async def test_throttling_halves_the_rate(make_upstream):
+    upstream = make_upstream(requests_per_minute=600, max_retries=1)
+    call, _ = flaky(StatusError(429), "ok")
+    assert await upstream.call(call) == "ok"
+    # Halved by the 429, then one recovery step for the success
+    assert upstream.bucket.rate == pytest.approx(10 / 2 + 10 / 20)
+
+async def test_slow_call_is_hedged_and_the_loser_cancelled(make_upstream):
+    upstream = make_upstream(hedge_after=0.01)
+    started = []
+    cancelled = []
+
+    async def call():
+        attempt = len(started)
+        started.append(attempt)
+        try:
+            await asyncio.sleep(1 if attempt == 0 else 0)
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return attempt
+
+    assert await upstream.call(call, hedge=True) == 1
+    await asyncio.sleep(0)
+    assert cancelled == [0]
+
+@pytest.mark.parametrize("hedge_after, attempts", [(1.0, 1), (0.01, 2)])
+async def test_cancelling_the_caller_cancels_every_attempt(make_upstream, hedge_after, attempts):
+    upstream = make_upstream(hedge_after=hedge_after)
+    running = set()
+
+    async def call():
+        task = asyncio.current_task()
+        running.add(task)
+        await asyncio.sleep(10)
+
+    caller = asyncio.create_task(upstream.call(call, hedge=True))
+    await asyncio.sleep(0.05)
+    assert len(running) == attempts
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    await asyncio.sleep(0)
+    assert all(task.cancelled() for task in running)
+
+def test_token_bucket_allows_a_burst_then_waits():
+    bucket = TokenBucket(rate=1, burst=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+def test_retry_after_headers():
+    assert retry_after(StatusError(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(StatusError(429, {"retry-after": "3"})) == 3.0
+    assert retry_after(StatusError(429)) is None